@@ -0,0 +1,143 @@
+"""
+Admission control for the image search API
+
+Each endpoint class (search, ingest) gets an AdmissionController: at most ``max_concurrent``
+requests run at once, at most ``max_queue`` more wait for a slot, and anything beyond that is
+turned away immediately instead of piling up CPU work until every request times out:
+
+- queue full -> 429 Too Many Requests
+- waited longer than ``queue_timeout`` seconds for a slot -> 503 Service Unavailable
+
+Both carry a ``Retry-After`` header estimated from the queue length and recent service times.
+Controllers live on the event loop (no locks needed); the work they admit must not block the
+loop, or waiting requests could not be rejected in time.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+DEFAULT_QUEUE_TIMEOUT = 5.0
+# Weight of the latest request in the service time average
+SERVICE_TIME_ALPHA = 0.2
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    """A request was not admitted; ``status`` is 429 or 503"""
+
+    def __init__(self, name: str, status: int, retry_after: int, reason: str):
+        super().__init__(f"{name}: {reason}")
+        self.name = name
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded FIFO wait queue
+
+    Usage:
+        search_admission = AdmissionController("search", max_concurrent=2, max_queue=16)
+        async with search_admission.admit():
+            ...   # raises Overloaded if the request is not admitted
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT, initial_service_seconds: float = 1.0):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._service_seconds = initial_service_seconds
+        self._counts = {"admitted": 0, "waited": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "completed": 0}
+        self._max_wait_seconds = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        backlog = (self.queued + self.in_flight) / self.max_concurrent
+        seconds = math.ceil(backlog * self._service_seconds)
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, seconds))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "avg_service_seconds": round(self._service_seconds, 3),
+            "max_wait_seconds": round(self._max_wait_seconds, 3),
+            **self._counts,
+        }
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self._counts["admitted"] += 1
+            return
+        if self.queued >= self.max_queue:
+            self._counts["rejected_queue_full"] += 1
+            raise Overloaded(self.name, 429, self.retry_after(), "too many requests waiting")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._counts["waited"] += 1
+        start = time.perf_counter()
+        try:
+            # A released slot is handed over to the waiter (in_flight is not decremented)
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived as the wait timed out: pass it on
+                self._release_slot()
+            else:
+                waiter.cancel()
+            self._counts["rejected_timeout"] += 1
+            raise Overloaded(self.name, 503, self.retry_after(), f"no capacity within {self.queue_timeout:g}s")
+        except asyncio.CancelledError:
+            # Client went away while waiting
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self._max_wait_seconds = max(self._max_wait_seconds, time.perf_counter() - start)
+        self._counts["admitted"] += 1
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        if service_seconds is not None:
+            self._service_seconds += SERVICE_TIME_ALPHA * (service_seconds - self._service_seconds)
+        self._counts["completed"] += 1
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
@@ -0,0 +1,164 @@
+"""
+Product-level aggregation of image search results
+
+Every product image is its own vector, so one product with many photos can fill the top-k.
+Matches are grouped by product (catalog assets without a product form their own group) and
+each group is scored by its best match ("max") or the mean of its matches ("mean").
+
+Optionally, one centroid vector per group is kept in a separate Pinecone namespace, together
+with the norm of the (unnormalized) mean of its image vectors. For a normalized query q,
+q . mean = (q . centroid) * norm is exactly the group's mean cosine similarity, so querying
+k * COARSE_FACTOR centroids and re-ranking them by that product gives k distinct products
+scored as in "mean" mode, instead of an image over-fetch that grows with the number of
+photos per product. Max scoring cannot be recovered from a centroid and always uses images.
+
+Backfill the centroids from an embedding store snapshot (see embedding_store.py):
+    python aggregation.py --store embeddings/furniture
+"""
+
+import argparse
+import logging
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION_MODES = ("max", "mean")
+CENTROID_NAMESPACE = "product-centroids"
+# Centroids fetched per requested product (the centroid ranking differs from the mean-score
+# ranking by each group's norm, so a few extra candidates are re-ranked)
+COARSE_FACTOR = 2
+# Result fields copied onto a centroid from the image closest to it
+REPRESENTATIVE_FIELDS = ("product_id", "product_name", "filepath", "filename", "image_size", "category", "subcategory")
+
+
+def group_key(metadata: Dict[str, Any], vector_id: str = "") -> str:
+    """Product a vector belongs to; catalog assets without a product are their own group"""
+    if metadata.get("product_id") not in (None, ""):
+        return f"product:{metadata['product_id']}"
+    if metadata.get("filepath"):
+        return f"file:{metadata['filepath']}"
+    return f"id:{vector_id}"
+
+
+def aggregate(items: Sequence[Any], mode: str, top_k: int,
+              score: Callable[[Any], float], key: Callable[[Any], str]) -> List[Dict[str, Any]]:
+    """
+    Collapse scored items into groups, best groups first
+
+    Returns:
+        [{"key", "score", "best": highest-scoring item, "count"}] for the top_k groups
+    """
+    if mode not in AGGREGATION_MODES:
+        raise ValueError(f"Aggregation mode must be one of {AGGREGATION_MODES}, got {mode!r}")
+    groups: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        group = groups.setdefault(key(item), {"key": key(item), "scores": [], "best": item})
+        group["scores"].append(score(item))
+        if score(item) > score(group["best"]):
+            group["best"] = item
+    ranked = []
+    for group in groups.values():
+        scores = group.pop("scores")
+        group["score"] = float(max(scores)) if mode == "max" else float(np.mean(scores))
+        group["count"] = len(scores)
+        ranked.append(group)
+    ranked.sort(key=lambda g: g["score"], reverse=True)
+    return ranked[:top_k]
+
+
+def centroid_record(key: str, ids: Sequence[str], vectors, metadata: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Pinecone vector for one group's centroid
+
+    The metadata carries the group's image count, the norm of its mean vector and the result
+    fields of its most central image, so a centroid match can be returned as a result as is.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    mean = vectors.mean(axis=0)
+    norm = float(np.linalg.norm(mean))
+    representative = int(np.argmax(vectors @ mean))
+    fields = {"group_key": key, "image_count": len(ids), "mean_norm": norm, "representative_id": str(ids[representative])}
+    for name in REPRESENTATIVE_FIELDS:
+        if metadata[representative].get(name) not in (None, ""):
+            fields[name] = metadata[representative][name]
+    return {"id": f"centroid:{key}", "values": (mean / max(norm, 1e-12)).tolist(), "metadata": fields}
+
+
+def upsert_centroid(index, key: str, ids: Sequence[str], vectors, metadata: Sequence[Dict[str, Any]]) -> None:
+    """Replace the centroid of one group (e.g. after a product's images were indexed)"""
+    index.upsert(vectors=[centroid_record(key, ids, vectors, metadata)], namespace=CENTROID_NAMESPACE)
+
+
+def centroid_candidates(index, embedding, top_k: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    One match per group from the centroid namespace, scored by the group's mean similarity
+
+    Returns:
+        Matches shaped like image matches (id of the most central image, metadata with
+        ``image_count``), best first; None when no centroids are indexed
+    """
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    response = index.query(vector=vector.tolist(), top_k=top_k * COARSE_FACTOR, include_metadata=True,
+                           namespace=CENTROID_NAMESPACE)
+    matches = response.get("matches", [])
+    if not matches:
+        return None
+    candidates = []
+    for match in matches:
+        metadata = dict(match.get("metadata", {}) or {})
+        score = float(match.get("score", 0.0)) * float(metadata.pop("mean_norm", 1.0))
+        vector_id = metadata.pop("representative_id", match.get("id", ""))
+        candidates.append({"id": vector_id, "score": score, "metadata": metadata})
+    candidates.sort(key=lambda m: m["score"], reverse=True)
+    return candidates
+
+
+def build_centroids(ids: Sequence[str], vectors, metadata: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Centroid records for every group in a set of vectors"""
+    members: Dict[str, List[int]] = {}
+    for i, (vector_id, meta) in enumerate(zip(ids, metadata)):
+        members.setdefault(group_key(meta, vector_id), []).append(i)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return [
+        centroid_record(key, [ids[i] for i in rows], vectors[rows], [metadata[i] for i in rows])
+        for key, rows in members.items()
+    ]
+
+
+def main():
+    """Backfill the centroid namespace from an embedding store snapshot"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build per-product centroid vectors in Pinecone")
+    parser.add_argument("--store", required=True, help="Embedding store snapshot (export_embeddings.py)")
+    args = parser.parse_args()
+
+    from pinecone import Pinecone
+    from config import PINECONE_API_KEY, PINECONE_INDEX_NAME, UPSERT_OPTIONS
+    from embedding_store import EmbeddingStore
+    from upsert_writer import upsert_all
+
+    try:
+        store = EmbeddingStore(args.store)
+        records = build_centroids(
+            [str(v) for v in store.ids],
+            np.asarray(store.vectors, dtype=np.float32),
+            [store.metadata(i) for i in range(len(store))],
+        )
+        index = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+        report = upsert_all(index, records, namespace=CENTROID_NAMESPACE, **UPSERT_OPTIONS)
+        if report["failed"]:
+            raise RuntimeError(f"{report['failed']} centroids failed; resume with upsert_writer.py --resume {report['spill_path']}")
+        logger.info(f"✅ Upserted {len(records)} centroids for {len(store)} vectors into namespace '{CENTROID_NAMESPACE}' "
+                    f"({report['vectors_per_second']:.0f} vectors/s)")
+    except Exception as e:
+        logger.error(f"❌ Error building centroids: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,6 @@ import logging
 from io import BytesIO
 from PIL import Image
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from pinecone import Pinecone
 from dotenv import load_dotenv
 
@@ -28,8 +27,12 @@ from config import (
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
     CLIP_MODEL_NAME,
-    MAX_IMAGE_SIZE
+    CLIP_LOAD_MODE,
+    MAX_IMAGE_SIZE,
+    UPSERT_OPTIONS
 )
+from upsert_writer import upsert_all
+from vision_encoder import load_image_model
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -42,8 +45,7 @@ def get_model():
     """Get or load CLIP model (singleton)"""
     global _model
     if _model is None:
-        logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
-        _model = SentenceTransformer(CLIP_MODEL_NAME)
+        _model = load_image_model(CLIP_LOAD_MODE, CLIP_MODEL_NAME)
         logger.info("CLIP model loaded")
     return _model
 
@@ -150,7 +152,7 @@ def add_product_to_pinecone(product_id, product_name, category, subcategory, ima
         
         # Upsert to Pinecone
         if vectors_to_upsert:
-            index.upsert(vectors=vectors_to_upsert)
+            added_count -= upsert_all(index, vectors_to_upsert, **UPSERT_OPTIONS)["failed"]
             logger.info(f"✅ Added {added_count} image embeddings for product {product_id} ({product_name})")
         
         return added_count
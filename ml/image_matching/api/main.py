@@ -5,18 +5,19 @@ Accepts image uploads, generates CLIP embeddings, and queries Pinecone
 
 import os
 import sys
+import threading
 from pathlib import Path
 from typing import List, Optional
 import logging
 from io import BytesIO
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from PIL import Image
 import numpy as np
-from sentence_transformers import SentenceTransformer, util as st_utils
 from pinecone import Pinecone
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
@@ -42,7 +43,54 @@ from config import (
     PINECONE_ENVIRONMENT,
     PINECONE_INDEX_NAME,
     CLIP_MODEL_NAME,
-    MAX_IMAGE_SIZE
+    CLIP_LOAD_MODE,
+    PROMPT_EMBEDDINGS_PATH,
+    MAX_IMAGE_SIZE,
+    DEDUP_ENABLED,
+    DEDUP_THRESHOLD,
+    DEDUP_SCOPE,
+    PRODUCT_CENTROIDS_ENABLED,
+    SEARCH_BACKEND,
+    LOCAL_INDEX_PATH,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    LOCAL_INDEX_SAVE_EVERY,
+    LOCAL_INDEX_COMPACT_AT,
+    LOCAL_INDEX_PROJECTION,
+    INGEST_BATCH_IMAGES,
+    INGEST_MAX_QUEUED_JOBS,
+    INFERENCE_SLOTS,
+    INFERENCE_SHARES,
+    INFERENCE_BULK_CHUNK,
+    HASH_FAST_PATH_ENABLED,
+    HASH_INDEX_PATH,
+    HASH_MAX_DISTANCE,
+    ADMISSION_SEARCH_CONCURRENCY,
+    ADMISSION_SEARCH_QUEUE,
+    ADMISSION_SEARCH_QUEUE_TIMEOUT,
+    ADMISSION_INGEST_CONCURRENCY,
+    ADMISSION_INGEST_QUEUE,
+    ADMISSION_INGEST_QUEUE_TIMEOUT,
+    UPSERT_OPTIONS
+)
+from dedup import DuplicateCollapser
+from aggregation import AGGREGATION_MODES, aggregate, centroid_candidates, group_key, upsert_centroid
+from local_index import LocalIndex
+from projection import load_components
+from ingest_queue import IngestQueue, QueueFull
+from admission import AdmissionController, Overloaded
+from inference_scheduler import InferenceScheduler, INTERACTIVE, BULK, PRIORITIES
+from phash import HashIndex, image_hashes
+from upsert_writer import upsert_all
+from vision_encoder import load_image_model
+from prompt_embeddings import (
+    FURNITURE_TYPE_PROMPTS,
+    SOFA_PROMPTS,
+    FURNITURE_PROMPTS,
+    NON_FURNITURE_PROMPTS,
+    PromptEmbeddings,
+    load_or_compute
 )
 
 # Setup logging
@@ -53,24 +101,49 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
  # Global model and Pinecone index (loaded on startup)
-model: Optional[SentenceTransformer] = None
+# SentenceTransformer, or VisionEncoder with CLIP_LOAD_MODE=vision
+model = None
+prompt_embeddings: Optional[PromptEmbeddings] = None
+# Every model call is scheduled by priority class: interactive > recommendation > bulk
+inference = InferenceScheduler(INFERENCE_SHARES, slots=INFERENCE_SLOTS)
+# Perceptual hashes of indexed images, checked before running CLIP on an upload
+hash_index: Optional[HashIndex] = None
+hash_fast_path_lock = threading.Lock()
+hash_fast_path_counts = {"served": 0, "fallbacks": 0}
 pinecone_index = None
+ingest_queue: Optional[IngestQueue] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events"""
     # Startup
-    global model, pinecone_index
+    global model, prompt_embeddings, pinecone_index, ingest_queue, hash_index
     
     try:
-        logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
-        model = SentenceTransformer(CLIP_MODEL_NAME)
-        logger.info("CLIP model loaded successfully")
+        model = load_image_model(CLIP_LOAD_MODE, CLIP_MODEL_NAME)
+        logger.info(f"CLIP model loaded successfully ({CLIP_LOAD_MODE} mode)")
         logger.info(f"Model embedding dimension: {model.get_sentence_embedding_dimension()}")
+        # Text prompts are encoded once, not on every request
+        prompt_embeddings = load_or_compute(PROMPT_EMBEDDINGS_PATH, model)
         
-        # Initialize Pinecone
-        if not PINECONE_API_KEY:
+        # Initialize the vector index
+        if SEARCH_BACKEND == "local":
+            logger.info(f"Opening local HNSW index at {LOCAL_INDEX_PATH}...")
+            projection = load_components(LOCAL_INDEX_PROJECTION) if LOCAL_INDEX_PROJECTION else None
+            if projection is not None:
+                logger.info(f"Graph search walks {len(projection)} projected dimensions ({LOCAL_INDEX_PROJECTION})")
+            pinecone_index = LocalIndex(
+                LOCAL_INDEX_PATH,
+                M=HNSW_M,
+                ef_construction=HNSW_EF_CONSTRUCTION,
+                ef_search=HNSW_EF_SEARCH,
+                save_every=LOCAL_INDEX_SAVE_EVERY,
+                compact_at=LOCAL_INDEX_COMPACT_AT,
+                projection=projection
+            )
+            logger.info(f"Local index ready: {pinecone_index.describe_index_stats()['total_vector_count']} vectors")
+        elif not PINECONE_API_KEY:
             logger.warning("PINECONE_API_KEY not found in environment variables. Pinecone features will be disabled.")
             logger.warning("To enable Pinecone, set PINECONE_API_KEY in .env file")
             pinecone_index = None
@@ -85,6 +158,18 @@ async def lifespan(app: FastAPI):
                 logger.warning("Service will start but image search will not work until Pinecone is configured")
                 pinecone_index = None
         
+        if HASH_FAST_PATH_ENABLED:
+            hash_index = HashIndex.load(HASH_INDEX_PATH, HASH_MAX_DISTANCE)
+            logger.info(f"Hash fast path: {len(hash_index)} catalog image hashes loaded")
+        
+        # Image ingestion runs in the background, off the request path
+        ingest_queue = IngestQueue(
+            process_ingest_batch,
+            batch_images=INGEST_BATCH_IMAGES,
+            max_queued=INGEST_MAX_QUEUED_JOBS
+        )
+        ingest_queue.start()
+        
     except Exception as e:
         logger.error(f"Error during startup: {e}")
         # Don't raise - allow service to start even if model loading fails
@@ -95,6 +180,15 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down image search service...")
+    if ingest_queue is not None:
+        ingest_queue.stop(timeout=60)
+        pending = ingest_queue.stats()["queue_depth"]
+        if pending:
+            logger.warning(f"{pending} queued ingest jobs were not processed; re-run the image search reindex")
+    if isinstance(pinecone_index, LocalIndex):
+        pinecone_index.save()
+    if hash_index is not None:
+        hash_index.save(HASH_INDEX_PATH)
 
 
 # Initialize FastAPI app
@@ -114,6 +208,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Same-image path of the search endpoints: a best match at or above SAME_IMAGE_THRESHOLD means
+# the upload is (nearly) a catalog image; all furniture above SAME_IMAGE_MIN_MATCH is returned
+SAME_IMAGE_THRESHOLD = 0.76
+SAME_IMAGE_MIN_MATCH = 0.58
+
+# Admission control: bounded concurrency and wait queue per endpoint class, so a traffic
+# spike turns some requests away quickly instead of timing out all of them
+ADMISSION = {
+    "search": AdmissionController(
+        "search", ADMISSION_SEARCH_CONCURRENCY, ADMISSION_SEARCH_QUEUE, ADMISSION_SEARCH_QUEUE_TIMEOUT
+    ),
+    "ingest": AdmissionController(
+        "ingest", ADMISSION_INGEST_CONCURRENCY, ADMISSION_INGEST_QUEUE, ADMISSION_INGEST_QUEUE_TIMEOUT
+    ),
+}
+ADMISSION_ROUTES = {
+    ("POST", "/search-by-image"): "search",
+    ("POST", "/search-by-image-base64"): "search",
+    ("POST", "/add-product"): "ingest",
+}
+
+
+def overload_response(status_code: int, detail: str, retry_after: int, **extra) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail, "retry_after": retry_after, **extra},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Admit requests of rate-limited endpoint classes before their body is read"""
+    endpoint_class = ADMISSION_ROUTES.get((request.method, request.url.path))
+    if endpoint_class is None:
+        return await call_next(request)
+    controller = ADMISSION[endpoint_class]
+    try:
+        async with controller.admit():
+            return await call_next(request)
+    except Overloaded as e:
+        logger.warning(f"⚠️ Rejected {request.method} {request.url.path} with {e.status}: {e.reason} "
+                       f"(in flight {controller.in_flight}, queued {controller.queued})")
+        return overload_response(
+            e.status,
+            f"Image search service is busy ({e.reason}). Retry after {e.retry_after}s.",
+            e.retry_after,
+            endpoint_class=endpoint_class
+        )
+
+
 # High-level furniture type definitions for classification + filtering
 FURNITURE_TYPES = {
     "bed": ["bed", "bunk", "cot", "king", "queen", "single", "double", "mattress", "headboard"],
@@ -130,26 +275,6 @@ FURNITURE_TYPES = {
     "study": ["study", "office", "work", "workstation", "computer"]
 }
 
-# Sofa gets multiple prompts so the model predicts "sofa" more reliably for sofa images
-FURNITURE_TYPE_PROMPTS = {
-    "bed": "a photo of a bed",
-    "chair": "a photo of a chair",
-    "sofa": "a photo of a sofa",  # Primary; sofa also boosted in predict_furniture_type
-    "table": "a photo of a table",
-    "bookshelf": "a photo of a bookshelf",
-    "wardrobe": "a photo of a wardrobe",
-    "dining": "a photo of a dining table",
-    "study": "a photo of a study table"
-}
-SOFA_PROMPTS = [
-    "a photo of a sofa",
-    "a photo of a couch",
-    "a photo of a two seater sofa",
-    "a photo of a three seater sofa",
-    "a photo of a living room sofa",
-]
-
-
 class SearchResult(BaseModel):
     """Model for search result"""
     id: str
@@ -160,6 +285,7 @@ class SearchResult(BaseModel):
     category: Optional[str] = None
     product_id: Optional[str] = None  # For products added via admin
     product_name: Optional[str] = None  # For products added via admin
+    match_count: Optional[int] = None  # Images of this product that matched (aggregated searches)
 
 
 class SearchResponse(BaseModel):
@@ -193,7 +319,15 @@ async def health_check():
         "status": status,
         "model_loaded": model is not None,
         "pinecone_connected": pinecone_index is not None,
+        "search_backend": SEARCH_BACKEND,
+        "local_index": pinecone_index.tier_stats() if isinstance(pinecone_index, LocalIndex) else None,
+        "ingest_queue": ingest_queue.stats() if ingest_queue is not None else None,
+        "admission": {name: controller.stats() for name, controller in ADMISSION.items()},
+        "inference": inference.stats(),
+        "hash_fast_path": hash_fast_path_stats(),
         "model_name": CLIP_MODEL_NAME if model else None,
+        "model_load_mode": CLIP_LOAD_MODE if model else None,
+        "prompt_embeddings": len(prompt_embeddings.prompts) if prompt_embeddings is not None else 0,
         "index_name": PINECONE_INDEX_NAME if pinecone_index else None,
         "message": "Service is running" if model else "Model not loaded - check logs"
     }
@@ -206,15 +340,20 @@ class AddProductRequest(BaseModel):
     category: str
     subcategory: Optional[str] = None
     images: List[dict]  # List of {data, filename, contentType}
+    dedup: bool = True  # Collapse near-duplicates of this product's indexed images into aliases
 
 
-@app.post("/add-product")
+@app.post("/add-product", status_code=202)
 async def add_product_to_search(request: AddProductRequest):
     """
-    Add a product's images to Pinecone for image search
-    Called automatically when a new product is created
+    Queue a product's images for indexing in Pinecone
+    Called automatically when a product is created or updated
+    
+    Returns 202 with a job ID right away; the ingest worker embeds the images in the
+    background (see ingest_queue.py). A queued job for the same product is replaced, so
+    repeated edits are only embedded once. Poll GET /add-product/jobs/{job_id} for the result.
     """
-    if model is None or pinecone_index is None:
+    if model is None or pinecone_index is None or ingest_queue is None:
         raise HTTPException(
             status_code=503,
             detail="Service not ready. Model or Pinecone not initialized."
@@ -222,87 +361,222 @@ async def add_product_to_search(request: AddProductRequest):
     
     # Only process furniture products
     if request.category != 'furniture':
-        return {
+        return JSONResponse(content={
             "success": True,
             "message": f"Product category '{request.category}' not indexed for image search",
             "embeddings_added": 0
-        }
+        })
     
     if not request.images or len(request.images) == 0:
-        return {
+        return JSONResponse(content={
             "success": True,
             "message": "No images provided",
             "embeddings_added": 0
-        }
+        })
     
     try:
-        import base64
-        from PIL import Image
-        from io import BytesIO
-        
-        vectors_to_upsert = []
-        added_count = 0
-        
-        # Process each image using the same preprocessing as search-by-image for consistent embeddings
-        for idx, image_obj in enumerate(request.images):
-            try:
-                image_data = image_obj.get('data', '')
-                if not image_data:
-                    continue
-                
-                # Decode base64 image
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                
-                image_bytes = base64.b64decode(image_data)
-                image = preprocess_image(image_bytes)  # Same pipeline as search so same image => same embedding
-                
-                # Generate embedding
-                embedding = model.encode(image, convert_to_numpy=True)
-                
-                # Create metadata
-                filename = image_obj.get('filename', f'product_{request.product_id}_img_{idx}.jpg')
-                metadata = {
-                    "filename": filename,
-                    "category": request.category,
-                    "subcategory": request.subcategory or "",
-                    "product_id": str(request.product_id),
-                    "product_name": request.product_name,
-                    "image_index": idx
-                }
-                
-                # Create unique vector ID
-                vector_id = f"product_{request.product_id}_img_{idx}_{hash(filename)}"
-                
-                vectors_to_upsert.append({
-                    "id": vector_id,
-                    "values": embedding.tolist(),
-                    "metadata": metadata
-                })
-                
-                added_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error processing image {idx} for product {request.product_id}: {e}")
+        job = ingest_queue.submit(str(request.product_id), request, image_count=len(request.images))
+    except QueueFull as e:
+        logger.warning(f"⚠️ Ingest queue full ({e.queue_depth} jobs); product {request.product_id} not queued")
+        return overload_response(429, str(e), e.retry_after, queue_depth=e.queue_depth)
+    queue_stats = ingest_queue.stats()
+    logger.info(f"Queued {len(request.images)} images for product {request.product_id} as job {job['job_id']}"
+                + (f" (replaced {job['replaced_job_id']})" if job["coalesced"] else ""))
+    return {
+        "success": True,
+        "message": f"Queued {len(request.images)} images for image search indexing",
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "coalesced": job["coalesced"],
+        "replaced_job_id": job["replaced_job_id"],
+        "queue_depth": queue_stats["queue_depth"]
+    }
+
+
+@app.get("/add-product/jobs/{job_id}")
+async def add_product_job_status(job_id: str):
+    """Status of an ingest job: queued, running, done (with the indexing result), failed or superseded"""
+    job = ingest_queue.status(job_id) if ingest_queue is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job
+
+
+@app.get("/admission")
+async def admission_stats():
+    """In-flight and queued requests, and rejections, per endpoint class"""
+    return {name: controller.stats() for name, controller in ADMISSION.items()}
+
+
+@app.get("/add-product/queue")
+async def add_product_queue_stats():
+    """Ingest queue depth and job counters"""
+    if ingest_queue is None:
+        raise HTTPException(status_code=503, detail="Ingest queue not running")
+    return ingest_queue.stats()
+
+
+def decode_product_images(request: AddProductRequest) -> list:
+    """(index, image object, preprocessed image) for every decodable image of a request"""
+    import base64
+    
+    decoded = []
+    for idx, image_obj in enumerate(request.images):
+        try:
+            image_data = image_obj.get('data', '')
+            if not image_data:
                 continue
+            
+            # Decode base64 image
+            if ',' in image_data:
+                image_data = image_data.split(',')[1]
+            
+            image_bytes = base64.b64decode(image_data)
+            # Same pipeline as search so same image => same embedding
+            decoded.append((idx, image_obj, preprocess_image(image_bytes)))
+        except Exception as e:
+            logger.error(f"Error processing image {idx} for product {request.product_id}: {e}")
+    return decoded
+
+
+def index_product_images(request: AddProductRequest, embedded: list) -> dict:
+    """
+    Upsert a product's embedded images and refresh its centroid
+    
+    Images at least DEDUP_THRESHOLD cosine-similar to an indexed image of the same product
+    (or to an earlier image of this request) are not upserted; they are recorded as aliases
+    on that vector. DEDUP_SCOPE=global also collapses into other products' images. An image
+    already indexed in the same slot is not upserted again; its metadata is updated in place.
+    The product's perceptual hashes are replaced by those of these images.
+    
+    Args:
+        embedded: (index, image object, embedding, perceptual hashes) per image
+    """
+    vectors_to_upsert = []
+    added_count = 0
+    duplicates = []
+    product_images = []  # (vector_id, embedding, metadata) of every image, duplicates included, for the centroid
+    hash_entries = []  # (image vector_id, hashes, vector to query with)
+    collapser = DuplicateCollapser(pinecone_index, DEDUP_THRESHOLD, scope=DEDUP_SCOPE) if (request.dedup and DEDUP_ENABLED) else None
+    
+    for idx, image_obj, embedding, hashes in embedded:
+        # Create metadata
+        filename = image_obj.get('filename', f'product_{request.product_id}_img_{idx}.jpg')
+        metadata = {
+            "filename": filename,
+            "category": request.category,
+            "subcategory": request.subcategory or "",
+            "product_id": str(request.product_id),
+            "product_name": request.product_name,
+            "image_index": idx,
+            **hashes
+        }
         
-        # Upsert to Pinecone
-        if vectors_to_upsert:
-            pinecone_index.upsert(vectors=vectors_to_upsert)
-            logger.info(f"✅ Added {added_count} image embeddings for product {request.product_id} ({request.product_name})")
+        # Create unique vector ID
+        vector_id = f"product_{request.product_id}_img_{idx}_{hash(filename)}"
         
-        return {
-            "success": True,
-            "message": f"Added {added_count} image embeddings to Pinecone",
-            "embeddings_added": added_count
-        }
+        status, canonical_id = ("new", None) if collapser is None else collapser.check(vector_id, embedding, metadata)
+        product_images.append((canonical_id or vector_id, embedding, metadata))
+        hash_entries.append((vector_id, hashes, canonical_id or vector_id))
+        if status != "new":
+            duplicates.append({"image_index": idx, "canonical_id": canonical_id, "status": status})
+            continue
         
-    except Exception as e:
-        logger.error(f"Error adding product to Pinecone: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error adding product to search index: {str(e)}"
-        )
+        vectors_to_upsert.append({
+            "id": vector_id,
+            "values": embedding.tolist(),
+            "metadata": metadata
+        })
+        
+        added_count += 1
+    
+    # Upsert to Pinecone
+    upsert_report = None
+    if vectors_to_upsert:
+        upsert_report = upsert_all(pinecone_index, vectors_to_upsert, **UPSERT_OPTIONS)
+        added_count -= upsert_report["failed"]
+        if added_count:
+            logger.info(f"✅ Added {added_count} image embeddings for product {request.product_id} ({request.product_name})")
+    
+    upsert_failed = upsert_report["failed"] if upsert_report else 0
+    if hash_index is not None:
+        # A product with failed upserts gets no hash entries until it is ingested again
+        hash_index.remove_product(str(request.product_id))
+        if not upsert_failed:
+            for image_id, hashes, target_id in hash_entries:
+                hash_index.add(image_id, hashes, target_id, str(request.product_id))
+    
+    centroid_updated = False
+    if PRODUCT_CENTROIDS_ENABLED and product_images:
+        try:
+            upsert_centroid(
+                pinecone_index,
+                group_key({"product_id": request.product_id}),
+                [image[0] for image in product_images],
+                [image[1] for image in product_images],
+                [image[2] for image in product_images]
+            )
+            centroid_updated = True
+        except Exception as e:
+            logger.warning(f"Could not update centroid for product {request.product_id}: {e}")
+    
+    collapsed = 0
+    if collapser is not None:
+        collapsed = collapser.collapsed
+        collapser.flush()
+        if duplicates:
+            logger.info(f"Product {request.product_id}: {collapsed} near-duplicates collapsed, {collapser.already_indexed} already indexed")
+    
+    result = {
+        "success": upsert_failed == 0,
+        "message": f"Added {added_count} image embeddings to Pinecone"
+                   + (f" ({collapsed} near-duplicates collapsed)" if collapsed else ""),
+        "embeddings_added": added_count,
+        "duplicates_collapsed": collapsed,
+        "duplicates": duplicates,
+        "centroid_updated": centroid_updated
+    }
+    if upsert_failed:
+        # The embeddings are kept in the spill file; upsert_writer.py --resume finishes the write
+        result["embeddings_failed"] = upsert_failed
+        result["error"] = f"{upsert_failed} embeddings could not be upserted; saved to {upsert_report['spill_path']}"
+    return result
+
+
+def process_ingest_batch(jobs: list) -> dict:
+    """
+    Ingest worker callback: embed the images of several jobs in one model call, then index
+    each product
+    
+    Returns:
+        job_id -> indexing result (``success`` False with ``error`` for a failed product)
+    """
+    decoded = [(job, decode_product_images(job["payload"])) for job in jobs]
+    images = [image for _, images in decoded for _, _, image in images]
+    # Bulk priority, in chunks that yield to waiting searches
+    embeddings = inference.encode(
+        model, images, BULK, chunk_size=INFERENCE_BULK_CHUNK,
+        batch_size=INFERENCE_BULK_CHUNK, convert_to_numpy=True
+    ) if images else []
+    
+    results = {}
+    offset = 0
+    for job, images in decoded:
+        request = job["payload"]
+        embedded = [(idx, image_obj, embeddings[offset + i], image_hashes(image))
+                    for i, (idx, image_obj, image) in enumerate(images)]
+        offset += len(images)
+        try:
+            results[job["job_id"]] = index_product_images(request, embedded)
+        except Exception as e:
+            logger.error(f"Error adding product {request.product_id} to Pinecone: {e}")
+            results[job["job_id"]] = {"success": False, "error": f"Error adding product to search index: {str(e)}"}
+    if hash_index is not None:
+        try:
+            hash_index.save(HASH_INDEX_PATH)
+        except Exception as e:
+            logger.warning(f"Could not save hash index: {e}")
+    return results
 
 
 def preprocess_image(image_bytes: bytes) -> Image.Image:
@@ -349,13 +623,14 @@ def preprocess_image(image_bytes: bytes) -> Image.Image:
         raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
 
 
-def generate_embedding(image: Image.Image) -> np.ndarray:
+def generate_embedding(image: Image.Image, priority: str = INTERACTIVE) -> np.ndarray:
     """
     Generate CLIP embedding for the uploaded image
     
     This function takes the image that the user uploaded and converts it
     into a 512-dimensional vector (embedding) that represents the visual
     features of the image. This embedding is then used to find similar images.
+    The model call is scheduled under ``priority`` (see inference_scheduler.py).
     """
     try:
         import numpy as np
@@ -393,7 +668,7 @@ def generate_embedding(image: Image.Image) -> np.ndarray:
             logger.debug(f"Image reloaded from BytesIO: mode={clean_image.mode}, size={clean_image.size}")
             
             # Now encode using the completely clean image
-            embedding = model.encode(clean_image, convert_to_numpy=True, show_progress_bar=False)
+            embedding = inference.encode(model, clean_image, priority, convert_to_numpy=True, show_progress_bar=False)
             
         except Exception as encode_error:
             logger.error(f"Error during BytesIO method: {encode_error}")
@@ -414,7 +689,7 @@ def generate_embedding(image: Image.Image) -> np.ndarray:
                 clean_image.load()
                 
                 # Try encoding
-                embedding = model.encode(clean_image, convert_to_numpy=True, show_progress_bar=False)
+                embedding = inference.encode(model, clean_image, priority, convert_to_numpy=True, show_progress_bar=False)
                 
             except Exception as numpy_error:
                 logger.error(f"Numpy method also failed: {numpy_error}")
@@ -424,7 +699,7 @@ def generate_embedding(image: Image.Image) -> np.ndarray:
                     if image.mode != 'RGB':
                         image = image.convert('RGB')
                     image.load()
-                    embedding = model.encode(image, convert_to_numpy=True, show_progress_bar=False)
+                    embedding = inference.encode(model, image, priority, convert_to_numpy=True, show_progress_bar=False)
                 except Exception as final_error:
                     logger.error(f"All methods failed. Final error: {final_error}")
                     raise encode_error  # Raise the original error
@@ -458,37 +733,16 @@ def is_furniture_image(image_embedding: np.ndarray) -> bool:
     Returns True if the image is confidently identified as furniture.
     """
     try:
-        if model is None:
+        if model is None or prompt_embeddings is None:
             return False
         
         # Prompts to distinguish furniture from other wood products
-        furniture_prompts = [
-            "a photo of furniture",
-            "a photo of a piece of furniture",
-            "a photo of home furniture",
-            "a photo of indoor furniture"
-        ]
-        
-        non_furniture_prompts = [
-            "a photo of raw wood",
-            "a photo of timber",
-            "a photo of construction materials",
-            "a photo of lumber",
-            "a photo of wooden planks",
-            "a photo of building materials",
-            "a photo of wood panels",
-            "a photo of a door",
-            "a photo of a wooden door",
-            "a photo of a window",
-            "a photo of a glass window",
-            "a photo of plastic chair",
-            "a photo of plastic furniture",
-            "a photo of outdoor plastic furniture",
-        ]
-        
-        # Encode all prompts
+        furniture_prompts = FURNITURE_PROMPTS
+        non_furniture_prompts = NON_FURNITURE_PROMPTS
+        
+        # Look up the precomputed prompt embeddings
         all_prompts = furniture_prompts + non_furniture_prompts
-        text_embeddings = model.encode(all_prompts, convert_to_numpy=True)
+        text_embeddings = prompt_embeddings.matrix(all_prompts)
         
         # Compute similarities
         image_vec = image_embedding / (np.linalg.norm(image_embedding) + 1e-8)
@@ -536,20 +790,20 @@ def predict_furniture_type(image_embedding: np.ndarray) -> Optional[str]:
     Sofa uses multiple prompts for better accuracy (two seater, couch, etc.).
     """
     try:
-        if model is None:
+        if model is None or prompt_embeddings is None:
             logger.warning("Model not loaded, cannot predict furniture type.")
             return None
 
         type_names = list(FURNITURE_TYPE_PROMPTS.keys())
         prompts = [FURNITURE_TYPE_PROMPTS[t] for t in type_names]
-        text_embeddings = model.encode(prompts, convert_to_numpy=True)
+        text_embeddings = prompt_embeddings.matrix(prompts)
 
         image_vec = image_embedding / (np.linalg.norm(image_embedding) + 1e-8)
         text_vecs = text_embeddings / (np.linalg.norm(text_embeddings, axis=1, keepdims=True) + 1e-8)
         similarities = np.dot(text_vecs, image_vec)
 
         # Boost sofa: take best score over multiple sofa-specific prompts
-        sofa_embeddings = model.encode(SOFA_PROMPTS, convert_to_numpy=True)
+        sofa_embeddings = prompt_embeddings.matrix(SOFA_PROMPTS)
         sofa_vecs = sofa_embeddings / (np.linalg.norm(sofa_embeddings, axis=1, keepdims=True) + 1e-8)
         sofa_scores = np.dot(sofa_vecs, image_vec)
         best_sofa_score = float(np.max(sofa_scores))
@@ -580,17 +834,157 @@ def predict_furniture_type(image_embedding: np.ndarray) -> Optional[str]:
         return None
 
 
+def fetch_candidates(embedding: np.ndarray, top_k: int, aggregate_mode: Optional[str], use_centroids: bool) -> list:
+    """
+    Candidate matches for a query embedding, best first
+    
+    With mean aggregation and centroids, one candidate per product comes from the centroid
+    namespace, already scored by the product's mean similarity; otherwise top_k images are
+    over-fetched three times.
+    """
+    if aggregate_mode == "mean" and use_centroids:
+        try:
+            matches = centroid_candidates(pinecone_index, embedding, top_k)
+            if matches is not None:
+                logger.info(f"🔍 Centroid pass: {len(matches)} candidate products")
+                return matches
+            logger.info("No product centroids indexed; falling back to a plain query")
+        except Exception as e:
+            logger.warning(f"Centroid pass failed, falling back to a plain query: {e}")
+    query_top_k = min(top_k * 3, 50)
+    logger.info(f"🔍 Querying Pinecone for top {query_top_k} similar images...")
+    query_results = pinecone_index.query(
+        vector=embedding.tolist(),
+        top_k=query_top_k,
+        include_metadata=True
+    )
+    return query_results.get("matches", [])
+
+
+def finalize_results(results: List[SearchResult], top_k: int, aggregate_mode: Optional[str]) -> List[SearchResult]:
+    """Best top_k results; with aggregation, one result per product scored by max or mean"""
+    results.sort(key=lambda x: x.score, reverse=True)
+    if not aggregate_mode:
+        return results[:top_k]
+    groups = aggregate(
+        results, aggregate_mode, top_k,
+        score=lambda r: r.score,
+        key=lambda r: group_key({"product_id": r.product_id, "filepath": r.filepath}, r.id)
+    )
+    # Centroid candidates already stand for a whole product and carry its image count
+    return [g["best"].copy(update={"score": g["score"], "match_count": g["best"].match_count or g["count"]}) for g in groups]
+
+
+def same_image_results(matches: list, top_k: int, aggregate_mode: Optional[str]) -> List[SearchResult]:
+    """Same-image path: catalog furniture matches above SAME_IMAGE_MIN_MATCH, no furniture/type filter"""
+    results = []
+    for match in matches:
+        similarity_score = float(match.get("score", 0.0))
+        if similarity_score < SAME_IMAGE_MIN_MATCH:
+            continue
+        metadata = match.get("metadata", {}) or {}
+        category = (metadata.get("category") or "").lower()
+        if category and category != "furniture":
+            continue
+        results.append(SearchResult(
+            id=match.get("id", ""),
+            score=similarity_score,
+            filename=metadata.get("filename", ""),
+            filepath=metadata.get("filepath"),
+            image_size=metadata.get("image_size"),
+            category=metadata.get("category", "furniture"),
+            product_id=metadata.get("product_id"),
+            product_name=metadata.get("product_name"),
+            match_count=metadata.get("image_count"),
+        ))
+    return finalize_results(results, top_k, aggregate_mode)
+
+
+def fetch_vector(vector_id: str) -> Optional[np.ndarray]:
+    """Stored values of one vector, or None if it is not in the index"""
+    response = pinecone_index.fetch(ids=[vector_id])
+    vectors = response.get("vectors") if isinstance(response, dict) else getattr(response, "vectors", None)
+    record = (vectors or {}).get(vector_id)
+    if record is None:
+        return None
+    values = record.get("values") if isinstance(record, dict) else getattr(record, "values", None)
+    return np.asarray(values, dtype=np.float32) if values else None
+
+
+def hash_fast_path(image: Image.Image, top_k: int, aggregate_mode: Optional[str], use_centroids: bool) -> Optional[List[SearchResult]]:
+    """
+    Results for an upload that is a copy of an indexed catalog image, without running CLIP
+    
+    The upload's perceptual hashes are looked up in the hash index; on a match the index is
+    queried with the stored vector of that catalog image and the same-image path applies.
+    Returns None (run the normal path) when there is no match or the vector is gone.
+    """
+    if hash_index is None or len(hash_index) == 0:
+        return None
+    hit = hash_index.nearest(image_hashes(image))
+    if hit is None:
+        return None
+    try:
+        vector = fetch_vector(hit["vector_id"])
+    except Exception as e:
+        logger.warning(f"Hash fast path: could not fetch {hit['vector_id']}: {e}")
+        vector = None
+    if vector is None:
+        with hash_fast_path_lock:
+            hash_fast_path_counts["fallbacks"] += 1
+        return None
+    matches = fetch_candidates(vector, top_k, aggregate_mode, use_centroids)
+    with hash_fast_path_lock:
+        hash_fast_path_counts["served"] += 1
+    logger.info(f"⚡ Hash fast path: upload matches {hit['key']} ({hit['distance']} bits), CLIP skipped")
+    return same_image_results(matches, top_k, aggregate_mode)
+
+
+def hash_fast_path_stats() -> Optional[dict]:
+    if hash_index is None:
+        return None
+    with hash_fast_path_lock:
+        return {**hash_index.stats(), **hash_fast_path_counts}
+
+
+def validate_priority(priority: Optional[str]) -> str:
+    """Priority class from the X-Request-Priority header (default interactive)"""
+    if not priority:
+        return INTERACTIVE
+    priority = priority.lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid X-Request-Priority '{priority}'. Use one of: {', '.join(PRIORITIES)}"
+        )
+    return priority
+
+
+def validate_aggregate(aggregate_mode: Optional[str]) -> Optional[str]:
+    if aggregate_mode in (None, ""):
+        return None
+    if aggregate_mode not in AGGREGATION_MODES:
+        raise HTTPException(status_code=400, detail=f"aggregate must be one of {', '.join(AGGREGATION_MODES)}")
+    return aggregate_mode
+
+
 @app.post("/search-by-image", response_model=SearchResponse)
 async def search_by_image(
     file: UploadFile = File(..., description="Image file to search"),
-    top_k: int = Form(5, ge=1, le=20, description="Number of similar images to return")
+    top_k: int = Form(5, ge=1, le=20, description="Number of similar images to return"),
+    aggregate: Optional[str] = Form(None, description="Collapse results by product: 'max' or 'mean'"),
+    use_centroids: bool = Form(False, description="Score products by their centroid (with aggregate=mean)"),
+    priority: Optional[str] = Header(None, alias="X-Request-Priority", description="interactive, recommendation or bulk")
 ):
     """
     Search for similar furniture images using CLIP embeddings and Pinecone
     
     Args:
         file: Image file to search (jpg, png, webp)
-        top_k: Number of similar images to return (1-20)
+        top_k: Number of similar images to return (1-20); distinct products with aggregate
+        aggregate: Return one result per product, scored by its best ("max") or mean match
+        use_centroids: Take candidates from the per-product centroids (with aggregate="mean")
+        priority: Scheduling class of the model call (interactive by default)
     
     Returns:
         List of similar images with similarity scores
@@ -607,6 +1001,9 @@ async def search_by_image(
             detail="Pinecone not configured. Please set PINECONE_API_KEY in .env file and ensure embeddings are generated."
         )
     
+    aggregate = validate_aggregate(aggregate)
+    priority = validate_priority(priority)
+    
     # Validate file type
     if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(
@@ -626,7 +1023,7 @@ async def search_by_image(
         
         # CRITICAL: Create image from bytes multiple times to ensure clean state
         # This helps avoid Windows file handle issues
-        image = preprocess_image(image_bytes)
+        image = await run_in_threadpool(preprocess_image, image_bytes)
         logger.info(f"✅ Image preprocessed successfully: {image.size[0]}x{image.size[1]} pixels")
         
         # Force a complete reload by recreating from bytes one more time
@@ -647,51 +1044,26 @@ async def search_by_image(
             logger.warning(f"Could not reload image (non-critical): {reload_error}")
             # Continue with original image
         
+        # Copy of a catalog image: answer from its stored vector without running CLIP
+        fast_results = await run_in_threadpool(hash_fast_path, image, top_k, aggregate, use_centroids)
+        if fast_results is not None:
+            return SearchResponse(query_image=file.filename, results=fast_results, total_results=len(fast_results), top_k=top_k)
+        
         # Generate embedding from the uploaded image
         logger.info("🤖 Generating CLIP embedding from uploaded image...")
-        embedding = generate_embedding(image)
+        embedding = await run_in_threadpool(generate_embedding, image, priority)
         logger.info(f"✅ Embedding generated: {len(embedding)} dimensions from YOUR uploaded image")
 
         # --- STEP 1: Always query Pinecone first (so same/catalog image always gets results) ---
-        query_top_k = min(top_k * 3, 50)
-        logger.info(f"🔍 Querying Pinecone for top {query_top_k} similar images...")
-        query_results = pinecone_index.query(
-            vector=embedding.tolist(),
-            top_k=query_top_k,
-            include_metadata=True
-        )
-        matches = query_results.get("matches", [])
+        matches = await run_in_threadpool(fetch_candidates, embedding, top_k, aggregate, use_centroids)
         logger.info(f"✅ Found {len(matches)} candidate matches")
 
         best_score = float(matches[0].get("score", 0.0)) if matches else 0.0
 
         # --- STEP 2: Same-image path: if best match is very high = same or near-same catalog image ---
-        SAME_IMAGE_THRESHOLD = 0.76  # Same or very close image from your site
-        SAME_IMAGE_MIN_MATCH = 0.58   # Include all furniture above this when in same-image path
-
         if best_score >= SAME_IMAGE_THRESHOLD:
             logger.info(f"📌 Same-image path: best score {best_score:.3f} >= {SAME_IMAGE_THRESHOLD} — returning catalog matches (no furniture/type filter)")
-            results = []
-            for match in matches:
-                similarity_score = float(match.get("score", 0.0))
-                if similarity_score < SAME_IMAGE_MIN_MATCH:
-                    continue
-                metadata = match.get("metadata", {}) or {}
-                category = (metadata.get("category") or "").lower()
-                if category and category != "furniture":
-                    continue
-                results.append(SearchResult(
-                    id=match.get("id", ""),
-                    score=similarity_score,
-                    filename=metadata.get("filename", ""),
-                    filepath=metadata.get("filepath"),
-                    image_size=metadata.get("image_size"),
-                    category=metadata.get("category", "furniture"),
-                    product_id=metadata.get("product_id"),
-                    product_name=metadata.get("product_name"),
-                ))
-            results.sort(key=lambda x: x.score, reverse=True)
-            results = results[:top_k]
+            results = same_image_results(matches, top_k, aggregate)
             logger.info(f"✅ Returning {len(results)} results (same-image path)")
             return SearchResponse(query_image=file.filename, results=results, total_results=len(results), top_k=top_k)
 
@@ -744,9 +1116,9 @@ async def search_by_image(
                 category=metadata.get("category", "furniture"),
                 product_id=metadata.get("product_id"),
                 product_name=metadata.get("product_name"),
+                match_count=metadata.get("image_count"),
             ))
-        results.sort(key=lambda x: x.score, reverse=True)
-        results = results[:top_k]
+        results = finalize_results(results, top_k, aggregate)
         logger.info(f"✅ Found {len(results)} similar images (threshold: {MIN_SIMILARITY_THRESHOLD})")
         
         if len(results) == 0 and len(matches) > 0:
@@ -783,14 +1155,20 @@ async def search_by_image(
 @app.post("/search-by-image-base64")
 async def search_by_image_base64(
     image_base64: str = Form(..., description="Base64 encoded image"),
-    top_k: int = Form(5, ge=1, le=20, description="Number of similar images to return")
+    top_k: int = Form(5, ge=1, le=20, description="Number of similar images to return"),
+    aggregate: Optional[str] = Form(None, description="Collapse results by product: 'max' or 'mean'"),
+    use_centroids: bool = Form(False, description="Score products by their centroid (with aggregate=mean)"),
+    priority: Optional[str] = Header(None, alias="X-Request-Priority", description="interactive, recommendation or bulk")
 ):
     """
     Search for similar furniture images using base64 encoded image
     
     Args:
         image_base64: Base64 encoded image string (with or without data URL prefix)
-        top_k: Number of similar images to return (1-20)
+        top_k: Number of similar images to return (1-20); distinct products with aggregate
+        aggregate: Return one result per product, scored by its best ("max") or mean match
+        use_centroids: Take candidates from the per-product centroids (with aggregate="mean")
+        priority: Scheduling class of the model call (interactive by default)
     
     Returns:
         List of similar images with similarity scores
@@ -807,6 +1185,9 @@ async def search_by_image_base64(
             detail="Pinecone not configured. Please set PINECONE_API_KEY in .env file and ensure embeddings are generated."
         )
     
+    aggregate = validate_aggregate(aggregate)
+    priority = validate_priority(priority)
+    
     try:
         # Decode base64 image
         import base64
@@ -823,44 +1204,24 @@ async def search_by_image_base64(
         
         # Preprocess image
         logger.info(f"Processing base64 image ({len(image_bytes)} bytes)")
-        image = preprocess_image(image_bytes)
+        image = await run_in_threadpool(preprocess_image, image_bytes)
+        
+        # Copy of a catalog image: answer from its stored vector without running CLIP
+        fast_results = await run_in_threadpool(hash_fast_path, image, top_k, aggregate, use_centroids)
+        if fast_results is not None:
+            return SearchResponse(query_image="base64_image", results=fast_results, total_results=len(fast_results), top_k=top_k)
         
         # Generate embedding
         logger.info("Generating CLIP embedding...")
-        embedding = generate_embedding(image)
+        embedding = await run_in_threadpool(generate_embedding, image, priority)
         
         # Query Pinecone first (same logic as search-by-image)
-        query_top_k = min(top_k * 3, 50)
-        query_results = pinecone_index.query(
-            vector=embedding.tolist(),
-            top_k=query_top_k,
-            include_metadata=True
-        )
-        b64_matches = query_results.get("matches", [])
+        b64_matches = await run_in_threadpool(fetch_candidates, embedding, top_k, aggregate, use_centroids)
         b64_best = float(b64_matches[0].get("score", 0.0)) if b64_matches else 0.0
 
-        if b64_best >= 0.76:
+        if b64_best >= SAME_IMAGE_THRESHOLD:
             # Same-image path: return catalog matches without furniture gate
-            results = []
-            for match in b64_matches:
-                sc = float(match.get("score", 0.0))
-                if sc < 0.58:
-                    continue
-                meta = match.get("metadata", {}) or {}
-                if meta.get("category", "").lower() not in ("", "furniture"):
-                    continue
-                results.append(SearchResult(
-                    id=match.get("id", ""),
-                    score=sc,
-                    filename=meta.get("filename", ""),
-                    filepath=meta.get("filepath"),
-                    image_size=meta.get("image_size"),
-                    category=meta.get("category", "furniture"),
-                    product_id=meta.get("product_id"),
-                    product_name=meta.get("product_name"),
-                ))
-            results.sort(key=lambda x: x.score, reverse=True)
-            results = results[:top_k]
+            results = same_image_results(b64_matches, top_k, aggregate)
             return SearchResponse(query_image="base64_image", results=results, total_results=len(results), top_k=top_k)
 
         if not is_furniture_image(embedding):
@@ -890,9 +1251,9 @@ async def search_by_image_base64(
                 category=meta.get("category", "furniture"),
                 product_id=meta.get("product_id"),
                 product_name=meta.get("product_name"),
+                match_count=meta.get("image_count"),
             ))
-        results.sort(key=lambda x: x.score, reverse=True)
-        results = results[:top_k]
+        results = finalize_results(results, top_k, aggregate)
         return SearchResponse(query_image="base64_image", results=results, total_results=len(results), top_k=top_k)
         
     except HTTPException:
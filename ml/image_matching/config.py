@@ -30,6 +30,13 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "furniture-images")
 # Alternative: Use transformers library directly with "openai/clip-vit-base-patch32"
 CLIP_MODEL_NAME = "clip-ViT-L-14"  # Using sentence-transformers CLIP wrapper
 
+# "full" loads both CLIP towers; "vision" loads only the image encoder (vision_encoder.py)
+# and takes the runtime text prompts from a precomputed artifact (prompt_embeddings.py)
+CLIP_LOAD_MODE = os.getenv("CLIP_LOAD_MODE", "full").lower()
+PROMPT_EMBEDDINGS_PATH = Path(os.getenv(
+    "PROMPT_EMBEDDINGS_PATH", str(CONFIG_DIR / "artifacts" / f"prompt_embeddings_{CLIP_MODEL_NAME}.npz")
+))
+
 # Image processing configuration
 SUPPORTED_IMAGE_FORMATS = [".jpg", ".jpeg", ".png", ".webp"]
 MAX_IMAGE_SIZE = (224, 224)  # Standard CLIP input size
@@ -37,3 +44,78 @@ MAX_IMAGE_SIZE = (224, 224)  # Standard CLIP input size
 # Metadata configuration
 METADATA_FIELDS = ["filename", "category", "filepath", "image_size"]
 
+# Near-duplicate collapsing at ingest: a new image at least this cosine-similar to an indexed
+# one is recorded as an alias of it instead of a new vector (resized/re-saved copies of the
+# same photo score above 0.97 with CLIP ViT-L/14; distinct photos of one product stay below)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() != "false"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.97"))
+# "product": only collapse into images of the same product (or catalog files into catalog
+# files); "global" also across products, which hides the later product from search
+DEDUP_SCOPE = os.getenv("DEDUP_SCOPE", "product")
+
+# Keep one centroid vector per product (separate namespace) for coarse-to-fine product search
+PRODUCT_CENTROIDS_ENABLED = os.getenv("PRODUCT_CENTROIDS_ENABLED", "true").lower() != "false"
+
+
+# Vector search backend: "pinecone", or "local" for the on-disk HNSW index (local_index.py)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "pinecone").lower()
+LOCAL_INDEX_PATH = Path(os.getenv("LOCAL_INDEX_PATH", str(CONFIG_DIR / "indexes" / "furniture")))
+# HNSW parameters: links per vector, build-time and query-time search widths
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# Fresh-segment vectors (or tombstones) that trigger a background compaction into the graph
+LOCAL_INDEX_COMPACT_AT = int(os.getenv("LOCAL_INDEX_COMPACT_AT", "1000"))
+# Upserted vectors between saves of the local index (it is also saved on shutdown)
+LOCAL_INDEX_SAVE_EVERY = int(os.getenv("LOCAL_INDEX_SAVE_EVERY", "1000"))
+# Walk the HNSW graph with vectors reduced by a projection fitted with projection.py
+# (e.g. embeddings/furniture/projection_128.npz), rescoring candidates at full dimension;
+# empty walks at full dimension
+LOCAL_INDEX_PROJECTION = os.getenv("LOCAL_INDEX_PROJECTION", "")
+
+# Images embedded per model call by the background /add-product worker; queued jobs for
+# different products are combined up to this size
+INGEST_BATCH_IMAGES = int(os.getenv("INGEST_BATCH_IMAGES", "16"))
+# Inference scheduling (inference_scheduler.py): concurrent model calls, the minimum share of
+# recent inference time each priority class keeps under load, and images per bulk chunk
+# (bulk encoding yields to waiting searches between chunks)
+INFERENCE_SLOTS = int(os.getenv("INFERENCE_SLOTS", "1"))
+INFERENCE_SHARES = {
+    "interactive": float(os.getenv("INFERENCE_SHARE_INTERACTIVE", "0.7")),
+    "recommendation": float(os.getenv("INFERENCE_SHARE_RECOMMENDATION", "0.2")),
+    "bulk": float(os.getenv("INFERENCE_SHARE_BULK", "0.1")),
+}
+INFERENCE_BULK_CHUNK = int(os.getenv("INFERENCE_BULK_CHUNK", "4"))
+
+# Perceptual-hash fast path (phash.py): uploads within HASH_MAX_DISTANCE bits of an indexed
+# catalog image are answered with that image's stored vector, without running CLIP
+HASH_FAST_PATH_ENABLED = os.getenv("HASH_FAST_PATH_ENABLED", "true").lower() != "false"
+HASH_INDEX_PATH = Path(os.getenv("HASH_INDEX_PATH", str(CONFIG_DIR / "indexes" / "image_hashes.npz")))
+HASH_MAX_DISTANCE = int(os.getenv("HASH_MAX_DISTANCE", "4"))
+
+# Queued /add-product jobs beyond which new products are turned away with 429 (0 = no limit)
+INGEST_MAX_QUEUED_JOBS = int(os.getenv("INGEST_MAX_QUEUED_JOBS", "500"))
+
+# Admission control (admission.py) per endpoint class: requests running at once, requests
+# waiting for a slot, and seconds a request may wait before it is turned away with 503
+ADMISSION_SEARCH_CONCURRENCY = int(os.getenv("ADMISSION_SEARCH_CONCURRENCY", "2"))
+ADMISSION_SEARCH_QUEUE = int(os.getenv("ADMISSION_SEARCH_QUEUE", "16"))
+ADMISSION_SEARCH_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_SEARCH_QUEUE_TIMEOUT", "5"))
+ADMISSION_INGEST_CONCURRENCY = int(os.getenv("ADMISSION_INGEST_CONCURRENCY", "2"))
+ADMISSION_INGEST_QUEUE = int(os.getenv("ADMISSION_INGEST_QUEUE", "8"))
+ADMISSION_INGEST_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_INGEST_QUEUE_TIMEOUT", "10"))
+
+# Vector upserts (upsert_writer.py): vectors and bytes per request, concurrent requests, and
+# where records of requests that still fail after retries are kept for --resume
+UPSERT_MAX_VECTORS = int(os.getenv("UPSERT_MAX_VECTORS", "100"))
+UPSERT_MAX_BYTES = int(os.getenv("UPSERT_MAX_BYTES", str(2 * 1024 * 1024)))
+UPSERT_MAX_IN_FLIGHT = int(os.getenv("UPSERT_MAX_IN_FLIGHT", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "5"))
+UPSERT_SPILL_DIR = Path(os.getenv("UPSERT_SPILL_DIR", str(CONFIG_DIR / "embeddings" / "failed_upserts")))
+UPSERT_OPTIONS = {
+    "max_vectors": UPSERT_MAX_VECTORS,
+    "max_bytes": UPSERT_MAX_BYTES,
+    "max_in_flight": UPSERT_MAX_IN_FLIGHT,
+    "max_retries": UPSERT_MAX_RETRIES,
+    "spill_dir": UPSERT_SPILL_DIR,
+}
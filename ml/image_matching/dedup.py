@@ -0,0 +1,221 @@
+"""
+Near-duplicate detection for image embeddings at ingest time
+
+The same photo is often ingested several times (resized, re-saved as JPEG, or present both in
+client/src/assets and in product uploads). Each new embedding is compared with the vectors
+accepted earlier in the same run and with the index; if one is at least ``threshold`` cosine
+similar, the new image is recorded as an alias of that canonical vector instead of becoming a
+vector of its own. Canonical vectors carry the aliases in their metadata:
+
+    aliases            vector IDs of the collapsed copies (capped at MAX_ALIASES)
+    alias_product_ids  products whose images were collapsed into this vector
+    duplicate_count    number of copies collapsed, including any beyond the cap
+
+Search does not expand aliases, so by default (scope "product", DEDUP_SCOPE) an image is only
+collapsed into a vector of the same owner: the same product, or the catalog files for
+generate_embeddings.py. Otherwise a product whose photo matches another listing would never
+be returned for it. Scope "global" collapses across products.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Pinecone keeps metadata small; the count keeps growing past the list cap
+MAX_ALIASES = 50
+
+SCOPES = ("product", "global")
+
+
+def source_key(metadata: Dict[str, Any]) -> Optional[str]:
+    """
+    Where an image came from: its catalog file, or its slot in a product
+
+    Two vectors from the same source are the same upload indexed twice (e.g. a re-run of
+    generate_embeddings.py, whose vector IDs change between runs), not a duplicate.
+    """
+    if metadata.get("filepath"):
+        return f"file:{metadata['filepath']}"
+    if metadata.get("product_id") not in (None, ""):
+        return f"product:{metadata['product_id']}:{metadata.get('image_index', '')}"
+    return None
+
+
+def owner_key(metadata: Dict[str, Any]) -> Optional[str]:
+    """Who an image belongs to: a product, or the catalog files; None if neither"""
+    if metadata.get("product_id") not in (None, ""):
+        return f"product:{metadata['product_id']}"
+    if metadata.get("filepath"):
+        return "catalog"
+    return None
+
+
+def owner_filter(metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Metadata filter for the indexed vectors of the same owner as ``metadata``"""
+    if metadata.get("product_id") not in (None, ""):
+        return {"product_id": {"$eq": str(metadata["product_id"])}}
+    if metadata.get("filepath"):
+        return {"filepath": {"$exists": True}}
+    return None
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class DuplicateCollapser:
+    """
+    Decides for each new embedding whether it is new, already indexed, or a near-duplicate
+
+    Usage:
+        collapser = DuplicateCollapser(index, threshold)   # scope="global" to collapse across products
+        for vector_id, embedding, metadata in images:
+            status, canonical_id = collapser.check(vector_id, embedding, metadata)
+            if status == "new":
+                upsert(...)
+        collapser.flush()   # writes alias fields and refreshed metadata onto the indexed vectors
+    """
+
+    def __init__(self, index=None, threshold: float = 0.97, namespace: str = "", scope: str = "product"):
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown dedup scope {scope!r}; expected one of {', '.join(SCOPES)}")
+        self.index = index
+        self.threshold = threshold
+        self.namespace = namespace
+        self.scope = scope
+        self.collapsed = 0
+        self.already_indexed = 0
+        # Vectors accepted in this run; the index may not show a fresh upsert for a few seconds
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._ids: List[str] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._owners: List[Optional[str]] = []
+        # Canonical ID -> alias metadata to write (starts from what the index already holds)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Canonical ID -> current metadata of a source that is indexed again (e.g. a renamed product)
+        self._refreshed: Dict[str, Dict[str, Any]] = {}
+
+    def _remember(self, vector_id: str, vector: np.ndarray, metadata: Dict[str, Any]) -> None:
+        if self._vectors.shape[1] != len(vector):
+            self._vectors = np.zeros((0, len(vector)), dtype=np.float32)
+        # Grow by doubling so a full catalog run stays linear
+        if len(self._ids) == len(self._vectors):
+            grown = np.zeros((max(64, 2 * len(self._vectors)), len(vector)), dtype=np.float32)
+            grown[:len(self._vectors)] = self._vectors
+            self._vectors = grown
+        self._vectors[len(self._ids)] = vector
+        self._ids.append(vector_id)
+        self._meta.append(metadata)
+        self._owners.append(owner_key(metadata))
+
+    def _local_match(self, vector: np.ndarray, metadata: Dict[str, Any]) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        if not self._ids or self._vectors.shape[1] != len(vector):
+            return None
+        scores = self._vectors[:len(self._ids)] @ vector
+        if self.scope == "product":
+            owner = owner_key(metadata)
+            scores = np.where([o == owner for o in self._owners], scores, -np.inf)
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            return None
+        return self._ids[best], float(scores[best]), self._meta[best]
+
+    def _index_match(self, vector: np.ndarray, metadata: Dict[str, Any]) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        if self.index is None:
+            return None
+        query = {"vector": vector.tolist(), "top_k": 1, "include_metadata": True, "namespace": self.namespace}
+        if self.scope == "product":
+            query["filter"] = owner_filter(metadata)
+        try:
+            response = self.index.query(**query)
+        except Exception as e:
+            # Ingest must not fail because the duplicate check did; index the image as new
+            logger.warning(f"Duplicate check against the index failed: {e}")
+            return None
+        matches = response.get("matches", []) if hasattr(response, "get") else response.matches
+        if not matches:
+            return None
+        match = matches[0]
+        return match.get("id", ""), float(match.get("score", 0.0)), match.get("metadata", {}) or {}
+
+    def check(self, vector_id: str, embedding, metadata: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """
+        Classify one embedding
+
+        Returns:
+            ("new", None) to upsert it, ("indexed", id) if the same source is already in the
+            index, or ("duplicate", canonical_id) if it was collapsed into another vector
+        """
+        vector = _normalize(embedding)
+        if self.scope == "product" and owner_key(metadata) is None:
+            # No owner to compare within
+            self._remember(vector_id, vector, metadata)
+            return "new", None
+        candidates = [m for m in (self._local_match(vector, metadata), self._index_match(vector, metadata))
+                      if m is not None]
+        if candidates:
+            canonical_id, score, canonical_meta = max(candidates, key=lambda m: m[1])
+            if score >= self.threshold:
+                key = source_key(metadata)
+                if key is not None and key == source_key(canonical_meta):
+                    self.already_indexed += 1
+                    self._refreshed[canonical_id] = dict(metadata)
+                    return "indexed", canonical_id
+                self._add_alias(canonical_id, canonical_meta, vector_id, metadata)
+                logger.info(f"Collapsed {vector_id} into {canonical_id} (cosine {score:.4f})")
+                return "duplicate", canonical_id
+        self._remember(vector_id, vector, metadata)
+        return "new", None
+
+    def _add_alias(self, canonical_id: str, canonical_meta: Dict[str, Any], alias_id: str, alias_meta: Dict[str, Any]) -> None:
+        entry = self._pending.get(canonical_id)
+        if entry is None:
+            entry = {
+                "aliases": list(canonical_meta.get("aliases") or []),
+                "alias_product_ids": list(canonical_meta.get("alias_product_ids") or []),
+                "duplicate_count": int(canonical_meta.get("duplicate_count") or 0),
+            }
+            self._pending[canonical_id] = entry
+        if len(entry["aliases"]) < MAX_ALIASES:
+            entry["aliases"].append(alias_id)
+        product_id = alias_meta.get("product_id")
+        if product_id not in (None, "") and str(product_id) not in entry["alias_product_ids"]:
+            entry["alias_product_ids"].append(str(product_id))
+        entry["duplicate_count"] += 1
+        self.collapsed += 1
+        # Later checks against the local copy see the aliases recorded so far
+        for i, local_id in enumerate(self._ids):
+            if local_id == canonical_id:
+                self._meta[i] = {**self._meta[i], **entry}
+                break
+
+    def alias_metadata(self) -> Dict[str, Dict[str, Any]]:
+        """Canonical ID -> alias fields to merge into its metadata"""
+        return {k: dict(v) for k, v in self._pending.items()}
+
+    def flush(self) -> int:
+        """
+        Write pending metadata to the index; returns the number of vectors updated
+
+        Re-indexed sources get their current metadata (name, subcategory, ...), since they are
+        not upserted again; canonical vectors get their alias fields.
+        """
+        updated = 0
+        if self.index is not None:
+            for canonical_id in dict.fromkeys(list(self._refreshed) + list(self._pending)):
+                fields = {**self._refreshed.get(canonical_id, {}), **self._pending.get(canonical_id, {})}
+                try:
+                    self.index.update(id=canonical_id, set_metadata=fields, namespace=self.namespace)
+                    updated += 1
+                except Exception as e:
+                    logger.error(f"Could not update metadata of {canonical_id}: {e}")
+        self._pending.clear()
+        self._refreshed.clear()
+        return updated
+
+    def stats(self) -> Dict[str, int]:
+        return {"duplicates_collapsed": self.collapsed, "already_indexed": self.already_indexed}
@@ -0,0 +1,287 @@
+"""
+On-disk embedding store for the image matching system
+
+A snapshot is a directory holding:
+    vectors.bin     raw row-major float16/float32 matrix (count x dimension), L2-normalized
+    ids.npy         fixed-width unicode vector IDs
+    meta_<name>.npy one array per metadata field (strings, JSON lists, integers or floats)
+    meta_<name>.mask.npy  which rows have the field, for typed fields some rows lack
+    store.json      manifest: dimension, dtype, count, columns, model, source
+
+Everything is opened through memory maps, so any number of processes can open the same
+snapshot without copying it into RAM. The manifest is written last and the snapshot is moved
+into place with a rename, so readers never see a half-written store.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MANIFEST_FILE = "store.json"
+VECTORS_FILE = "vectors.bin"
+IDS_FILE = "ids.npy"
+FORMAT_VERSION = 1
+SUPPORTED_DTYPES = ("float16", "float32")
+# Rows scored per block in exact search (bounds the temporary score matrix)
+SEARCH_BLOCK_ROWS = 65536
+
+
+def replace_directory(staging: Path, path: Path) -> None:
+    """
+    Move a fully written staging directory to ``path``, replacing what was there
+
+    The old directory is renamed aside first, since a rename cannot replace a non-empty
+    directory. Readers that already opened files in it keep their memory maps.
+    """
+    # mkdtemp creates the directory private to this user; snapshots are shared read-only
+    os.chmod(staging, 0o755)
+    previous = None
+    if path.exists():
+        previous = path.with_name(f".{path.name}.old.{os.getpid()}")
+        os.replace(path, previous)
+    os.replace(staging, path)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def _column_file(name: str) -> str:
+    return f"meta_{name}.npy"
+
+
+def _mask_file(name: str) -> str:
+    return f"meta_{name}.mask.npy"
+
+
+def _column_array(values: List[Any]) -> Tuple[np.ndarray, str]:
+    """
+    Pack one metadata field into a typed array; lists become JSON, mixed values strings
+
+    Missing values of a bool/int/float field are filled with False/0 in the array; the caller
+    stores which rows have the field separately.
+    """
+    present = [v for v in values if v is not None]
+    if any(isinstance(v, (list, dict)) for v in present):
+        return np.array(["" if v is None else json.dumps(v) for v in values], dtype=str), "json"
+    if present:
+        if all(isinstance(v, bool) for v in present):
+            return np.array([bool(v) for v in values], dtype=bool), "bool"
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+            return np.array([0 if v is None else v for v in values], dtype=np.int64), "int"
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            return np.array([0.0 if v is None else v for v in values], dtype=np.float64), "float"
+    strings = ["" if v is None else (v if isinstance(v, str) else json.dumps(v)) for v in values]
+    return np.array(strings, dtype=str), "str"
+
+
+class EmbeddingStoreWriter:
+    """
+    Streams vectors into a new snapshot
+
+    Vectors are appended batch by batch to the vector file; IDs and metadata are small and
+    kept in memory until close(). Use as a context manager: the snapshot only replaces
+    ``path`` when the block exits without an error.
+    """
+
+    def __init__(self, path, dimension: int, dtype: str = "float16",
+                 model: Optional[str] = None, source: Optional[str] = None):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"dtype must be one of {SUPPORTED_DTYPES}, got {dtype!r}")
+        self.path = Path(path)
+        self.dimension = int(dimension)
+        self.dtype = dtype
+        self.model = model
+        self.source = source
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._staging = Path(tempfile.mkdtemp(prefix=f".{self.path.name}.", dir=self.path.parent))
+        self._vectors = open(self._staging / VECTORS_FILE, "wb")
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, ids: Sequence[str], vectors, metadata: Optional[Sequence[Dict[str, Any]]] = None) -> int:
+        """Append a batch; IDs already written are skipped. Returns the number of rows added"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+        metadata = list(metadata) if metadata is not None else [{} for _ in ids]
+        keep = []
+        for i, vector_id in enumerate(ids):
+            vector_id = str(vector_id)
+            if vector_id in self._positions:
+                continue
+            self._positions[vector_id] = len(self._ids)
+            self._ids.append(vector_id)
+            self._metadata.append(dict(metadata[i] or {}))
+            keep.append(i)
+        if not keep:
+            return 0
+        batch = vectors[keep]
+        # Normalized rows make cosine similarity a dot product and keep float16 in range
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        batch = batch / np.maximum(norms, 1e-12)
+        self._vectors.write(np.ascontiguousarray(batch, dtype=self.dtype).tobytes())
+        return len(keep)
+
+    def update_metadata(self, vector_id: str, fields: Dict[str, Any]) -> bool:
+        """Merge fields into the metadata of a row already added (False if the ID is unknown)"""
+        row = self._positions.get(vector_id)
+        if row is None:
+            return False
+        self._metadata[row].update(fields)
+        return True
+
+    def close(self) -> Path:
+        """Write IDs, metadata columns and the manifest, then move the snapshot into place"""
+        if self._closed:
+            return self.path
+        self._vectors.close()
+        np.save(self._staging / IDS_FILE, np.array(self._ids, dtype=str))
+
+        names = sorted({key for row in self._metadata for key in row})
+        columns = []
+        for name in names:
+            values = [row.get(name) for row in self._metadata]
+            array, kind = _column_array(values)
+            np.save(self._staging / _column_file(name), array)
+            column = {"name": name, "type": kind}
+            if kind in ("bool", "int", "float") and any(v is None for v in values):
+                np.save(self._staging / _mask_file(name), np.array([v is not None for v in values], dtype=bool))
+                column["nullable"] = True
+            columns.append(column)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "count": len(self._ids),
+            "dimension": self.dimension,
+            "dtype": self.dtype,
+            "normalized": True,
+            "columns": columns,
+            "model": self.model,
+            "source": self.source,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        with open(self._staging / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        replace_directory(self._staging, self.path)
+        self._closed = True
+        return self.path
+
+    def abort(self) -> None:
+        """Discard the staging directory"""
+        if not self._closed:
+            self._vectors.close()
+            shutil.rmtree(self._staging, ignore_errors=True)
+            self._closed = True
+
+    def __enter__(self) -> "EmbeddingStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class EmbeddingStore:
+    """Read-only, memory-mapped view of a snapshot"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store format: {self.manifest.get('format_version')}")
+        self.count = int(self.manifest["count"])
+        self.dimension = int(self.manifest["dimension"])
+        self.dtype = self.manifest["dtype"]
+        if self.count:
+            self.vectors = np.memmap(self.path / VECTORS_FILE, dtype=self.dtype, mode="r",
+                                     shape=(self.count, self.dimension))
+        else:
+            self.vectors = np.zeros((0, self.dimension), dtype=self.dtype)
+        self.ids = np.load(self.path / IDS_FILE, mmap_mode="r")
+        self._columns: Dict[str, np.ndarray] = {}
+        self._masks: Dict[str, np.ndarray] = {}
+        self._positions: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c["name"] for c in self.manifest["columns"]]
+
+    def column(self, name: str) -> np.ndarray:
+        """Memory-mapped metadata column"""
+        if name not in self._columns:
+            if name not in self.column_names:
+                raise KeyError(name)
+            self._columns[name] = np.load(self.path / _column_file(name), mmap_mode="r")
+        return self._columns[name]
+
+    def present(self, name: str) -> Optional[np.ndarray]:
+        """Which rows have a typed field that some rows lack (None if every row has it)"""
+        if name not in self._masks:
+            column = next((c for c in self.manifest["columns"] if c["name"] == name), None)
+            if column is None:
+                raise KeyError(name)
+            self._masks[name] = np.load(self.path / _mask_file(name), mmap_mode="r") if column.get("nullable") else None
+        return self._masks[name]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        """Metadata of one row, in the shape it was written (empty strings dropped)"""
+        result = {}
+        for column in self.manifest["columns"]:
+            if column.get("nullable") and not self.present(column["name"])[row]:
+                continue
+            value = self.column(column["name"])[row].item()
+            if value != "":
+                result[column["name"]] = json.loads(value) if column["type"] == "json" else value
+        return result
+
+    def position(self, vector_id: str) -> Optional[int]:
+        """Row of a vector ID (builds the lookup table on first use)"""
+        if self._positions is None:
+            self._positions = {str(v): i for i, v in enumerate(self.ids)}
+        return self._positions.get(vector_id)
+
+    def iter_batches(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray, List[Dict[str, Any]]]]:
+        """(ids, float32 vectors, metadata) in row order, e.g. to load another vector backend"""
+        for start in range(0, self.count, batch_size):
+            stop = min(start + batch_size, self.count)
+            ids = [str(v) for v in self.ids[start:stop]]
+            yield ids, np.asarray(self.vectors[start:stop], dtype=np.float32), [self.metadata(i) for i in range(start, stop)]
+
+    def search(self, query, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Exact cosine search over the whole snapshot, in blocks"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        top_k = min(top_k, self.count)
+        if top_k <= 0:
+            return []
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = np.concatenate([best_scores, block @ query])
+            rows = np.concatenate([best_rows, np.arange(start, start + len(block))])
+            keep = np.argpartition(-scores, top_k - 1)[:top_k] if len(scores) > top_k else np.arange(len(scores))
+            best_scores, best_rows = scores[keep], rows[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return [
+            {"id": str(self.ids[r]), "score": float(s), "metadata": self.metadata(int(r))}
+            for s, r in zip(best_scores[order], best_rows[order])
+        ]
+
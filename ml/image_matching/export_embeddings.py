@@ -0,0 +1,111 @@
+"""
+Bulk export of the Pinecone index into an on-disk embedding store
+Lets a local search node warm-start, back up the index or load another vector backend
+without running CLIP over the catalog again.
+
+Usage:
+    python export_embeddings.py --out embeddings/furniture [--dtype float16] [--namespace ""]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from typing import Iterator, List
+
+from pinecone import Pinecone
+
+from config import PINECONE_API_KEY, PINECONE_INDEX_NAME, CLIP_MODEL_NAME
+from embedding_store import EmbeddingStoreWriter, SUPPORTED_DTYPES
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Pinecone caps fetch requests; 100 IDs per call keeps the request URL short
+FETCH_BATCH_SIZE = 100
+
+
+def _field(obj, name: str):
+    """Read a field from a Pinecone response object or a plain dict"""
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def list_vector_ids(index, namespace: str = "") -> Iterator[List[str]]:
+    """Pages of vector IDs in the index (serverless indexes support listing)"""
+    for page in index.list(namespace=namespace):
+        if page:
+            yield list(page)
+
+
+def export_index(index, out_path: str, dimension: int, dtype: str = "float16",
+                 namespace: str = "", batch_size: int = FETCH_BATCH_SIZE) -> int:
+    """
+    Copy every vector and its metadata from ``index`` into a new snapshot at ``out_path``
+
+    Returns:
+        Number of vectors written
+    """
+    start = time.perf_counter()
+    pending: List[str] = []
+    source = f"pinecone:{PINECONE_INDEX_NAME}" + (f"/{namespace}" if namespace else "")
+    with EmbeddingStoreWriter(out_path, dimension, dtype=dtype, model=CLIP_MODEL_NAME, source=source) as writer:
+
+        def flush(ids: List[str]) -> None:
+            vectors = _field(index.fetch(ids=ids, namespace=namespace), "vectors")
+            # fetch returns a mapping; keep the listing order for a stable snapshot
+            found = [vectors[i] for i in ids if i in vectors]
+            if len(found) < len(ids):
+                logger.warning(f"{len(ids) - len(found)} listed vectors were not returned by fetch (deleted meanwhile?)")
+            if found:
+                writer.add(
+                    [_field(v, "id") for v in found],
+                    [_field(v, "values") for v in found],
+                    [_field(v, "metadata") or {} for v in found],
+                )
+
+        for page in list_vector_ids(index, namespace):
+            pending.extend(page)
+            while len(pending) >= batch_size:
+                flush(pending[:batch_size])
+                pending = pending[batch_size:]
+                logger.info(f"Exported {len(writer)} vectors")
+        if pending:
+            flush(pending)
+        count = len(writer)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Wrote {count} vectors to {out_path} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} vectors/s)")
+    return count
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Export the Pinecone index to an on-disk embedding store")
+    parser.add_argument("--out", required=True, help="Snapshot directory to write (replaced atomically)")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float16", help="Storage precision of the vectors")
+    parser.add_argument("--namespace", default="", help="Pinecone namespace to export")
+    parser.add_argument("--batch_size", type=int, default=FETCH_BATCH_SIZE, help="Vector IDs per fetch request")
+    args = parser.parse_args()
+
+    if not PINECONE_API_KEY:
+        logger.error("PINECONE_API_KEY not found in environment variables")
+        sys.exit(1)
+
+    try:
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+        index = pc.Index(PINECONE_INDEX_NAME)
+        stats = index.describe_index_stats()
+        dimension = _field(stats, "dimension")
+        logger.info(f"Exporting {_field(stats, 'total_vector_count')} vectors ({dimension} dimensions) from '{PINECONE_INDEX_NAME}'")
+        export_index(index, args.out, dimension, dtype=args.dtype, namespace=args.namespace, batch_size=args.batch_size)
+    except Exception as e:
+        logger.error(f"❌ Export failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Pinecone-style metadata filters for the local indexes
+
+Supports the operators search and ingest use against Pinecone: $eq, $ne, $gt, $gte, $lt,
+$lte, $in, $nin, $exists, $and and $or. A bare value means $eq. As in Pinecone, a list
+field matches $eq/$in if any of its elements does.
+"""
+
+from typing import Any, Dict, Optional
+
+
+def _compare(op: str, value: Any, target: Any) -> bool:
+    values = value if isinstance(value, list) else [value]
+    if op == "$eq":
+        return target in values
+    if op == "$ne":
+        return target not in values
+    if op == "$in":
+        return any(v in target for v in values)
+    if op == "$nin":
+        return not any(v in target for v in values)
+    try:
+        if op == "$gt":
+            return value > target
+        if op == "$gte":
+            return value >= target
+        if op == "$lt":
+            return value < target
+        if op == "$lte":
+            return value <= target
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def matches_filter(metadata: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    """True if ``metadata`` satisfies the filter (None or {} matches everything)"""
+    if not flt:
+        return True
+    for key, condition in flt.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, c) for c in condition):
+                return False
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, target in condition.items():
+            if op == "$exists":
+                if (key in metadata) != bool(target):
+                    return False
+                continue
+            if key not in metadata:
+                # Missing fields only satisfy negative operators
+                if op in ("$ne", "$nin"):
+                    continue
+                return False
+            if not _compare(op, metadata[key], target):
+                return False
+    return True
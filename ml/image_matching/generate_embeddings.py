@@ -5,12 +5,12 @@ Generates CLIP embeddings for furniture product images and stores them in Pineco
 
 import os
 import sys
+import argparse
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 from PIL import Image
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from pinecone import Pinecone, ServerlessSpec
 import logging
 from tqdm import tqdm
@@ -22,10 +22,22 @@ from config import (
     PINECONE_ENVIRONMENT,
     PINECONE_INDEX_NAME,
     CLIP_MODEL_NAME,
+    CLIP_LOAD_MODE,
     SUPPORTED_IMAGE_FORMATS,
     MAX_IMAGE_SIZE,
-    METADATA_FIELDS
+    METADATA_FIELDS,
+    DEDUP_ENABLED,
+    DEDUP_THRESHOLD,
+    DEDUP_SCOPE,
+    UPSERT_OPTIONS,
+    HASH_INDEX_PATH
 )
+from embedding_store import EmbeddingStoreWriter, SUPPORTED_DTYPES
+from dedup import DuplicateCollapser
+from upsert_writer import UpsertWriter
+from vision_encoder import load_image_model
+from phash import HashIndex, image_hashes
+from prompt_embeddings import load_or_compute
 
 # Setup logging
 logging.basicConfig(
@@ -38,14 +50,20 @@ logger = logging.getLogger(__name__)
 class FurnitureImageEmbedder:
     """Class to handle image embedding generation and Pinecone storage"""
     
-    def __init__(self):
-        """Initialize the embedder with CLIP model and Pinecone client"""
-        logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
+    def __init__(self, use_pinecone: bool = True):
+        """
+        Initialize the embedder with CLIP model and Pinecone client
+
+        Args:
+            use_pinecone: Connect to (or create) the Pinecone index; when False, embeddings
+                are only written to a local embedding store
+        """
         try:
             # Load CLIP model using sentence-transformers
             # sentence-transformers supports CLIP models like "clip-ViT-B-32" or "clip-ViT-L-14"
             # If using OpenAI CLIP directly, you may need transformers library
-            self.model = SentenceTransformer(CLIP_MODEL_NAME)
+            # CLIP_LOAD_MODE=vision loads only the image encoder (no text tower is needed here)
+            self.model = load_image_model(CLIP_LOAD_MODE, CLIP_MODEL_NAME)
             logger.info("CLIP model loaded successfully")
             logger.info(f"Model embedding dimension: {self.model.get_sentence_embedding_dimension()}")
         except Exception as e:
@@ -53,6 +71,18 @@ class FurnitureImageEmbedder:
             logger.error("Note: If using OpenAI CLIP, ensure transformers library is installed")
             logger.error("Alternative: Try 'openai/clip-vit-base-patch32' with transformers library")
             raise
+
+        if hasattr(self.model, "tokenize"):
+            # The text tower is loaded anyway: write the prompt artifact vision-mode workers load
+            try:
+                load_or_compute(model=self.model)
+            except Exception as e:
+                logger.warning(f"Could not build prompt embeddings: {e}")
+        
+        self.index = None
+        if not use_pinecone:
+            logger.info("Pinecone disabled; embeddings go to the local store only")
+            return
         
         # Initialize Pinecone client
         if not PINECONE_API_KEY:
@@ -64,26 +94,31 @@ class FurnitureImageEmbedder:
         # Create or connect to index
         self.index = self._setup_pinecone_index()
         
+    def _embedding_dimension(self) -> int:
+        """Embedding dimension of the loaded model"""
+        # For CLIP models, get_sentence_embedding_dimension() may return None
+        # So we encode a dummy image to get the dimension
+        try:
+            embedding_dimension = self.model.get_sentence_embedding_dimension()
+            if embedding_dimension is None:
+                # Create a dummy image to get dimension
+                dummy_image = Image.new('RGB', MAX_IMAGE_SIZE, color='white')
+                dummy_embedding = self.model.encode(dummy_image, convert_to_numpy=True)
+                embedding_dimension = len(dummy_embedding)
+                logger.info(f"Got embedding dimension from dummy image: {embedding_dimension}")
+            else:
+                logger.info(f"Got embedding dimension from model: {embedding_dimension}")
+        except Exception as e:
+            logger.warning(f"Could not get dimension from model method, using default: {e}")
+            # CLIP-ViT-L-14 default dimension is 768
+            embedding_dimension = 768
+        return embedding_dimension
+    
     def _setup_pinecone_index(self):
         """Setup or connect to Pinecone index"""
         try:
             # Get embedding dimension from model first
-            # For CLIP models, get_sentence_embedding_dimension() may return None
-            # So we encode a dummy image to get the dimension
-            try:
-                embedding_dimension = self.model.get_sentence_embedding_dimension()
-                if embedding_dimension is None:
-                    # Create a dummy image to get dimension
-                    dummy_image = Image.new('RGB', MAX_IMAGE_SIZE, color='white')
-                    dummy_embedding = self.model.encode(dummy_image, convert_to_numpy=True)
-                    embedding_dimension = len(dummy_embedding)
-                    logger.info(f"Got embedding dimension from dummy image: {embedding_dimension}")
-                else:
-                    logger.info(f"Got embedding dimension from model: {embedding_dimension}")
-            except Exception as e:
-                logger.warning(f"Could not get dimension from model method, using default: {e}")
-                # CLIP-ViT-L-14 default dimension is 768
-                embedding_dimension = 768
+            embedding_dimension = self._embedding_dimension()
             
             # Check if index exists
             existing_indexes = [idx.name for idx in self.pc.list_indexes()]
@@ -186,15 +221,27 @@ class FurnitureImageEmbedder:
             "filename": image_path.name,
             "category": "furniture",
             "filepath": str(image_path.relative_to(FURNITURE_IMAGES_PATH.parent.parent.parent)),
-            "image_size": f"{image.size[0]}x{image.size[1]}"
+            "image_size": f"{image.size[0]}x{image.size[1]}",
+            # Perceptual hashes for the API's exact-match fast path (phash.py)
+            **image_hashes(image)
         }
     
-    def process_images(self, batch_size: int = 32) -> Dict[str, Any]:
+    def process_images(self, batch_size: int = 32, store_path: Optional[str] = None,
+                       store_dtype: str = "float16",
+                       dedup_threshold: Optional[float] = None,
+                       hash_index_path: Optional[str] = None) -> Dict[str, Any]:
         """
         Process all furniture images and upload to Pinecone
         
         Args:
             batch_size: Number of images to process in each batch
+            store_path: Also write every embedding to an on-disk embedding store here
+                (the snapshot replaces the previous one once all batches succeed)
+            store_dtype: Storage precision of the store ("float16" or "float32")
+            dedup_threshold: Collapse images at least this cosine-similar to one already
+                indexed (or processed earlier in this run) into aliases of it; None disables
+            hash_index_path: Merge the images' perceptual hashes into the hash index here
+                (HASH_INDEX_PATH for the search fast path); None skips it
             
         Returns:
             Dictionary with processing statistics
@@ -203,16 +250,33 @@ class FurnitureImageEmbedder:
         
         if not image_files:
             logger.warning("No images found to process")
-            return {"processed": 0, "failed": 0, "skipped": 0}
+            return {"processed": 0, "failed": 0, "skipped": 0, "duplicates_collapsed": 0}
         
+        hash_entries = []  # (vector ID, hashes, vector to query with)
+
         processed_count = 0
         failed_count = 0
         skipped_count = 0
         
+        collapser = None
+        if dedup_threshold is not None:
+            collapser = DuplicateCollapser(self.index, dedup_threshold, scope=DEDUP_SCOPE)
+        
+        store = None
+        if store_path:
+            store = EmbeddingStoreWriter(
+                store_path, self._embedding_dimension(), dtype=store_dtype,
+                model=CLIP_MODEL_NAME, source=str(FURNITURE_IMAGES_PATH)
+            )
+        
+        # Upserts run in the background while the next batch is embedded
+        writer = UpsertWriter(self.index, **UPSERT_OPTIONS) if self.index is not None else None
+        
         # Process images in batches
         for i in tqdm(range(0, len(image_files), batch_size), desc="Processing batches"):
             batch_files = image_files[i:i + batch_size]
             vectors_to_upsert = []
+            vectors_to_store = []
             
             for image_path in batch_files:
                 try:
@@ -228,12 +292,31 @@ class FurnitureImageEmbedder:
                     # Create unique ID (using filename + hash of path)
                     vector_id = f"furniture_{image_path.stem}_{hash(str(image_path))}"
                     
-                    # Prepare vector for upsert
-                    vectors_to_upsert.append({
+                    vector = {
                         "id": vector_id,
                         "values": embedding.tolist(),
                         "metadata": metadata
-                    })
+                    }
+                    
+                    hashes = {"dhash": metadata["dhash"], "ahash": metadata["ahash"]}
+                    status, canonical_id = "new", None
+                    if collapser is not None:
+                        status, canonical_id = collapser.check(vector_id, embedding, metadata)
+                    # Collapsed images are answered with the vector they were collapsed into
+                    hash_key = canonical_id if status == "indexed" else vector_id
+                    hash_entries.append((hash_key, hashes, canonical_id or vector_id))
+                    
+                    if status == "duplicate":
+                        continue
+                    if status == "indexed":
+                        # Same file already in the index: keep it in the store under its ID
+                        vectors_to_store.append({**vector, "id": canonical_id})
+                        skipped_count += 1
+                        continue
+                    
+                    # Prepare vector for upsert
+                    vectors_to_upsert.append(vector)
+                    vectors_to_store.append(vector)
                     
                     processed_count += 1
                     
@@ -242,28 +325,74 @@ class FurnitureImageEmbedder:
                     failed_count += 1
                     continue
             
-            # Upsert batch to Pinecone
-            if vectors_to_upsert:
-                try:
-                    self.index.upsert(vectors=vectors_to_upsert)
-                    logger.info(f"Upserted batch of {len(vectors_to_upsert)} vectors")
-                except Exception as e:
-                    logger.error(f"Error upserting batch to Pinecone: {e}")
-                    failed_count += len(vectors_to_upsert)
-                    processed_count -= len(vectors_to_upsert)
+            if store is not None and vectors_to_store:
+                store.add(
+                    [v["id"] for v in vectors_to_store],
+                    [v["values"] for v in vectors_to_store],
+                    [v["metadata"] for v in vectors_to_store]
+                )
+            
+            # Queue batch for upsert to Pinecone
+            if vectors_to_upsert and writer is not None:
+                writer.add(vectors_to_upsert)
+        
+        if writer is not None:
+            # Vectors that failed after retries are in the spill file, ready for --resume
+            upsert_report = writer.close()
+            failed_count += upsert_report["failed"]
+            processed_count -= upsert_report["failed"]
+            logger.info(f"Upserted {upsert_report['upserted']} vectors in {upsert_report['chunks']} requests "
+                        f"({upsert_report['vectors_per_second']:.0f} vectors/s, {upsert_report['retries']} retries)")
         
         stats = {
             "processed": processed_count,
             "failed": failed_count,
             "skipped": skipped_count,
+            "duplicates_collapsed": 0,
             "total_images": len(image_files)
         }
+        if writer is not None:
+            stats["upsert"] = upsert_report
+        
+        if collapser is not None:
+            # Record aliases once every canonical vector has been upserted
+            stats["duplicates_collapsed"] = collapser.collapsed
+            if store is not None:
+                for canonical_id, fields in collapser.alias_metadata().items():
+                    store.update_metadata(canonical_id, fields)
+            collapser.flush()
+        
+        if hash_index_path and hash_entries:
+            stats["hashed"] = self._merge_hash_index(hash_index_path, hash_entries)
+        
+        if store is not None:
+            stats["stored"] = len(store)
+            store.close()
+            logger.info(f"Wrote {stats['stored']} embeddings to store: {store_path}")
         
         logger.info(f"Processing complete. Stats: {stats}")
         return stats
     
+    def _merge_hash_index(self, path, entries) -> int:
+        """
+        Replace the catalog entries (no product ID) of the hash index at ``path`` with this run's
+        
+        Entries of products added through /add-product are kept. The search API loads the
+        index at startup, so restart it to serve the new hashes.
+        """
+        hash_index = HashIndex.load(path)
+        removed = hash_index.remove_product("")
+        for vector_id, hashes, target_id in entries:
+            hash_index.add(vector_id, hashes, target_id)
+        hash_index.save(path)
+        logger.info(f"Hash index {path}: {len(entries)} catalog image hashes "
+                    f"(replaced {removed}), {len(hash_index)} entries in total")
+        return len(entries)
+    
     def get_index_stats(self) -> Dict[str, Any]:
         """Get statistics about the Pinecone index"""
+        if self.index is None:
+            return {}
         try:
             stats = self.index.describe_index_stats()
             return stats
@@ -274,17 +403,35 @@ class FurnitureImageEmbedder:
 
 def main():
     """Main function to run the embedding generation"""
+    parser = argparse.ArgumentParser(description="Generate CLIP embeddings for the furniture images")
+    parser.add_argument("--batch_size", type=int, default=32, help="Images per batch")
+    parser.add_argument("--store", type=str, default=None, help="Also write an on-disk embedding store to this directory")
+    parser.add_argument("--store_dtype", choices=SUPPORTED_DTYPES, default="float16", help="Storage precision of the store")
+    parser.add_argument("--no_pinecone", action="store_true", help="Only write the local store (requires --store)")
+    parser.add_argument("--dedup_threshold", type=float, default=DEDUP_THRESHOLD, help="Cosine similarity above which an image is collapsed into an existing one")
+    parser.add_argument("--no_dedup", action="store_true", help="Index every image, even near-duplicates")
+    parser.add_argument("--hash_index", type=str, default=str(HASH_INDEX_PATH), help="Hash index for the search fast path to merge the images' hashes into")
+    parser.add_argument("--no_hash_index", action="store_true", help="Do not update the hash index")
+    args = parser.parse_args()
+    if args.no_pinecone and not args.store:
+        parser.error("--no_pinecone requires --store")
+    
     try:
         logger.info("=" * 60)
         logger.info("Furniture Image Embedding Generation")
         logger.info("=" * 60)
         
         # Initialize embedder
-        embedder = FurnitureImageEmbedder()
+        embedder = FurnitureImageEmbedder(use_pinecone=not args.no_pinecone)
         
         # Process images
         logger.info("Starting image processing...")
-        stats = embedder.process_images(batch_size=32)
+        dedup_threshold = None if args.no_dedup or not DEDUP_ENABLED else args.dedup_threshold
+        stats = embedder.process_images(
+            batch_size=args.batch_size, store_path=args.store, store_dtype=args.store_dtype,
+            dedup_threshold=dedup_threshold,
+            hash_index_path=None if args.no_hash_index else args.hash_index
+        )
         
         # Display results
         logger.info("=" * 60)
@@ -292,7 +439,8 @@ def main():
         logger.info(f"  Total images found: {stats['total_images']}")
         logger.info(f"  Successfully processed: {stats['processed']}")
         logger.info(f"  Failed: {stats['failed']}")
-        logger.info(f"  Skipped: {stats['skipped']}")
+        logger.info(f"  Skipped (already indexed): {stats['skipped']}")
+        logger.info(f"  Near-duplicates collapsed: {stats['duplicates_collapsed']}")
         
         # Get index stats
         logger.info("\nPinecone Index Statistics:")
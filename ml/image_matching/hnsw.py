@@ -0,0 +1,511 @@
+"""
+Hierarchical navigable small world (HNSW) graph for approximate nearest-neighbour search
+
+Exact scoring touches every vector per query. HNSW keeps a layered proximity graph instead:
+each vector is linked to about ``M`` close neighbours (``2 * M`` on the bottom layer), upper
+layers hold exponentially fewer vectors, and a query descends greedily from the top layer
+and then runs a best-first search of width ``ef_search`` on the bottom layer, so it touches a
+few thousand vectors whatever the catalog size.
+
+    M                 links per vector; more links raise recall and memory (default 16)
+    ef_construction   search width while inserting; higher builds a better graph, slower
+    ef_search         search width per query; the recall/latency knob at serving time
+
+Vectors are L2-normalized and scored by cosine similarity, like the Pinecone index. Queries
+return Pinecone-shaped responses ({"matches": [{"id", "score", "metadata"}]}) and accept
+Pinecone-style metadata filters (see filters.py). Re-inserting an ID replaces its vector;
+the old node stays in the graph as a routing point but is never returned.
+
+With a ``projection`` (a dim x dimension basis fitted by projection.py), queries walk the
+graph with reduced vectors and rescore the ``ef_search`` candidates they collect at full
+dimension; the graph itself is always built at full dimension.
+
+Usage:
+    python hnsw.py build --store embeddings/furniture --out indexes/furniture
+    python hnsw.py sweep --store embeddings/furniture --ef 16 32 64 128 256 --k 10
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, replace_directory
+from filters import matches_filter
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "index.json"
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+# A filtered query whose search found fewer than top_k matches retries with this much wider
+# search, and scans the matching vectors exactly once the width reaches the index size
+FILTER_EF_GROWTH = 4
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors.reshape(-1, vectors.shape[-1])
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class HnswIndex:
+    """
+    In-memory HNSW graph with incremental inserts and directory persistence
+
+    Usage:
+        index = HnswIndex(dimension=768)
+        index.add(ids, vectors, metadata)
+        index.query(vector, top_k=5, filter={"category": "chair"})
+        index.save("indexes/furniture")
+        index = HnswIndex.load("indexes/furniture")
+    """
+
+    def __init__(self, dimension: int, M: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+                 ef_search: int = DEFAULT_EF_SEARCH, seed: int = 0, projection: Optional[np.ndarray] = None):
+        if M < 2:
+            raise ValueError(f"M must be at least 2, got {M}")
+        self.dimension = int(dimension)
+        self.M = int(M)
+        self.max_links0 = 2 * self.M
+        self.ef_construction = int(ef_construction)
+        self.ef_search = int(ef_search)
+        self._level_mult = 1.0 / math.log(self.M)
+        self._rng = np.random.default_rng(seed)
+
+        self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._deleted: List[bool] = []
+        # _links[node][level] -> neighbour nodes on that level
+        self._links: List[List[List[int]]] = []
+        self._node_of: Dict[str, int] = {}
+        self._entry = -1
+        self._max_level = -1
+        self._components: Optional[np.ndarray] = None
+        self._reduced: Optional[np.ndarray] = None
+        self.set_projection(projection)
+
+    def set_projection(self, components: Optional[np.ndarray]) -> None:
+        """Walk the graph in the subspace spanned by ``components``' rows; None walks at full dimension"""
+        if components is None:
+            self._components = self._reduced = None
+            return
+        components = np.asarray(components, dtype=np.float32)
+        if components.ndim != 2 or components.shape[1] != self.dimension:
+            raise ValueError(f"Projection must be (dim x {self.dimension}), got {components.shape}")
+        self._components = components
+        self._reduced = self._vectors @ components.T
+
+    @property
+    def projection_dim(self) -> Optional[int]:
+        return None if self._components is None else len(self._components)
+
+    def __len__(self) -> int:
+        return len(self._node_of)
+
+    @property
+    def node_count(self) -> int:
+        """Graph nodes, including replaced and deleted vectors kept for routing"""
+        return len(self._ids)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self._node_of
+
+    def ids(self) -> List[str]:
+        return list(self._node_of)
+
+    def vector(self, vector_id: str) -> np.ndarray:
+        return self._vectors[self._node_of[vector_id]].copy()
+
+    def metadata(self, vector_id: str) -> Dict[str, Any]:
+        return dict(self._metadata[self._node_of[vector_id]])
+
+    @property
+    def deleted_fraction(self) -> float:
+        """Share of graph nodes that only route searches (replaced or deleted vectors)"""
+        return 1.0 - len(self) / max(self.node_count, 1)
+
+    def copy(self) -> "HnswIndex":
+        """Independent copy of the graph, for building a new version while this one serves"""
+        clone = HnswIndex(self.dimension, self.M, self.ef_construction, self.ef_search, projection=self._components)
+        clone._rng = np.random.default_rng(self._rng.integers(2 ** 32))
+        clone._vectors = self._vectors[:self.node_count].copy()
+        clone._ids = list(self._ids)
+        clone._metadata = list(self._metadata)
+        clone._deleted = list(self._deleted)
+        clone._links = [[list(links) for links in node] for node in self._links]
+        clone._node_of = dict(self._node_of)
+        clone._entry, clone._max_level = self._entry, self._max_level
+        if self._reduced is not None:
+            clone._reduced = self._reduced[:self.node_count].copy()
+        return clone
+
+    # Insertion
+
+    def _grow(self, needed: int) -> None:
+        if needed <= len(self._vectors):
+            return
+        grown = np.zeros((max(needed, 1024, 2 * len(self._vectors)), self.dimension), dtype=np.float32)
+        grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+        self._vectors = grown
+        if self._reduced is not None:
+            reduced = np.zeros((len(grown), self._reduced.shape[1]), dtype=np.float32)
+            reduced[:len(self._ids)] = self._reduced[:len(self._ids)]
+            self._reduced = reduced
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+
+    def _search_layer(self, query: np.ndarray, entry_points: Sequence[int], ef: int, level: int,
+                      vectors: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """Best-first search on one layer; returns up to ``ef`` (similarity, node), best first"""
+        vectors = self._vectors if vectors is None else vectors
+        links = self._links
+        visited = set(entry_points)
+        entry_scores = vectors[list(entry_points)] @ query
+        candidates = [(-float(s), n) for s, n in zip(entry_scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), n) for s, n in zip(entry_scores, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbours = [n for n in links[node][level] if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            scores = vectors[neighbours] @ query
+            for score, neighbour in zip(scores.tolist(), neighbours):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbour))
+                    heapq.heappush(results, (score, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbours(self, candidates: List[Tuple[float, int]], limit: int) -> List[int]:
+        """
+        Diversity heuristic from the HNSW paper: keep a candidate only if it is closer to the
+        base vector than to every neighbour kept so far, then top up with the closest skipped
+        ones. Links then point in different directions, which keeps clustered catalogs
+        (many photos of one product) navigable.
+        """
+        if len(candidates) <= limit:
+            return [n for _, n in candidates]
+        block = self._vectors[[n for _, n in candidates]]
+        scores = np.array([s for s, _ in candidates], dtype=np.float32)
+        # dominated[i][j]: candidate i is closer to candidate j than to the base vector
+        dominated = ((block @ block.T) > scores[:, None]).tolist()
+        kept: List[int] = []
+        skipped: List[int] = []
+        for i, row in enumerate(dominated):
+            if len(kept) >= limit:
+                break
+            if any(row[j] for j in kept):
+                skipped.append(i)
+            else:
+                kept.append(i)
+        return [candidates[i][1] for i in kept + skipped[:limit - len(kept)]]
+
+    def _link(self, node: int, neighbours: List[int], level: int) -> None:
+        self._links[node][level] = neighbours
+        limit = self.max_links0 if level == 0 else self.M
+        for neighbour in neighbours:
+            links = self._links[neighbour][level]
+            links.append(node)
+            if len(links) > limit:
+                scores = self._vectors[links] @ self._vectors[neighbour]
+                ranked = sorted(zip(scores.tolist(), links), reverse=True)
+                self._links[neighbour][level] = self._select_neighbours(ranked, limit)
+
+    def _insert(self, vector_id: str, vector: np.ndarray, metadata: Dict[str, Any]) -> None:
+        previous = self._node_of.get(vector_id)
+        if previous is not None:
+            self._deleted[previous] = True
+        node = len(self._ids)
+        self._grow(node + 1)
+        self._vectors[node] = vector
+        if self._reduced is not None:
+            self._reduced[node] = self._components @ vector
+        self._ids.append(vector_id)
+        self._metadata.append(dict(metadata))
+        self._deleted.append(False)
+        self._node_of[vector_id] = node
+        level = self._random_level()
+        self._links.append([[] for _ in range(level + 1)])
+
+        if self._entry < 0:
+            self._entry, self._max_level = node, level
+            return
+        entry = [self._entry]
+        for layer in range(self._max_level, level, -1):
+            entry = [self._search_layer(vector, entry, 1, layer)[0][1]]
+        for layer in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(vector, entry, self.ef_construction, layer)
+            self._link(node, self._select_neighbours(found, self.max_links0 if layer == 0 else self.M), layer)
+            entry = [n for _, n in found]
+        if level > self._max_level:
+            self._entry, self._max_level = node, level
+
+    def add(self, ids: Sequence[str], vectors, metadata: Optional[Sequence[Dict[str, Any]]] = None) -> None:
+        """Insert vectors (normalized here); an existing ID is replaced"""
+        vectors = _normalize_rows(vectors)
+        if vectors.shape != (len(ids), self.dimension):
+            raise ValueError(f"Expected {len(ids)} vectors of dimension {self.dimension}, got {vectors.shape}")
+        metadata = metadata if metadata is not None else [{}] * len(ids)
+        for vector_id, vector, meta in zip(ids, vectors, metadata):
+            self._insert(str(vector_id), vector, meta or {})
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """Hide vectors from results; their nodes keep routing searches until the next rebuild"""
+        removed = 0
+        for vector_id in ids:
+            node = self._node_of.pop(str(vector_id), None)
+            if node is not None:
+                self._deleted[node] = True
+                removed += 1
+        return removed
+
+    def update_metadata(self, vector_id: str, fields: Dict[str, Any]) -> bool:
+        node = self._node_of.get(vector_id)
+        if node is None:
+            return False
+        self._metadata[node] = {**self._metadata[node], **fields}
+        return True
+
+    # Search
+
+    def _live(self, node: int, flt: Optional[Dict[str, Any]], exclude: Optional[AbstractSet[str]]) -> bool:
+        return (not self._deleted[node] and (not exclude or self._ids[node] not in exclude)
+                and matches_filter(self._metadata[node], flt))
+
+    def search(self, query, top_k: int = 5, flt: Optional[Dict[str, Any]] = None, ef: Optional[int] = None,
+               exclude: Optional[AbstractSet[str]] = None) -> List[Tuple[int, float]]:
+        """
+        (node, cosine similarity) of the best ``top_k`` live vectors matching the filter
+
+        IDs in ``exclude`` are skipped like filtered-out vectors (tiered_index.py passes the
+        IDs its fresh segment has replaced or deleted).
+        """
+        if top_k <= 0 or not self._node_of:
+            return []
+        query = _normalize_rows(query)[0]
+        ef = max(ef or self.ef_search, top_k)
+        vectors, walk_query = self._vectors, query
+        if self._components is not None:
+            vectors, walk_query = self._reduced, self._components @ query
+        entry = [self._entry]
+        for layer in range(self._max_level, 0, -1):
+            entry = [self._search_layer(walk_query, entry, 1, layer, vectors)[0][1]]
+        while True:
+            candidates = self._search_layer(walk_query, entry, ef, 0, vectors)
+            if self._components is not None:
+                # Rescore the shortlist at full dimension
+                nodes = [n for _, n in candidates]
+                candidates = sorted(zip((self._vectors[nodes] @ query).tolist(), nodes), reverse=True)
+            found = [(n, s) for s, n in candidates if self._live(n, flt, exclude)]
+            if len(found) >= top_k or ef >= self.node_count:
+                return found[:top_k]
+            if ef * FILTER_EF_GROWTH >= self.node_count:
+                # Selective filter: the graph walk would visit most nodes anyway
+                return self.exact_search(query, top_k, flt, exclude)
+            ef *= FILTER_EF_GROWTH
+
+    def exact_search(self, query, top_k: int = 5, flt: Optional[Dict[str, Any]] = None,
+                     exclude: Optional[AbstractSet[str]] = None) -> List[Tuple[int, float]]:
+        """Brute-force reference with the same result format as ``search``"""
+        query = _normalize_rows(query)[0]
+        nodes = np.array([n for n in self._node_of.values() if self._live(n, flt, exclude)], dtype=np.int64)
+        if top_k <= 0 or len(nodes) == 0:
+            return []
+        scores = self._vectors[nodes] @ query
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [(int(nodes[i]), float(scores[i])) for i in order]
+
+    def query(self, vector, top_k: int = 5, filter: Optional[Dict[str, Any]] = None,
+              include_metadata: bool = True, ef: Optional[int] = None) -> Dict[str, Any]:
+        """Pinecone-shaped query: {"matches": [{"id", "score", "metadata"}]}"""
+        return {"matches": [self.match(node, score, include_metadata) for node, score in self.search(vector, top_k, filter, ef)]}
+
+    def match(self, node: int, score: float, include_metadata: bool = True) -> Dict[str, Any]:
+        match = {"id": self._ids[node], "score": score}
+        if include_metadata:
+            match["metadata"] = dict(self._metadata[node])
+        return match
+
+    # Persistence
+
+    def save(self, path) -> None:
+        """
+        Write the index to a directory, replacing any previous save atomically
+
+        Every node is written, including replaced and deleted ones: their vectors and links
+        stay in the saved graph and ``deleted.npy`` flags them, so the reloaded index routes
+        searches through them exactly as before while never returning them.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent))
+        count = self.node_count
+        np.save(staging / "vectors.npy", self._vectors[:count])
+        np.save(staging / "ids.npy", np.array(self._ids, dtype=str))
+        np.save(staging / "deleted.npy", np.array(self._deleted, dtype=bool))
+        levels = np.array([len(links) - 1 for links in self._links], dtype=np.int32)
+        np.save(staging / "levels.npy", levels)
+        for level in range(self._max_level + 1):
+            # One CSR adjacency per layer over all nodes (empty rows for nodes below it)
+            rows = [links[level] if len(links) > level else [] for links in self._links]
+            np.save(staging / f"links_{level}_offsets.npy", np.cumsum([0] + [len(r) for r in rows], dtype=np.int64))
+            np.save(staging / f"links_{level}.npy", np.array([n for r in rows for n in r], dtype=np.int32))
+        with open(staging / "metadata.jsonl", "w", encoding="utf-8") as f:
+            for meta in self._metadata:
+                f.write(json.dumps(meta) + "\n")
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "dimension": self.dimension,
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "count": len(self),
+            "nodes": count,
+            "entry": self._entry,
+            "max_level": self._max_level,
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(staging / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        replace_directory(staging, path)
+
+    @classmethod
+    def load(cls, path, ef_search: Optional[int] = None, projection: Optional[np.ndarray] = None) -> "HnswIndex":
+        path = Path(path)
+        with open(path / MANIFEST_FILE, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {manifest.get('format_version')} in {path}")
+        index = cls(manifest["dimension"], manifest["M"], manifest["ef_construction"],
+                    ef_search or manifest["ef_search"])
+        index._vectors = np.load(path / "vectors.npy")
+        index._ids = [str(i) for i in np.load(path / "ids.npy")]
+        index._deleted = np.load(path / "deleted.npy").tolist()
+        with open(path / "metadata.jsonl", encoding="utf-8") as f:
+            index._metadata = [json.loads(line) for line in f]
+        levels = np.load(path / "levels.npy")
+        index._links = [[None] * (int(level) + 1) for level in levels]
+        for level in range(manifest["max_level"] + 1):
+            offsets = np.load(path / f"links_{level}_offsets.npy")
+            flat = np.load(path / f"links_{level}.npy").tolist()
+            for node in np.flatnonzero(levels >= level):
+                index._links[node][level] = flat[offsets[node]:offsets[node + 1]]
+        index._node_of = {vector_id: node for node, vector_id in enumerate(index._ids) if not index._deleted[node]}
+        index._entry, index._max_level = manifest["entry"], manifest["max_level"]
+        index.set_projection(projection)
+        return index
+
+    @classmethod
+    def from_store(cls, store: EmbeddingStore, log_every: int = 10000, **params) -> "HnswIndex":
+        """Build an index over every vector of an embedding store snapshot"""
+        index = cls(store.dimension, **params)
+        start = time.perf_counter()
+        for row in range(store.count):
+            index._insert(str(store.ids[row]), _normalize_rows(store.vectors[row])[0], store.metadata(row))
+            if log_every and (row + 1) % log_every == 0:
+                logger.info(f"Inserted {row + 1}/{store.count} vectors ({time.perf_counter() - start:.0f}s)")
+        return index
+
+
+def sweep(store_path, ef_values: Sequence[int], k: int = 10, n_queries: int = 200, M: int = DEFAULT_M,
+          ef_construction: int = DEFAULT_EF_CONSTRUCTION, index_path=None,
+          queries: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    recall@k and latency of the graph search per ``ef_search``, against exact search
+
+    Builds the graph from the snapshot unless ``index_path`` holds a saved index.
+    """
+    from projection import _latency, sample_queries
+
+    store = EmbeddingStore(store_path)
+    if index_path and (Path(index_path) / MANIFEST_FILE).exists():
+        index, build_seconds = HnswIndex.load(index_path), None
+    else:
+        start = time.perf_counter()
+        index = HnswIndex.from_store(store, M=M, ef_construction=ef_construction)
+        build_seconds = time.perf_counter() - start
+        if index_path:
+            index.save(index_path)
+    if queries is None:
+        queries = sample_queries(store, n_queries)
+
+    exact = [{m["id"] for m in store.search(q, k)} for q in queries]
+    rows = [{"method": "exact", "ef_search": None, f"recall@{k}": 1.0, **_latency(lambda q: store.search(q, k), queries)}]
+    for ef in ef_values:
+        found = [{index._ids[n] for n, _ in index.search(q, k, ef=ef)} for q in queries]
+        recall = float(np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, exact)]))
+        rows.append({"method": "hnsw", "ef_search": ef, f"recall@{k}": recall,
+                     **_latency(lambda q: index.search(q, k, ef=ef), queries)})
+    return {"count": len(index), "M": index.M, "ef_construction": index.ef_construction,
+            "build_seconds": build_seconds, "results": rows}
+
+
+def main():
+    """Build an HNSW index from a snapshot or sweep ef_search against exact search"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="HNSW approximate nearest-neighbour index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="Build an index from an embedding store snapshot")
+    sweep_parser = sub.add_parser("sweep", help="recall@k and latency per ef_search against exact search")
+    for p in (build_parser, sweep_parser):
+        p.add_argument("--store", required=True, help="Embedding store snapshot")
+        p.add_argument("--M", type=int, default=DEFAULT_M, help="Links per vector")
+        p.add_argument("--ef_construction", type=int, default=DEFAULT_EF_CONSTRUCTION, help="Search width while inserting")
+    build_parser.add_argument("--out", required=True, help="Index directory to write (replaced atomically)")
+    build_parser.add_argument("--ef_search", type=int, default=DEFAULT_EF_SEARCH, help="Default search width per query")
+    sweep_parser.add_argument("--index", type=str, default=None, help="Reuse (or save) the built index here")
+    sweep_parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256], help="ef_search values")
+    sweep_parser.add_argument("--k", type=int, default=10, help="Results per query")
+    sweep_parser.add_argument("--queries", type=str, default=None, help="Query vectors (.npy); default: perturbed catalog vectors")
+    sweep_parser.add_argument("--n_queries", type=int, default=200, help="Number of sampled queries")
+    sweep_parser.add_argument("--out", type=str, default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            store = EmbeddingStore(args.store)
+            start = time.perf_counter()
+            index = HnswIndex.from_store(store, M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search)
+            index.save(args.out)
+            logger.info(f"✅ Indexed {len(index)} vectors in {time.perf_counter() - start:.1f}s into {args.out}")
+            return
+        queries = np.load(args.queries) if args.queries else None
+        report = sweep(args.store, args.ef, args.k, args.n_queries, args.M, args.ef_construction, args.index, queries)
+        if report["build_seconds"] is not None:
+            print(f"Built M={report['M']} ef_construction={report['ef_construction']} over {report['count']} vectors "
+                  f"in {report['build_seconds']:.1f}s")
+        print(f"{'ef':>6} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}  method")
+        for row in report["results"]:
+            print(f"{row['ef_search'] or '-':>6} {row[f'recall@{args.k}']:>10.4f} {row['latency_p50_ms']:>8.2f} "
+                  f"{row['latency_p95_ms']:>8.2f}  {row['method']}")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    except Exception as e:
+        logger.error(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Priority scheduling of CLIP inference
+
+Customer searches, recommendation lookups and bulk ingestion (the /add-product worker, which
+the admin reindex feeds) share one model and CPU. Every model call goes through an
+InferenceScheduler, which runs at most ``slots`` calls at once and picks the next waiting
+call by class:
+
+- interactive (customer /search-by-image) before recommendation before bulk;
+- unless a waiting class has had less than its share of recent inference time (decayed
+  with a half-life of ``half_life`` seconds); that class goes first, so lower classes keep
+  a minimum share under sustained load instead of starving.
+
+Bulk work is encoded in chunks of a few images, each scheduled separately, so a large batch
+is preempted at chunk boundaries: a search arriving mid-batch waits for at most one chunk.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+INTERACTIVE = "interactive"
+RECOMMENDATION = "recommendation"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, RECOMMENDATION, BULK)
+
+DEFAULT_SHARES = {INTERACTIVE: 0.7, RECOMMENDATION: 0.2, BULK: 0.1}
+DEFAULT_HALF_LIFE = 10.0
+
+
+class InferenceScheduler:
+    """
+    Priority classes with minimum shares over a fixed number of inference slots
+
+    Usage:
+        scheduler = InferenceScheduler({"interactive": 0.7, "recommendation": 0.2, "bulk": 0.1})
+        embedding = scheduler.encode(model, image, INTERACTIVE, convert_to_numpy=True)
+        embeddings = scheduler.encode(model, images, BULK, chunk_size=4, convert_to_numpy=True)
+    """
+
+    def __init__(self, shares: Optional[Dict[str, float]] = None, slots: int = 1,
+                 half_life: float = DEFAULT_HALF_LIFE):
+        shares = shares or DEFAULT_SHARES
+        self.shares = {p: max(0.0, float(shares.get(p, 0.0))) for p in PRIORITIES}
+        self.slots = max(1, slots)
+        self.half_life = half_life
+        self._cond = threading.Condition()
+        self._waiting: Dict[str, deque] = {p: deque() for p in PRIORITIES}
+        self._running = 0
+        self._usage = {p: 0.0 for p in PRIORITIES}
+        self._usage_at = time.perf_counter()
+        self._stats = {p: {"runs": 0, "busy_seconds": 0.0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                           "preempted_by_higher": 0} for p in PRIORITIES}
+
+    def _next_class(self) -> Optional[str]:
+        waiting = [p for p in PRIORITIES if self._waiting[p]]
+        if not waiting:
+            return None
+        total = sum(self._usage.values())
+        if total > 0:
+            starved = [p for p in waiting if self._usage[p] / total < self.shares[p]]
+            if starved:
+                return starved[0]
+        return waiting[0]
+
+    def acquire(self, priority: str) -> None:
+        if priority not in self._waiting:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(PRIORITIES)}")
+        ticket = object()
+        start = time.perf_counter()
+        with self._cond:
+            self._waiting[priority].append(ticket)
+            while not (self._running < self.slots and self._next_class() == priority
+                       and self._waiting[priority][0] is ticket):
+                self._cond.wait()
+            self._waiting[priority].popleft()
+            self._running += 1
+            # Lower classes still waiting were passed over (e.g. bulk at a chunk boundary)
+            for other in PRIORITIES[PRIORITIES.index(priority) + 1:]:
+                if self._waiting[other]:
+                    self._stats[other]["preempted_by_higher"] += 1
+            waited = time.perf_counter() - start
+            stats = self._stats[priority]
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+            # Wake the next waiter if slots remain
+            self._cond.notify_all()
+
+    def release(self, priority: str, busy_seconds: float) -> None:
+        with self._cond:
+            now = time.perf_counter()
+            decay = 0.5 ** ((now - self._usage_at) / self.half_life)
+            for p in PRIORITIES:
+                self._usage[p] *= decay
+            self._usage_at = now
+            self._usage[priority] += busy_seconds
+            self._stats[priority]["runs"] += 1
+            self._stats[priority]["busy_seconds"] += busy_seconds
+            self._running -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str):
+        """Hold an inference slot for one model call"""
+        self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(priority, time.perf_counter() - start)
+
+    def encode(self, model, images, priority: str, chunk_size: Optional[int] = None, **kwargs):
+        """
+        ``model.encode`` scheduled under ``priority``
+
+        A list of images is encoded ``chunk_size`` at a time (all at once if omitted), each
+        chunk in its own slot; the chunks' embeddings are returned as one array.
+        """
+        if not isinstance(images, list):
+            with self.slot(priority):
+                return model.encode(images, **kwargs)
+        chunk_size = chunk_size or max(1, len(images))
+        parts = []
+        for start in range(0, len(images), chunk_size):
+            with self.slot(priority):
+                parts.append(np.asarray(model.encode(images[start:start + chunk_size], **kwargs)))
+        return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            total = sum(self._usage.values())
+            classes = {}
+            for p in PRIORITIES:
+                stats = self._stats[p]
+                classes[p] = {
+                    "waiting": len(self._waiting[p]),
+                    "share": self.shares[p],
+                    "recent_share": round(self._usage[p] / total, 3) if total > 0 else 0.0,
+                    "runs": stats["runs"],
+                    "busy_seconds": round(stats["busy_seconds"], 3),
+                    "avg_wait_ms": round(1000.0 * stats["wait_seconds"] / stats["runs"], 1) if stats["runs"] else 0.0,
+                    "max_wait_ms": round(1000.0 * stats["max_wait_seconds"], 1),
+                    "preempted_by_higher": stats["preempted_by_higher"],
+                }
+            return {"slots": self.slots, "running": self._running, "classes": classes}
@@ -0,0 +1,224 @@
+"""
+Background queue for product image ingestion
+
+``/add-product`` used to decode and embed every image inside the HTTP request, so a burst of
+admin edits competed with live searches and every edit of a product was embedded again. Jobs
+are now queued and drained by one worker thread:
+
+- A job submitted while an earlier job for the same product is still queued replaces it in
+  place; the earlier job is marked "superseded" and only the latest version is embedded.
+- The worker takes queued jobs in submission order until they hold ``batch_images`` images
+  (or nothing else is queued) and hands them to the processing callback together, so the
+  model encodes one batch for several small jobs.
+
+- With ``max_queued`` set, a job for a product that is not already queued is refused with
+  QueueFull once that many jobs are waiting; replacing a queued job is always accepted.
+
+Job states: queued -> running -> done | failed, or queued -> superseded.
+"""
+
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_IMAGES = 16
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = 1000
+# Weight of the latest batch in the per-image processing time average
+IMAGE_SECONDS_ALPHA = 0.2
+
+
+class QueueFull(Exception):
+    """The queue holds ``max_queued`` jobs; ``retry_after`` estimates seconds until it drains"""
+
+    def __init__(self, queue_depth: int, retry_after: int):
+        super().__init__(f"Ingest queue is full ({queue_depth} jobs waiting)")
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+
+class IngestQueue:
+    """
+    Coalescing job queue with one worker thread
+
+    ``process_batch(jobs)`` receives a list of job dicts (``job_id``, ``product_id``,
+    ``payload``) and returns one result dict per job ID; a job missing from the result, or a
+    batch that raises, is marked failed.
+
+    Usage:
+        queue = IngestQueue(process_batch)
+        queue.start()
+        job = queue.submit(product_id, payload, image_count=len(payload.images))
+        queue.status(job["job_id"])
+    """
+
+    def __init__(self, process_batch: Callable[[List[Dict[str, Any]]], Dict[str, Dict[str, Any]]],
+                 batch_images: int = DEFAULT_BATCH_IMAGES, max_finished: int = MAX_FINISHED_JOBS,
+                 max_queued: Optional[int] = None):
+        self.process_batch = process_batch
+        self.batch_images = batch_images
+        self.max_finished = max_finished
+        self.max_queued = max_queued or None
+        self._seconds_per_image = 1.0
+        self._cond = threading.Condition()
+        # job_id -> job, in submission order; queued jobs are the ones still in _queued
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._queued: "OrderedDict[str, str]" = OrderedDict()  # product_id -> queued job_id
+        self._running: List[str] = []
+        self._worker: Optional[threading.Thread] = None
+        self._stopping = False
+        self._counts = {"submitted": 0, "coalesced": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def start(self) -> None:
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop after the batch in progress; queued jobs are left queued"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def submit(self, product_id: str, payload: Any, image_count: int = 1) -> Dict[str, Any]:
+        """
+        Queue a job; returns its status, with ``coalesced`` set if it replaced a queued job
+
+        Raises QueueFull when ``max_queued`` jobs are waiting and none of them is for this product.
+        """
+        now = time.time()
+        with self._cond:
+            if (self.max_queued is not None and product_id not in self._queued
+                    and len(self._queued) >= self.max_queued):
+                self._counts["rejected"] += 1
+                raise QueueFull(len(self._queued), self._retry_after())
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "product_id": product_id,
+                "status": "queued",
+                "image_count": image_count,
+                "submitted_at": now,
+                "payload": payload,
+            }
+            previous_id = self._queued.get(product_id)
+            if previous_id is not None:
+                previous = self._jobs[previous_id]
+                previous.update(status="superseded", superseded_by=job_id, finished_at=now, payload=None)
+                self._counts["coalesced"] += 1
+                logger.info(f"Job {previous_id} for product {product_id} superseded by {job_id}")
+            self._jobs[job_id] = job
+            # A replacement keeps the product's place in the queue, so frequent edits cannot starve it
+            self._queued[product_id] = job_id
+            self._counts["submitted"] += 1
+            self._trim()
+            self._cond.notify_all()
+            return {**self._public(job), "coalesced": previous_id is not None, "replaced_job_id": previous_id}
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = self._public(job)
+            if job["status"] == "queued":
+                status["queue_position"] = list(self._queued.values()).index(job_id) + 1
+            return status
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = [self._jobs[j] for j in self._queued.values()]
+            return {
+                "queue_depth": len(queued),
+                "queued_images": sum(j["image_count"] for j in queued),
+                "running": len(self._running),
+                "oldest_queued_seconds": round(time.time() - queued[0]["submitted_at"], 3) if queued else 0.0,
+                "max_queued": self.max_queued,
+                "seconds_per_image": round(self._seconds_per_image, 3),
+                "worker_alive": self._worker is not None and self._worker.is_alive(),
+                **self._counts,
+            }
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until nothing is queued or running (for tests and shutdown)"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queued or self._running:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _retry_after(self) -> int:
+        queued_images = sum(self._jobs[j]["image_count"] for j in self._queued.values())
+        return max(1, math.ceil(queued_images * self._seconds_per_image))
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in job.items() if k != "payload"}
+
+    def _trim(self) -> None:
+        finished = [j for j, job in self._jobs.items() if job["status"] in ("done", "failed", "superseded")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch, images = [], 0
+        for product_id in list(self._queued):
+            job = self._jobs[self._queued[product_id]]
+            if batch and images + job["image_count"] > self.batch_images:
+                break
+            del self._queued[product_id]
+            job.update(status="running", started_at=time.time())
+            self._running.append(job["job_id"])
+            batch.append(job)
+            images += job["image_count"]
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queued and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                batch = self._take_batch()
+            start = time.perf_counter()
+            try:
+                results = self.process_batch([{k: job[k] for k in ("job_id", "product_id", "payload")} for job in batch])
+                error = None
+            except Exception as e:
+                logger.error(f"❌ Ingest batch of {len(batch)} jobs failed: {e}")
+                results, error = {}, str(e)
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                images = sum(job["image_count"] for job in batch)
+                if images:
+                    self._seconds_per_image += IMAGE_SECONDS_ALPHA * (elapsed / images - self._seconds_per_image)
+                for job in batch:
+                    result = results.get(job["job_id"])
+                    failed = result is None or not result.get("success", True)
+                    job.update(
+                        status="failed" if failed else "done",
+                        finished_at=time.time(),
+                        result=result,
+                        error=((result or {}).get("error") or error) if failed else None,
+                        payload=None,
+                    )
+                    self._counts["failed" if failed else "done"] += 1
+                    self._running.remove(job["job_id"])
+                self._trim()
+                self._cond.notify_all()
+            logger.info(f"Ingested {len(batch)} jobs ({sum(j['image_count'] for j in batch)} images) in {elapsed:.2f}s")
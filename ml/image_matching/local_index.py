@@ -0,0 +1,212 @@
+"""
+Local vector index with the subset of the Pinecone index API this service uses
+
+Each namespace is a tiered index (see tiered_index.py: an exact-search fresh segment over
+an HNSW base graph) saved in its own subdirectory, so the search API, duplicate collapsing
+and product centroids run unchanged against a local index (SEARCH_BACKEND=local in
+config.py). Upserts are searchable immediately, folded into the base graph by background
+compaction, and written to disk every ``save_every`` upserted vectors and on shutdown.
+
+Build one from an embedding store snapshot (see export_embeddings.py):
+    python local_index.py --store embeddings/furniture --out indexes/furniture
+"""
+
+import argparse
+import logging
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from hnsw import DEFAULT_EF_CONSTRUCTION, DEFAULT_EF_SEARCH, DEFAULT_M, HnswIndex
+from tiered_index import BASE_DIR, DEFAULT_COMPACT_AT, FRESH_FILE, TieredIndex
+
+logger = logging.getLogger(__name__)
+
+# Directory name of the default ("") namespace, as Pinecone reports it
+DEFAULT_NAMESPACE_DIR = "__default__"
+LIST_PAGE_SIZE = 100
+
+
+def _namespace_dir(namespace: str) -> str:
+    return namespace or DEFAULT_NAMESPACE_DIR
+
+
+def _record(vector) -> tuple:
+    """(id, values, metadata) from a Pinecone upsert item: a dict or an (id, values[, metadata]) tuple"""
+    if isinstance(vector, dict):
+        return str(vector["id"]), vector["values"], vector.get("metadata") or {}
+    return str(vector[0]), vector[1], (vector[2] if len(vector) > 2 else {}) or {}
+
+
+class LocalIndex:
+    """
+    Pinecone-compatible index over one tiered index per namespace
+
+    Supports query, upsert, update, fetch, delete, list and describe_index_stats with the
+    keyword arguments the Pinecone client takes. Each namespace handles concurrent reads and
+    writes itself; the lock here only guards the namespace table and save bookkeeping.
+    """
+
+    def __init__(self, path, M: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+                 ef_search: int = DEFAULT_EF_SEARCH, save_every: int = 1000, compact_at: int = DEFAULT_COMPACT_AT,
+                 projection: Optional[np.ndarray] = None):
+        self.path = Path(path)
+        self.params = {"M": M, "ef_construction": ef_construction, "ef_search": ef_search, "compact_at": compact_at,
+                       "projection": projection}
+        self.save_every = save_every
+        self._lock = threading.RLock()
+        self._graphs: Dict[str, TieredIndex] = {}
+        self._unsaved: Dict[str, int] = {}
+        if self.path.exists():
+            for directory in sorted(self.path.iterdir()):
+                if (directory / BASE_DIR).is_dir() or (directory / FRESH_FILE).exists():
+                    namespace = "" if directory.name == DEFAULT_NAMESPACE_DIR else directory.name
+                    self._graphs[namespace] = TieredIndex.load(directory, ef_search=ef_search, compact_at=compact_at,
+                                                                projection=projection)
+                    logger.info(f"Loaded {len(self._graphs[namespace])} vectors for namespace '{directory.name}'")
+
+    def graph(self, namespace: str = "") -> Optional[TieredIndex]:
+        return self._graphs.get(namespace)
+
+    def query(self, vector, top_k: int = 10, include_metadata: bool = False, filter: Optional[Dict[str, Any]] = None,
+              namespace: str = "", include_values: bool = False, **kwargs) -> Dict[str, Any]:
+        graph = self._graphs.get(namespace)
+        if graph is None:
+            return {"matches": [], "namespace": namespace}
+        response = graph.query(vector, top_k, filter, include_metadata)
+        if include_values:
+            for match in response["matches"]:
+                match["values"] = graph.vector(match["id"]).tolist()
+        response["namespace"] = namespace
+        return response
+
+    def upsert(self, vectors: Sequence[Any], namespace: str = "", **kwargs) -> Dict[str, int]:
+        records = [_record(v) for v in vectors]
+        if not records:
+            return {"upserted_count": 0}
+        with self._lock:
+            graph = self._graphs.get(namespace)
+            if graph is None:
+                graph = self._graphs[namespace] = TieredIndex(len(records[0][1]), **self.params)
+        graph.add([r[0] for r in records], [r[1] for r in records], [r[2] for r in records])
+        self._mark_unsaved(namespace, len(records))
+        return {"upserted_count": len(records)}
+
+    def update(self, id: str, set_metadata: Optional[Dict[str, Any]] = None, values=None,
+               namespace: str = "", **kwargs) -> Dict[str, Any]:
+        graph = self._graphs.get(namespace)
+        if graph is None or id not in graph:
+            return {}
+        if values is not None:
+            merged = {**graph.metadata(id), **(set_metadata or {})}
+            graph.add([id], [values], [merged])
+        elif set_metadata:
+            graph.update_metadata(id, set_metadata)
+        self._mark_unsaved(namespace, 1)
+        return {}
+
+    def fetch(self, ids: Sequence[str], namespace: str = "", **kwargs) -> Dict[str, Any]:
+        graph = self._graphs.get(namespace)
+        found = {}
+        for vector_id in ids:
+            if graph is not None and vector_id in graph:
+                found[vector_id] = {"id": vector_id, "values": graph.vector(vector_id).tolist(),
+                                    "metadata": graph.metadata(vector_id)}
+        return {"vectors": found, "namespace": namespace}
+
+    def delete(self, ids: Optional[Sequence[str]] = None, delete_all: bool = False, namespace: str = "",
+               **kwargs) -> Dict[str, Any]:
+        graph = self._graphs.get(namespace)
+        if graph is None:
+            return {}
+        removed = graph.delete(graph.ids() if delete_all else (ids or []))
+        self._mark_unsaved(namespace, removed)
+        return {}
+
+    def list(self, prefix: Optional[str] = None, namespace: str = "", limit: int = LIST_PAGE_SIZE,
+             **kwargs) -> Iterator[List[str]]:
+        """Pages of vector IDs, like the serverless Pinecone client's list()"""
+        graph = self._graphs.get(namespace)
+        ids = [] if graph is None else [i for i in graph.ids() if not prefix or i.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            dimension = next((g.dimension for g in self._graphs.values()), None)
+            return {
+                "dimension": dimension,
+                "total_vector_count": sum(len(g) for g in self._graphs.values()),
+                "namespaces": {_namespace_dir(ns): {"vector_count": len(g)} for ns, g in self._graphs.items()},
+            }
+
+    def tier_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Fresh/base sizes, tombstones and compaction state per namespace"""
+        return {_namespace_dir(ns): g.stats() for ns, g in list(self._graphs.items())}
+
+    def _mark_unsaved(self, namespace: str, count: int) -> None:
+        with self._lock:
+            self._unsaved[namespace] = self._unsaved.get(namespace, 0) + count
+            if self.save_every and self._unsaved[namespace] >= self.save_every:
+                self.save(namespace)
+
+    def save(self, namespace: Optional[str] = None) -> None:
+        """Write namespaces with unsaved changes (or just ``namespace``) to disk"""
+        with self._lock:
+            namespaces = [namespace] if namespace is not None else [ns for ns, n in self._unsaved.items() if n]
+            for ns in namespaces:
+                if ns in self._graphs:
+                    self._graphs[ns].save(self.path / _namespace_dir(ns))
+                    self._unsaved[ns] = 0
+                    logger.info(f"Saved {len(self._graphs[ns])} vectors for namespace '{_namespace_dir(ns)}'")
+
+
+def build_from_store(store_path, out_path, namespace: str = "", centroids: bool = True, **params) -> LocalIndex:
+    """Build a local index from an embedding store snapshot, with product centroids by default"""
+    from aggregation import CENTROID_NAMESPACE, build_centroids
+    from embedding_store import EmbeddingStore
+
+    store = EmbeddingStore(store_path)
+    index = LocalIndex(out_path, save_every=0, **params)
+    graph_params = {k: v for k, v in index.params.items() if k != "compact_at"}
+    index._graphs[namespace] = TieredIndex(store.dimension, HnswIndex.from_store(store, **graph_params), **index.params)
+    index._unsaved[namespace] = len(store)
+    if centroids:
+        records = build_centroids(
+            [str(v) for v in store.ids],
+            np.asarray(store.vectors, dtype=np.float32),
+            [store.metadata(i) for i in range(len(store))],
+        )
+        index.upsert(records, namespace=CENTROID_NAMESPACE)
+        index.graph(CENTROID_NAMESPACE).compact()
+    index.save()
+    return index
+
+
+def main():
+    """Build a local index from an embedding store snapshot"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build a local HNSW index for SEARCH_BACKEND=local")
+    parser.add_argument("--store", required=True, help="Embedding store snapshot (export_embeddings.py)")
+    parser.add_argument("--out", required=True, help="Index directory (LOCAL_INDEX_PATH)")
+    parser.add_argument("--namespace", default="", help="Namespace to build")
+    parser.add_argument("--no_centroids", action="store_true", help="Skip the product centroid namespace")
+    parser.add_argument("--M", type=int, default=DEFAULT_M, help="Links per vector")
+    parser.add_argument("--ef_construction", type=int, default=DEFAULT_EF_CONSTRUCTION, help="Search width while inserting")
+    parser.add_argument("--ef_search", type=int, default=DEFAULT_EF_SEARCH, help="Search width per query")
+    args = parser.parse_args()
+
+    try:
+        index = build_from_store(args.store, args.out, args.namespace, not args.no_centroids,
+                                 M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search)
+        logger.info(f"✅ Built local index at {args.out}: {index.describe_index_stats()['namespaces']}")
+    except Exception as e:
+        logger.error(f"❌ Error building local index: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
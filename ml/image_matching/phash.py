@@ -0,0 +1,203 @@
+"""
+Perceptual hashes of catalog images for an exact-match fast path
+
+Many uploads are screenshots or downloads of our own catalog photos. A 64-bit difference
+hash (dHash) and average hash (aHash) of the preprocessed image survive re-encoding, resizing
+and small colour changes, so such an upload lands within a few bits of the catalog image's
+hashes. The search API checks HashIndex first; on a match it queries with the stored vector
+of that catalog image and skips the CLIP encode.
+
+Hashes are computed at ingest (/add-product, generate_embeddings.py) and stored in vector
+metadata as 16-digit hex strings ("dhash", "ahash"). The in-memory index is saved to
+HASH_INDEX_PATH; rebuild it from a snapshot with:
+
+    python phash.py build --store embeddings/furniture [--out indexes/image_hashes.npz]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 = 64 bits
+# Largest Hamming distance (of each hash) still treated as the same image
+DEFAULT_MAX_DISTANCE = 4
+
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """Difference hash: whether each pixel is brighter than its right neighbour"""
+    pixels = np.asarray(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def ahash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """Average hash: whether each pixel is brighter than the mean"""
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.Resampling.LANCZOS), dtype=np.float32)
+    return _to_int(pixels > pixels.mean())
+
+
+def image_hashes(image: Image.Image) -> Dict[str, str]:
+    """Both hashes as hex strings, in the form stored in vector metadata"""
+    return {"dhash": f"{dhash(image):016x}", "ahash": f"{ahash(image):016x}"}
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_BITS[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class HashIndex:
+    """
+    In-memory Hamming-distance index of catalog image hashes
+
+    Each entry is keyed by the image's own vector ID and points at the vector to query with
+    (the image itself, or the canonical vector it was collapsed into at ingest).
+
+    Usage:
+        index = HashIndex.load("indexes/image_hashes.npz")
+        index.add(image_id, image_hashes(image), vector_id, product_id)
+        hit = index.nearest(image_hashes(upload))   # {"key", "vector_id", "product_id", "distance"} or None
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[int, int, str, str]] = {}  # key -> (dhash, ahash, vector_id, product_id)
+        self._arrays: Optional[Tuple[list, np.ndarray, np.ndarray]] = None
+        self._counts = {"lookups": 0, "hits": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str, hashes: Dict[str, str], vector_id: Optional[str] = None, product_id: str = "") -> None:
+        with self._lock:
+            self._entries[key] = (int(hashes["dhash"], 16), int(hashes["ahash"], 16), vector_id or key, str(product_id))
+            self._arrays = None
+
+    def remove_product(self, product_id: str) -> int:
+        """Drop every entry of a product (before adding its current images)"""
+        with self._lock:
+            keys = [k for k, entry in self._entries.items() if entry[3] == str(product_id)]
+            for key in keys:
+                del self._entries[key]
+            if keys:
+                self._arrays = None
+            return len(keys)
+
+    def _snapshot(self) -> Tuple[list, np.ndarray, np.ndarray]:
+        # Rebuilt after writes only; lookups between writes reuse it
+        if self._arrays is None:
+            keys = list(self._entries)
+            self._arrays = (
+                keys,
+                np.array([self._entries[k][0] for k in keys], dtype=np.uint64),
+                np.array([self._entries[k][1] for k in keys], dtype=np.uint64),
+            )
+        return self._arrays
+
+    def nearest(self, hashes: Dict[str, str], max_distance: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Closest entry whose dHash and aHash are both within ``max_distance`` bits"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            self._counts["lookups"] += 1
+            keys, dhashes, ahashes = self._snapshot()
+            if not keys:
+                return None
+            d = _popcount(dhashes ^ np.uint64(int(hashes["dhash"], 16)))
+            a = _popcount(ahashes ^ np.uint64(int(hashes["ahash"], 16)))
+            candidates = np.flatnonzero((d <= max_distance) & (a <= max_distance))
+            if candidates.size == 0:
+                return None
+            best = int(candidates[np.argmin(d[candidates].astype(np.int32) + a[candidates])])
+            self._counts["hits"] += 1
+            entry = self._entries[keys[best]]
+            return {"key": keys[best], "vector_id": entry[2], "product_id": entry[3],
+                    "distance": int(d[best]), "ahash_distance": int(a[best])}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_distance": self.max_distance, **self._counts}
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            keys = list(self._entries)
+            entries = [self._entries[k] for k in keys]
+        staging = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            staging,
+            keys=np.array(keys, dtype=str),
+            dhash=np.array([e[0] for e in entries], dtype=np.uint64),
+            ahash=np.array([e[1] for e in entries], dtype=np.uint64),
+            vector_ids=np.array([e[2] for e in entries], dtype=str),
+            product_ids=np.array([e[3] for e in entries], dtype=str),
+        )
+        os.replace(staging, path)
+
+    @classmethod
+    def load(cls, path, max_distance: int = DEFAULT_MAX_DISTANCE) -> "HashIndex":
+        """Saved index, or an empty one if the file does not exist"""
+        index = cls(max_distance)
+        if not Path(path).exists():
+            return index
+        with np.load(path, allow_pickle=False) as data:
+            for key, d, a, vector_id, product_id in zip(data["keys"], data["dhash"], data["ahash"],
+                                                        data["vector_ids"], data["product_ids"]):
+                index._entries[str(key)] = (int(d), int(a), str(vector_id), str(product_id))
+        return index
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, Dict[str, Any]]],
+                     max_distance: int = DEFAULT_MAX_DISTANCE) -> "HashIndex":
+        """Index of (vector ID, metadata) records whose metadata holds both hashes"""
+        index = cls(max_distance)
+        for vector_id, metadata in records:
+            if metadata.get("dhash") and metadata.get("ahash"):
+                index.add(vector_id, metadata, vector_id, metadata.get("product_id", ""))
+        return index
+
+
+def main():
+    """Build the hash index from the metadata of an embedding store snapshot"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Perceptual hash index for the exact-match search fast path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build the index from a snapshot's dhash/ahash metadata")
+    build.add_argument("--store", required=True, help="Embedding store snapshot directory")
+    build.add_argument("--out", default=None, help="Index file (default: HASH_INDEX_PATH)")
+    args = parser.parse_args()
+
+    from config import HASH_INDEX_PATH
+    from embedding_store import EmbeddingStore
+
+    try:
+        store = EmbeddingStore(args.store)
+        records = ((vector_id, metadata) for ids, _, batch in store.iter_batches()
+                   for vector_id, metadata in zip(ids, batch))
+        index = HashIndex.from_records(records)
+        out = args.out or HASH_INDEX_PATH
+        index.save(out)
+        logger.info(f"✅ Saved {len(index)} image hashes ({len(store) - len(index)} vectors without hashes) to {out}")
+    except Exception as e:
+        logger.error(f"❌ Error building hash index: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Learned dimensionality reduction for a compact first-pass search space
+
+The furniture catalog occupies a narrow region of CLIP space, so most of the variance of its
+768-dimensional vectors lies in a few hundred directions. A projection onto the top
+eigenvectors of the catalog's second-moment matrix (PCA without centering, which is the
+subspace that best preserves inner products, i.e. cosine similarity of normalized vectors)
+is fitted on an embedding store snapshot. Search scans the reduced vectors for a shortlist
+of ``top_k * shortlist_factor`` candidates and rescores that shortlist at full dimension.
+
+Projections are written into the snapshot directory (``projection_<dim>.npz`` plus the
+reduced matrix ``reduced_<dim>.bin``) and stamped with the snapshot they were fitted on,
+so a re-exported snapshot never pairs with a stale projection.
+
+The local index can walk its HNSW graph in a fitted subspace and rescore the candidates it
+collects at full dimension (LOCAL_INDEX_PROJECTION in config.py, see hnsw.py).
+
+Usage:
+    python projection.py fit --store embeddings/furniture --dims 128 256
+    python projection.py evaluate --store embeddings/furniture --dims 64 128 256 --k 10
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, SEARCH_BLOCK_ROWS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIMS = (128, 256)
+SHORTLIST_FACTOR = 10
+# Rows per block when accumulating the second-moment matrix
+FIT_BLOCK_ROWS = 65536
+
+
+def _projection_file(dim: int) -> str:
+    return f"projection_{dim}.npz"
+
+
+def _reduced_file(dim: int) -> str:
+    return f"reduced_{dim}.bin"
+
+
+def _stamp(store: EmbeddingStore) -> Dict[str, Any]:
+    return {"created_at": store.manifest["created_at"], "count": store.count}
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    rows = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+    return rows[np.argsort(-scores[rows], kind="stable")]
+
+
+def fit_components(store: EmbeddingStore, dims: List[int]) -> Dict[int, np.ndarray]:
+    """
+    Top eigenvectors of X^T X over the whole snapshot, one (dim x dimension) basis per size
+
+    The matrix is accumulated block by block, so the snapshot is streamed from its memory
+    map rather than loaded at once.
+    """
+    moment = np.zeros((store.dimension, store.dimension), dtype=np.float64)
+    for start in range(0, store.count, FIT_BLOCK_ROWS):
+        block = np.asarray(store.vectors[start:start + FIT_BLOCK_ROWS], dtype=np.float64)
+        moment += block.T @ block
+    eigenvalues, eigenvectors = np.linalg.eigh(moment)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues, eigenvectors = eigenvalues[order], eigenvectors[:, order]
+    total = max(float(eigenvalues.sum()), 1e-12)
+    bases = {}
+    for dim in dims:
+        if not 0 < dim < store.dimension:
+            raise ValueError(f"Target dimension must be between 1 and {store.dimension - 1}, got {dim}")
+        bases[dim] = eigenvectors[:, :dim].T.astype(np.float32)
+        logger.info(f"dim {dim}: {eigenvalues[:dim].sum() / total:.1%} of the catalog's energy retained")
+    return bases
+
+
+def fit(store_path, dims: List[int], dtype: str = "float16") -> List[Path]:
+    """Fit projections for ``dims`` on a snapshot and write them next to it"""
+    store = EmbeddingStore(store_path)
+    if store.count == 0:
+        raise ValueError("Cannot fit a projection on an empty snapshot")
+    written = []
+    for dim, components in fit_components(store, dims).items():
+        reduced_path = store.path / _reduced_file(dim)
+        reduced = np.memmap(reduced_path, dtype=dtype, mode="w+", shape=(store.count, dim))
+        for start in range(0, store.count, FIT_BLOCK_ROWS):
+            block = np.asarray(store.vectors[start:start + FIT_BLOCK_ROWS], dtype=np.float32)
+            reduced[start:start + len(block)] = block @ components.T
+        reduced.flush()
+        del reduced
+        # Written last: a projection file only exists once its reduced matrix is complete
+        np.savez(
+            store.path / _projection_file(dim),
+            components=components,
+            meta=np.array(json.dumps({"dim": dim, "dtype": dtype, "source": _stamp(store)}))
+        )
+        written.append(store.path / _projection_file(dim))
+        logger.info(f"Wrote {dim}-dimensional projection of {store.count} vectors to {store.path}")
+    return written
+
+
+def load_components(path) -> np.ndarray:
+    """The (dim x dimension) basis of a fitted projection file"""
+    with np.load(path) as data:
+        return data["components"]
+
+
+def available_dims(store_path) -> List[int]:
+    return sorted(int(p.stem.split("_")[1]) for p in Path(store_path).glob("projection_*.npz"))
+
+
+class ProjectedSearch:
+    """Two-pass search over a snapshot: reduced-dimension scan, then full-dimension rescoring"""
+
+    def __init__(self, store: EmbeddingStore, dim: int, shortlist_factor: int = SHORTLIST_FACTOR):
+        self.store = store
+        self.dim = dim
+        self.shortlist_factor = shortlist_factor
+        with np.load(store.path / _projection_file(dim)) as data:
+            self.components = data["components"]
+            meta = json.loads(str(data["meta"]))
+        if meta["source"] != _stamp(store):
+            raise ValueError(f"Projection {dim} was fitted on a different snapshot; run projection.py fit again")
+        self.reduced = np.memmap(store.path / _reduced_file(dim), dtype=meta["dtype"], mode="r",
+                                 shape=(store.count, dim))
+
+    def shortlist(self, query, size: int) -> np.ndarray:
+        """Rows of the ``size`` best candidates in the reduced space"""
+        reduced_query = self.components @ np.asarray(query, dtype=np.float32).ravel()
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, self.store.count, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.reduced[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = np.concatenate([best_scores, block @ reduced_query])
+            rows = np.concatenate([best_rows, np.arange(start, start + len(block))])
+            keep = _top_k_rows(scores, size)
+            best_scores, best_rows = scores[keep], rows[keep]
+        return best_rows
+
+    def search(self, query, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Same result format as EmbeddingStore.search"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if top_k <= 0 or self.store.count == 0:
+            return []
+        rows = np.sort(self.shortlist(query, top_k * self.shortlist_factor))
+        full = np.asarray(self.store.vectors[rows], dtype=np.float32) @ query
+        order = _top_k_rows(full, top_k)
+        return [
+            {"id": str(self.store.ids[rows[i]]), "score": float(full[i]), "metadata": self.store.metadata(int(rows[i]))}
+            for i in order
+        ]
+
+
+def sample_queries(store: EmbeddingStore, n: int, noise: float = 0.5, seed: int = 0) -> np.ndarray:
+    """
+    Catalog vectors with isotropic noise added, as stand-ins for photos of catalog items
+
+    ``noise`` is the norm of the perturbation relative to the (unit) vector; 0.5 puts the
+    query at a cosine of about 0.9 from its source.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(store.count, size=min(n, store.count), replace=False))
+    base = np.asarray(store.vectors[rows], dtype=np.float32)
+    perturbation = rng.normal(size=base.shape).astype(np.float32)
+    perturbation *= noise / np.linalg.norm(perturbation, axis=1, keepdims=True)
+    queries = base + perturbation
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def _latency(run, queries: np.ndarray) -> Dict[str, float]:
+    run(queries[0])
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        run(query)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return {"latency_p50_ms": float(np.percentile(times, 50)), "latency_p95_ms": float(np.percentile(times, 95))}
+
+
+def evaluate(store_path, dims: List[int], k: int = 10, n_queries: int = 200,
+             shortlist_factor: int = SHORTLIST_FACTOR, queries: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    recall@k against exact full-dimension search, latency and footprint per target dimension
+
+    Dimensions without a fitted projection are fitted first.
+    """
+    store = EmbeddingStore(store_path)
+    missing = [d for d in dims if d not in available_dims(store_path)]
+    if missing:
+        fit(store_path, missing)
+    if queries is None:
+        queries = sample_queries(store, n_queries)
+    itemsize = np.dtype(store.dtype).itemsize
+
+    exact = [{m["id"] for m in store.search(q, k)} for q in queries]
+    rows = [{
+        "dim": store.dimension, "method": "exact", f"recall@{k}": 1.0,
+        "scan_bytes_per_vector": store.dimension * itemsize,
+        **_latency(lambda q: store.search(q, k), queries),
+    }]
+    for dim in dims:
+        searcher = ProjectedSearch(store, dim, shortlist_factor)
+        found = [{m["id"] for m in searcher.search(q, k)} for q in queries]
+        recall = float(np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, exact)]))
+        rows.append({
+            "dim": dim, "method": f"projected+rescore({k * shortlist_factor})", f"recall@{k}": recall,
+            "scan_bytes_per_vector": dim * searcher.reduced.dtype.itemsize,
+            **_latency(lambda q: searcher.search(q, k), queries),
+        })
+    return rows
+
+
+def main():
+    """Fit projections or report recall@k and latency per target dimension"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Dimensionality reduction for the first search pass")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit_parser = sub.add_parser("fit", help="Fit projections on a snapshot")
+    fit_parser.add_argument("--store", required=True, help="Embedding store snapshot")
+    fit_parser.add_argument("--dims", type=int, nargs="+", default=list(DEFAULT_DIMS), help="Target dimensions")
+    eval_parser = sub.add_parser("evaluate", help="recall@k and latency per target dimension")
+    eval_parser.add_argument("--store", required=True, help="Embedding store snapshot")
+    eval_parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256], help="Target dimensions")
+    eval_parser.add_argument("--k", type=int, default=10, help="Results per query")
+    eval_parser.add_argument("--queries", type=str, default=None, help="Query vectors (.npy); default: perturbed catalog vectors")
+    eval_parser.add_argument("--n_queries", type=int, default=200, help="Number of sampled queries")
+    eval_parser.add_argument("--shortlist_factor", type=int, default=SHORTLIST_FACTOR, help="Shortlist size as a multiple of k")
+    eval_parser.add_argument("--out", type=str, default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "fit":
+            fit(args.store, args.dims)
+            return
+        queries = np.load(args.queries) if args.queries else None
+        report = evaluate(args.store, args.dims, args.k, args.n_queries, args.shortlist_factor, queries)
+        print(f"{'dim':>5} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'bytes/vec':>10}  method")
+        for row in report:
+            print(f"{row['dim']:>5} {row[f'recall@{args.k}']:>10.4f} {row['latency_p50_ms']:>8.2f} "
+                  f"{row['latency_p95_ms']:>8.2f} {row['scan_bytes_per_vector']:>10}  {row['method']}")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    except Exception as e:
+        logger.error(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
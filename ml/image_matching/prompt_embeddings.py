@@ -0,0 +1,185 @@
+"""
+Text prompts used at runtime and their precomputed CLIP embeddings
+
+The search API only needs the text tower for a fixed set of prompts (furniture type
+classification and the furniture gate). Their embeddings are computed once and stored in a
+small artifact, so search and ingest workers can load only the vision encoder
+(CLIP_LOAD_MODE=vision, see vision_encoder.py):
+
+    python prompt_embeddings.py [--out artifacts/prompt_embeddings_clip-ViT-L-14.npz]
+
+generate_embeddings.py also writes it with the full model. Rebuild the artifact whenever a
+prompt or CLIP_MODEL_NAME changes; a missing or stale artifact is detected at startup, the
+embeddings are computed once with a temporarily loaded text tower and saved for later starts.
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import CLIP_MODEL_NAME, PROMPT_EMBEDDINGS_PATH
+
+logger = logging.getLogger(__name__)
+
+# Sofa gets multiple prompts so the model predicts "sofa" more reliably for sofa images
+FURNITURE_TYPE_PROMPTS = {
+    "bed": "a photo of a bed",
+    "chair": "a photo of a chair",
+    "sofa": "a photo of a sofa",  # Primary; sofa also boosted in predict_furniture_type
+    "table": "a photo of a table",
+    "bookshelf": "a photo of a bookshelf",
+    "wardrobe": "a photo of a wardrobe",
+    "dining": "a photo of a dining table",
+    "study": "a photo of a study table"
+}
+SOFA_PROMPTS = [
+    "a photo of a sofa",
+    "a photo of a couch",
+    "a photo of a two seater sofa",
+    "a photo of a three seater sofa",
+    "a photo of a living room sofa",
+]
+
+# Prompts to distinguish furniture from other wood products
+FURNITURE_PROMPTS = [
+    "a photo of furniture",
+    "a photo of a piece of furniture",
+    "a photo of home furniture",
+    "a photo of indoor furniture"
+]
+NON_FURNITURE_PROMPTS = [
+    "a photo of raw wood",
+    "a photo of timber",
+    "a photo of construction materials",
+    "a photo of lumber",
+    "a photo of wooden planks",
+    "a photo of building materials",
+    "a photo of wood panels",
+    "a photo of a door",
+    "a photo of a wooden door",
+    "a photo of a window",
+    "a photo of a glass window",
+    "a photo of plastic chair",
+    "a photo of plastic furniture",
+    "a photo of outdoor plastic furniture",
+]
+
+ALL_PROMPTS = list(dict.fromkeys(
+    list(FURNITURE_TYPE_PROMPTS.values()) + SOFA_PROMPTS + FURNITURE_PROMPTS + NON_FURNITURE_PROMPTS
+))
+
+
+def load_text_model(model_name: str = CLIP_MODEL_NAME):
+    """The full CLIP model (text and vision towers), for tooling that encodes arbitrary text"""
+    from sentence_transformers import SentenceTransformer
+    logger.info(f"Loading CLIP model with text tower: {model_name}")
+    return SentenceTransformer(model_name)
+
+
+class PromptEmbeddings:
+    """
+    Prompt -> embedding lookup, saved as an .npz artifact
+
+    Usage:
+        prompts = PromptEmbeddings.load(PROMPT_EMBEDDINGS_PATH)
+        text_embeddings = prompts.matrix(SOFA_PROMPTS)   # (len(SOFA_PROMPTS), dim)
+    """
+
+    def __init__(self, prompts: Sequence[str], embeddings: np.ndarray, model_name: str = CLIP_MODEL_NAME):
+        self.prompts = list(prompts)
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.model_name = model_name
+        self._rows: Dict[str, int] = {prompt: i for i, prompt in enumerate(self.prompts)}
+
+    @classmethod
+    def compute(cls, model, prompts: Sequence[str] = ALL_PROMPTS,
+                model_name: str = CLIP_MODEL_NAME) -> "PromptEmbeddings":
+        """Encode prompts with a model that has the text tower"""
+        prompts = list(prompts)
+        embeddings = model.encode(prompts, convert_to_numpy=True, show_progress_bar=False)
+        return cls(prompts, embeddings, model_name)
+
+    @classmethod
+    def load(cls, path=PROMPT_EMBEDDINGS_PATH, model_name: Optional[str] = CLIP_MODEL_NAME) -> "PromptEmbeddings":
+        """Load an artifact; raises ValueError if it was built with another model"""
+        with np.load(path, allow_pickle=False) as data:
+            stored_model = str(data["model_name"])
+            if model_name is not None and stored_model != model_name:
+                raise ValueError(f"Prompt embeddings in {path} were built with {stored_model}, not {model_name}")
+            return cls([str(p) for p in data["prompts"]], data["embeddings"], stored_model)
+
+    def save(self, path=PROMPT_EMBEDDINGS_PATH) -> None:
+        """Write the artifact atomically, so concurrently starting workers never read a partial file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(staging, prompts=np.array(self.prompts), embeddings=self.embeddings,
+                 model_name=np.array(self.model_name))
+        os.replace(staging, path)
+
+    def missing(self, prompts: Sequence[str]) -> List[str]:
+        return [p for p in prompts if p not in self._rows]
+
+    def matrix(self, prompts: Sequence[str]) -> np.ndarray:
+        """Embeddings of prompts, one row each, in the given order"""
+        missing = self.missing(prompts)
+        if missing:
+            raise KeyError(f"No precomputed embedding for prompts: {missing}")
+        return self.embeddings[[self._rows[p] for p in prompts]]
+
+
+def load_or_compute(path=PROMPT_EMBEDDINGS_PATH, model=None, prompts: Sequence[str] = ALL_PROMPTS,
+                    model_name: str = CLIP_MODEL_NAME) -> PromptEmbeddings:
+    """
+    Prompt embeddings from the artifact, or computed now if it is missing or stale
+
+    ``model`` is used for computing when it has a text tower (a SentenceTransformer);
+    otherwise the full model is loaded for the computation and released afterwards. Computed
+    embeddings are saved to ``path``, so the text tower is loaded at most once per artifact.
+    """
+    try:
+        stored = PromptEmbeddings.load(path, model_name)
+        missing = stored.missing(prompts)
+        if not missing:
+            logger.info(f"Loaded {len(stored.prompts)} prompt embeddings from {path}")
+            return stored
+        logger.warning(f"{len(missing)} prompts are not in {path}; rebuild it with: python prompt_embeddings.py")
+    except FileNotFoundError:
+        logger.warning(f"No prompt embeddings at {path}; build them with: python prompt_embeddings.py")
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Ignoring prompt embeddings at {path}: {e}")
+    if model is None or not hasattr(model, "tokenize"):
+        model = load_text_model(model_name)
+    computed = PromptEmbeddings.compute(model, prompts, model_name)
+    try:
+        computed.save(path)
+        logger.info(f"Saved {len(computed.prompts)} prompt embeddings to {path}")
+    except OSError as e:
+        logger.error(f"❌ Could not save prompt embeddings to {path}: {e}; the text tower will be loaded again at next startup")
+    return computed
+
+
+def main():
+    """Compute the runtime prompt embeddings with the full CLIP model and save them"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the prompt embeddings artifact used with CLIP_LOAD_MODE=vision")
+    parser.add_argument("--out", type=str, default=str(PROMPT_EMBEDDINGS_PATH), help="Artifact path (.npz)")
+    parser.add_argument("--model", type=str, default=CLIP_MODEL_NAME, help="CLIP model (must match the one serving)")
+    args = parser.parse_args()
+
+    try:
+        embeddings = PromptEmbeddings.compute(load_text_model(args.model), ALL_PROMPTS, args.model)
+        embeddings.save(args.out)
+        logger.info(f"✅ Saved {len(embeddings.prompts)} prompt embeddings ({embeddings.embeddings.shape[1]} dims) to {args.out}")
+    except Exception as e:
+        logger.error(f"❌ Error building prompt embeddings: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
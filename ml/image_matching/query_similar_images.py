@@ -1,12 +1,37 @@
 """
 Query script to find similar furniture images using Pinecone
 Example usage after embeddings have been generated
+
+Single image:
+    python query_similar_images.py ../client/src/assets/furniture/bed.jpg 5
+
+Batch evaluation (model loaded once, images encoded in model-sized batches):
+    python query_similar_images.py --dir queries/ --k 10 --out report.json [--csv queries.csv]
+    python query_similar_images.py --manifest labels.csv --k 10 --out report.json
+
+A manifest is a CSV (with header) or JSON-lines file with one query per row:
+    image       path of the query image (relative to the manifest)
+    product_id  product the image shows; results of that product count as relevant
+    target      filename or vector ID of the identical indexed image (same-image queries)
+In --dir mode each image's target is its own filename (queries are catalog copies), and
+with --product_from_dir its product is the name of its parent directory.
+
+The report holds recall@k (share of labeled queries with a relevant result in the top k),
+MRR, the same-image hit rate (top result relevant and at or above the API's same-image
+threshold), latency percentiles and every query's results, so two configurations can be
+compared by diffing their reports.
 """
 
+import argparse
+import csv
+import json
 import os
 import sys
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Sequence
 from PIL import Image
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from pinecone import Pinecone
 from dotenv import load_dotenv
@@ -16,7 +41,10 @@ from config import (
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
     CLIP_MODEL_NAME,
-    MAX_IMAGE_SIZE
+    MAX_IMAGE_SIZE,
+    SUPPORTED_IMAGE_FORMATS,
+    SEARCH_BACKEND,
+    LOCAL_INDEX_PATH
 )
 
 # Setup logging
@@ -26,39 +54,57 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Same-image path threshold of /search-by-image
+SAME_IMAGE_THRESHOLD = 0.76
+DEFAULT_BATCH_SIZE = 16
+
+
+def load_query_image(path) -> Image.Image:
+    """Same preprocessing as the search API: RGB, resized to the model input size"""
+    image = Image.open(path).convert("RGB")
+    image = image.resize(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image.load()
+    return image
 
-def query_similar_images(query_image_path: str, top_k: int = 5):
+
+def open_index(backend: str = SEARCH_BACKEND, local_path=LOCAL_INDEX_PATH):
+    """Pinecone index, or the local HNSW index for backend "local" """
+    if backend == "local":
+        from local_index import LocalIndex
+        return LocalIndex(local_path)
+    if not PINECONE_API_KEY:
+        raise ValueError("PINECONE_API_KEY not found in environment variables")
+    return Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+
+
+def query_similar_images(query_image_path: str, top_k: int = 5, model=None, index=None):
     """
     Query Pinecone to find similar images
-    
+
     Args:
         query_image_path: Path to the query image
         top_k: Number of similar images to return
-        
+        model, index: Already loaded CLIP model and index (loaded here if omitted)
+
     Returns:
         List of similar images with scores and metadata
     """
     try:
-        # Load CLIP model
-        logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
-        model = SentenceTransformer(CLIP_MODEL_NAME)
-        
-        # Initialize Pinecone
-        if not PINECONE_API_KEY:
-            raise ValueError("PINECONE_API_KEY not found in environment variables")
-        
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index(PINECONE_INDEX_NAME)
-        
+        if model is None:
+            # Load CLIP model
+            logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
+            model = SentenceTransformer(CLIP_MODEL_NAME)
+        if index is None:
+            index = open_index()
+
         # Load and preprocess query image
         logger.info(f"Loading query image: {query_image_path}")
-        query_image = Image.open(query_image_path).convert("RGB")
-        query_image = query_image.resize(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
-        
+        query_image = load_query_image(query_image_path)
+
         # Generate embedding
         logger.info("Generating embedding for query image...")
         query_embedding = model.encode(query_image, convert_to_numpy=True)
-        
+
         # Query Pinecone
         logger.info(f"Querying Pinecone for top {top_k} similar images...")
         results = index.query(
@@ -66,44 +112,248 @@ def query_similar_images(query_image_path: str, top_k: int = 5):
             top_k=top_k,
             include_metadata=True
         )
-        
+
         # Display results
         print("\n" + "=" * 60)
         print(f"Query Image: {query_image_path}")
         print("=" * 60)
         print(f"\nFound {len(results['matches'])} similar images:\n")
-        
+
         for i, match in enumerate(results['matches'], 1):
             print(f"{i}. Similarity Score: {match['score']:.4f}")
             print(f"   Image: {match['metadata']['filename']}")
             print(f"   Path: {match['metadata'].get('filepath', 'N/A')}")
             print(f"   Size: {match['metadata'].get('image_size', 'N/A')}")
             print()
-        
+
         return results['matches']
-        
+
     except Exception as e:
         logger.error(f"Error querying similar images: {e}")
         raise
 
 
+def load_manifest(path) -> List[Dict[str, Any]]:
+    """Queries from a CSV or JSON-lines manifest; image paths are resolved against its directory"""
+    path = Path(path)
+    if path.suffix.lower() in (".jsonl", ".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    queries = []
+    for row in rows:
+        if not row.get("image"):
+            raise ValueError(f"Manifest row without an image: {row}")
+        queries.append({
+            "image": str((path.parent / row["image"]).resolve()),
+            "product_id": str(row["product_id"]) if row.get("product_id") not in (None, "") else None,
+            "target": row.get("target") or None,
+        })
+    return queries
+
+
+def directory_queries(directory, product_from_dir: bool = False) -> List[Dict[str, Any]]:
+    """Every image under a directory, labeled with its own filename (and parent directory as product)"""
+    directory = Path(directory)
+    files = sorted(p for p in directory.rglob("*") if p.suffix.lower() in SUPPORTED_IMAGE_FORMATS)
+    return [
+        {"image": str(p), "product_id": p.parent.name if product_from_dir else None, "target": p.name}
+        for p in files
+    ]
+
+
+def is_relevant(match: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    metadata = match.get("metadata") or {}
+    if query.get("product_id") is not None and str(metadata.get("product_id", "")) == query["product_id"]:
+        return True
+    target = query.get("target")
+    if target:
+        filepath = str(metadata.get("filepath", ""))
+        return (match.get("id") == target or metadata.get("filename") == target
+                or (filepath and os.path.basename(filepath) == target))
+    return False
+
+
+def summarize(records: Sequence[Dict[str, Any]], ks: Sequence[int],
+              same_image_threshold: float = SAME_IMAGE_THRESHOLD) -> Dict[str, Any]:
+    """Quality and latency summary over per-query records (see run_batch)"""
+    labeled = [r for r in records if r["labeled"] and r["error"] is None]
+    summary: Dict[str, Any] = {
+        "queries": len(records),
+        "labeled": len(labeled),
+        "errors": sum(1 for r in records if r["error"] is not None),
+    }
+    if labeled:
+        for k in ks:
+            summary[f"recall@{k}"] = float(np.mean([r["first_relevant_rank"] is not None and r["first_relevant_rank"] <= k
+                                                     for r in labeled]))
+        summary["mrr"] = float(np.mean([1.0 / r["first_relevant_rank"] if r["first_relevant_rank"] else 0.0
+                                        for r in labeled]))
+        summary["same_image_hit_rate"] = float(np.mean([
+            r["first_relevant_rank"] == 1 and r["top_score"] is not None and r["top_score"] >= same_image_threshold
+            for r in labeled
+        ]))
+    answered = [r for r in records if r["error"] is None]
+    if answered:
+        summary["same_image_path_rate"] = float(np.mean([
+            r["top_score"] is not None and r["top_score"] >= same_image_threshold for r in answered
+        ]))
+        for name in ("encode_ms", "query_ms", "total_ms"):
+            values = [r[name] for r in answered]
+            summary[f"{name}_p50"] = float(np.percentile(values, 50))
+            summary[f"{name}_p95"] = float(np.percentile(values, 95))
+            summary[f"{name}_p99"] = float(np.percentile(values, 99))
+    return summary
+
+
+def run_batch(model, index, queries: List[Dict[str, Any]], top_k: int = 10,
+              batch_size: int = DEFAULT_BATCH_SIZE, namespace: str = "") -> List[Dict[str, Any]]:
+    """
+    Encode queries in batches and query the index one by one
+
+    Returns:
+        One record per query: labels, result IDs and scores, rank of the first relevant
+        result, and latency (encode time is the batch's time divided by its size)
+    """
+    records = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        images, loaded = [], []
+        for query in batch:
+            try:
+                images.append(load_query_image(query["image"]))
+                loaded.append(query)
+            except Exception as e:
+                logger.error(f"Could not load {query['image']}: {e}")
+                records.append({**query, "labeled": False, "error": str(e), "results": [],
+                                "first_relevant_rank": None, "top_score": None,
+                                "encode_ms": 0.0, "query_ms": 0.0, "total_ms": 0.0})
+        if not images:
+            continue
+        encode_start = time.perf_counter()
+        embeddings = model.encode(images, batch_size=batch_size, convert_to_numpy=True)
+        encode_ms = (time.perf_counter() - encode_start) * 1000.0 / len(images)
+
+        for query, embedding in zip(loaded, embeddings):
+            query_start = time.perf_counter()
+            error = None
+            try:
+                matches = index.query(vector=embedding.tolist(), top_k=top_k, include_metadata=True,
+                                      namespace=namespace).get("matches", [])
+            except Exception as e:
+                logger.error(f"Query failed for {query['image']}: {e}")
+                matches, error = [], str(e)
+            query_ms = (time.perf_counter() - query_start) * 1000.0
+            ranks = [i for i, match in enumerate(matches, 1) if is_relevant(match, query)]
+            records.append({
+                **query,
+                "labeled": query.get("product_id") is not None or bool(query.get("target")),
+                "error": error,
+                "results": [{"id": m.get("id"), "score": round(float(m.get("score", 0.0)), 6),
+                             "product_id": (m.get("metadata") or {}).get("product_id")} for m in matches],
+                "first_relevant_rank": ranks[0] if ranks else None,
+                "top_score": float(matches[0].get("score", 0.0)) if matches else None,
+                "encode_ms": encode_ms,
+                "query_ms": query_ms,
+                "total_ms": encode_ms + query_ms,
+            })
+        logger.info(f"Evaluated {len(records)}/{len(queries)} queries")
+    return records
+
+
+def write_csv(records: Sequence[Dict[str, Any]], path) -> None:
+    fields = ["image", "product_id", "target", "first_relevant_rank", "top_score", "top_id",
+              "encode_ms", "query_ms", "total_ms", "error"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in records:
+            writer.writerow({**{k: r.get(k) for k in fields}, "top_id": r["results"][0]["id"] if r["results"] else None})
+
+
+def evaluate(queries: List[Dict[str, Any]], top_k: int = 10, batch_size: int = DEFAULT_BATCH_SIZE,
+             backend: str = SEARCH_BACKEND, local_path=LOCAL_INDEX_PATH, namespace: str = "",
+             same_image_threshold: float = SAME_IMAGE_THRESHOLD) -> Dict[str, Any]:
+    """Load the model and index once, run every query and build the report"""
+    load_start = time.perf_counter()
+    logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME}")
+    model = SentenceTransformer(CLIP_MODEL_NAME)
+    index = open_index(backend, local_path)
+    load_seconds = time.perf_counter() - load_start
+
+    records = run_batch(model, index, queries, top_k, batch_size, namespace)
+    ks = sorted({k for k in (1, 5, 10, top_k) if k <= top_k})
+    return {
+        "config": {
+            "model": CLIP_MODEL_NAME,
+            "backend": backend,
+            "index": str(local_path) if backend == "local" else PINECONE_INDEX_NAME,
+            "namespace": namespace,
+            "top_k": top_k,
+            "batch_size": batch_size,
+            "same_image_threshold": same_image_threshold,
+            "load_seconds": round(load_seconds, 3),
+        },
+        "summary": summarize(records, ks, same_image_threshold),
+        "queries": records,
+    }
+
+
 def main():
     """Main function"""
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description="Query similar images, or evaluate retrieval over a batch of labeled queries")
+    parser.add_argument("query_image", nargs="?", help="Single query image")
+    parser.add_argument("top_k", nargs="?", type=int, default=None, help="Results for a single query (default 5)")
+    parser.add_argument("--dir", type=str, default=None, help="Evaluate every image in this directory")
+    parser.add_argument("--manifest", type=str, default=None, help="Evaluate the queries of a labeled CSV/JSONL manifest")
+    parser.add_argument("--product_from_dir", action="store_true", help="--dir: parent directory name is the product ID")
+    parser.add_argument("--k", type=int, default=10, help="Results per query in batch mode")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Images per model call")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default=SEARCH_BACKEND, help="Vector index to query")
+    parser.add_argument("--local_index", type=str, default=str(LOCAL_INDEX_PATH), help="Local index directory")
+    parser.add_argument("--namespace", default="", help="Namespace to query")
+    parser.add_argument("--same_image_threshold", type=float, default=SAME_IMAGE_THRESHOLD, help="Score of the API's same-image path")
+    parser.add_argument("--out", type=str, default=None, help="Write the full report as JSON")
+    parser.add_argument("--csv", type=str, default=None, help="Write one CSV row per query")
+    args = parser.parse_args()
+
+    if args.dir or args.manifest:
+        try:
+            queries = load_manifest(args.manifest) if args.manifest else directory_queries(args.dir, args.product_from_dir)
+            if not queries:
+                logger.error("No query images found")
+                sys.exit(1)
+            report = evaluate(queries, args.k, args.batch_size, args.backend, args.local_index, args.namespace,
+                              args.same_image_threshold)
+        except Exception as e:
+            logger.error(f"Evaluation failed: {e}")
+            sys.exit(1)
+        print(json.dumps(report["summary"], indent=2))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if args.csv:
+            write_csv(report["queries"], args.csv)
+        return
+
+    if not args.query_image:
         print("Usage: python query_similar_images.py <path_to_query_image> [top_k]")
+        print("       python query_similar_images.py --dir <queries> | --manifest <labels.csv> [--k 10] [--out report.json]")
         print("\nExample:")
         print("  python query_similar_images.py ../client/src/assets/furniture/bed.jpg 5")
         sys.exit(1)
-    
-    query_image_path = sys.argv[1]
-    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
-    
+
+    query_image_path = args.query_image
+    top_k = args.top_k or 5
+
     if not Path(query_image_path).exists():
         logger.error(f"Query image not found: {query_image_path}")
         sys.exit(1)
-    
+
     try:
-        query_similar_images(query_image_path, top_k)
+        query_similar_images(query_image_path, top_k, index=open_index(args.backend, args.local_index))
     except Exception as e:
         logger.error(f"Failed to query similar images: {e}")
         sys.exit(1)
@@ -111,5 +361,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
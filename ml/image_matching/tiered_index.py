@@ -0,0 +1,367 @@
+"""
+Two-tier vector index: a small mutable fresh segment over an immutable HNSW base
+
+Inserting into an HNSW graph costs a graph search per vector, and rewiring links under
+concurrent searches needs locking. Writes therefore go to a fresh segment that is searched
+exactly (a plain matrix scan, fast while it holds a few thousand vectors), and the bulk of
+the catalog stays in a base graph (see hnsw.py) that is never modified once published.
+
+    upsert   goes to the fresh segment and tombstones the ID's base vector, if any
+    delete   removes the ID from the fresh segment and tombstones its base vector
+    query    searches both tiers (the base skipping tombstoned IDs) and merges by score
+
+Once the fresh segment or the tombstones reach ``compact_at`` entries, a background thread
+copies the base, applies the tombstones, inserts the fresh vectors and swaps the new base in.
+Reads and writes only wait for the snapshot and the swap. Writes made during compaction stay
+in the fresh segment, tracked by sequence number, and are folded in by the next compaction.
+When replaced vectors make up more than REBUILD_FRACTION of the graph, compaction rebuilds
+it from the live vectors instead.
+
+On disk a tiered index is a directory with the base graph in ``base/`` and the fresh
+segment plus tombstones in ``fresh.npz``.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from filters import matches_filter
+from hnsw import DEFAULT_EF_CONSTRUCTION, DEFAULT_EF_SEARCH, DEFAULT_M, MANIFEST_FILE, HnswIndex, _normalize_rows
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = "base"
+FRESH_FILE = "fresh.npz"
+DEFAULT_COMPACT_AT = 1000
+# Rebuild the base from live vectors once replaced/deleted nodes exceed this share of it
+REBUILD_FRACTION = 0.2
+
+
+class FreshSegment:
+    """Mutable exact-search segment; every entry carries the sequence number of its last write"""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._seq: List[int] = []
+        self._row_of: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self._row_of
+
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def put(self, vector_id: str, vector: np.ndarray, metadata: Dict[str, Any], seq: int) -> None:
+        row = self._row_of.get(vector_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._vectors):
+                grown = np.zeros((max(64, 2 * row), self.dimension), dtype=np.float32)
+                grown[:row] = self._vectors[:row]
+                self._vectors = grown
+            self._ids.append(vector_id)
+            self._metadata.append({})
+            self._seq.append(0)
+            self._row_of[vector_id] = row
+        self._vectors[row] = vector
+        self._metadata[row] = dict(metadata)
+        self._seq[row] = seq
+
+    def remove(self, vector_id: str) -> bool:
+        row = self._row_of.pop(vector_id, None)
+        if row is None:
+            return False
+        # Move the last row into the gap
+        last = len(self._ids) - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._ids[row], self._metadata[row], self._seq[row] = self._ids[last], self._metadata[last], self._seq[last]
+            self._row_of[self._ids[row]] = row
+        self._ids.pop()
+        self._metadata.pop()
+        self._seq.pop()
+        return True
+
+    def vector(self, vector_id: str) -> np.ndarray:
+        return self._vectors[self._row_of[vector_id]].copy()
+
+    def metadata(self, vector_id: str) -> Dict[str, Any]:
+        return dict(self._metadata[self._row_of[vector_id]])
+
+    def set_metadata(self, vector_id: str, fields: Dict[str, Any], seq: int) -> None:
+        row = self._row_of[vector_id]
+        self._metadata[row] = {**self._metadata[row], **fields}
+        self._seq[row] = seq
+
+    def snapshot(self) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+        count = len(self._ids)
+        return list(self._ids), self._vectors[:count].copy(), list(self._metadata)
+
+    def drop_through(self, seq: int) -> None:
+        """Remove entries last written at or before ``seq`` (they are in the new base)"""
+        for vector_id in [v for v, s in zip(self._ids, self._seq) if s <= seq]:
+            self.remove(vector_id)
+
+    def search(self, query: np.ndarray, top_k: int, flt: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        count = len(self._ids)
+        if count == 0 or top_k <= 0:
+            return []
+        scores = self._vectors[:count] @ query
+        rows = np.arange(count)
+        if flt:
+            rows = np.array([r for r in range(count) if matches_filter(self._metadata[r], flt)], dtype=np.int64)
+            if len(rows) == 0:
+                return []
+            scores = scores[rows]
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [{"id": self._ids[rows[i]], "score": float(scores[i]), "metadata": dict(self._metadata[rows[i]])}
+                for i in order]
+
+
+class TieredIndex:
+    """
+    Fresh segment plus immutable HNSW base, with tombstones and background compaction
+
+    Offers the same operations as HnswIndex (add, delete, update_metadata, query, ids,
+    vector, metadata, save/load), and is safe to call from several threads.
+    """
+
+    def __init__(self, dimension: int, base: Optional[HnswIndex] = None, M: int = DEFAULT_M,
+                 ef_construction: int = DEFAULT_EF_CONSTRUCTION, ef_search: int = DEFAULT_EF_SEARCH,
+                 compact_at: int = DEFAULT_COMPACT_AT, projection: Optional[np.ndarray] = None):
+        self.dimension = int(dimension)
+        # Every base built here walks its graph with the projection (see hnsw.py)
+        self.params = {"M": M, "ef_construction": ef_construction, "ef_search": ef_search, "projection": projection}
+        self.compact_at = compact_at
+        self._base = base
+        self._base_saved = base is None
+        self._fresh = FreshSegment(self.dimension)
+        # ID -> sequence number of the write that hid its base version
+        self._tombstones: Dict[str, int] = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+        self.compactions = 0
+
+    # Writes
+
+    def _tombstone(self, vector_id: str) -> None:
+        # During compaction any write may hide a vector the new base is about to contain
+        if self.compacting or (self._base is not None and vector_id in self._base):
+            self._tombstones[vector_id] = self._seq
+
+    def add(self, ids: Sequence[str], vectors, metadata: Optional[Sequence[Dict[str, Any]]] = None) -> None:
+        """Insert or replace vectors; they are searchable when this returns"""
+        vectors = _normalize_rows(vectors)
+        if vectors.shape != (len(ids), self.dimension):
+            raise ValueError(f"Expected {len(ids)} vectors of dimension {self.dimension}, got {vectors.shape}")
+        metadata = metadata if metadata is not None else [{}] * len(ids)
+        with self._lock:
+            for vector_id, vector, meta in zip(ids, vectors, metadata):
+                self._seq += 1
+                self._fresh.put(str(vector_id), vector, meta or {}, self._seq)
+                self._tombstone(str(vector_id))
+        self._maybe_compact()
+
+    def delete(self, ids: Sequence[str]) -> int:
+        removed = 0
+        with self._lock:
+            for vector_id in map(str, ids):
+                present = vector_id in self._fresh or self._in_base(vector_id)
+                self._seq += 1
+                self._fresh.remove(vector_id)
+                self._tombstone(vector_id)
+                removed += present
+        self._maybe_compact()
+        return removed
+
+    def update_metadata(self, vector_id: str, fields: Dict[str, Any]) -> bool:
+        """Merge metadata fields; a base vector is copied into the fresh segment first"""
+        with self._lock:
+            self._seq += 1
+            if vector_id in self._fresh:
+                self._fresh.set_metadata(vector_id, fields, self._seq)
+            elif self._in_base(vector_id):
+                merged = {**self._base.metadata(vector_id), **fields}
+                self._fresh.put(vector_id, self._base.vector(vector_id), merged, self._seq)
+                self._tombstone(vector_id)
+            else:
+                return False
+        self._maybe_compact()
+        return True
+
+    # Reads
+
+    def _in_base(self, vector_id: str) -> bool:
+        return self._base is not None and vector_id in self._base and vector_id not in self._tombstones
+
+    def __len__(self) -> int:
+        with self._lock:
+            hidden = sum(1 for v in self._tombstones if self._base is not None and v in self._base)
+            return (len(self._base) if self._base is not None else 0) - hidden + len(self._fresh)
+
+    def __contains__(self, vector_id: str) -> bool:
+        with self._lock:
+            return vector_id in self._fresh or self._in_base(vector_id)
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            base_ids = [] if self._base is None else [v for v in self._base.ids() if v not in self._tombstones]
+            return base_ids + self._fresh.ids()
+
+    def vector(self, vector_id: str) -> np.ndarray:
+        with self._lock:
+            return self._fresh.vector(vector_id) if vector_id in self._fresh else self._base_only(vector_id).vector(vector_id)
+
+    def metadata(self, vector_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._fresh.metadata(vector_id) if vector_id in self._fresh else self._base_only(vector_id).metadata(vector_id)
+
+    def _base_only(self, vector_id: str) -> HnswIndex:
+        if not self._in_base(vector_id):
+            raise KeyError(vector_id)
+        return self._base
+
+    def query(self, vector, top_k: int = 5, filter: Optional[Dict[str, Any]] = None,
+              include_metadata: bool = True) -> Dict[str, Any]:
+        """Pinecone-shaped query over both tiers"""
+        query = _normalize_rows(vector)[0]
+        with self._lock:
+            # The fresh scan is short; the base is immutable, so it is searched outside the lock
+            fresh = self._fresh.search(query, top_k, filter)
+            base, tombstones = self._base, frozenset(self._tombstones)
+        matches = list(fresh)
+        if base is not None:
+            matches += [base.match(node, score) for node, score in base.search(query, top_k, filter, exclude=tombstones)]
+        matches.sort(key=lambda m: m["score"], reverse=True)
+        if not include_metadata:
+            for match in matches:
+                match.pop("metadata", None)
+        return {"matches": matches[:top_k]}
+
+    # Compaction
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "base_vectors": len(self._base) if self._base is not None else 0,
+                "fresh_vectors": len(self._fresh),
+                "tombstones": len(self._tombstones),
+                "compacting": self.compacting,
+                "compactions": self.compactions,
+                "projection_dim": self._base.projection_dim if self._base is not None else None,
+            }
+
+    @property
+    def compacting(self) -> bool:
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def _maybe_compact(self) -> None:
+        if self.compact_at and max(len(self._fresh), len(self._tombstones)) >= self.compact_at and not self.compacting:
+            self.compact(wait=False)
+
+    def compact(self, wait: bool = True) -> None:
+        """Fold the fresh segment and tombstones into a new base (in a background thread unless ``wait``)"""
+        with self._lock:
+            if self.compacting:
+                thread = self._compaction
+            else:
+                thread = self._compaction = threading.Thread(target=self._compact, name="index-compaction", daemon=True)
+                thread.start()
+        if wait:
+            thread.join()
+
+    def _compact(self) -> None:
+        start = time.perf_counter()
+        with self._lock:
+            through = self._seq
+            base = self._base
+            ids, vectors, metadata = self._fresh.snapshot()
+            deleted = list(self._tombstones)
+        if not ids and not deleted:
+            return
+        try:
+            if base is None:
+                new_base = HnswIndex(self.dimension, **self.params)
+            elif base.deleted_fraction + len(deleted) / max(base.node_count, 1) > REBUILD_FRACTION:
+                hidden = set(deleted)
+                live = [v for v in base.ids() if v not in hidden]
+                new_base = HnswIndex(self.dimension, **self.params)
+                new_base.add(live, np.stack([base.vector(v) for v in live]) if live else np.zeros((0, self.dimension)),
+                             [base.metadata(v) for v in live])
+            else:
+                new_base = base.copy()
+                new_base.delete(deleted)
+            if ids:
+                new_base.add(ids, vectors, metadata)
+        except Exception as e:
+            logger.error(f"❌ Compaction failed, keeping the current base: {e}")
+            return
+        with self._lock:
+            self._base = new_base
+            self._base_saved = False
+            self._fresh.drop_through(through)
+            # Older tombstones are applied in the new base; newer ones still hide its vectors
+            self._tombstones = {v: s for v, s in self._tombstones.items() if s > through and v in new_base}
+            self.compactions += 1
+        logger.info(f"Compacted {len(ids)} fresh vectors and {len(deleted)} tombstones into a base of "
+                    f"{len(new_base)} vectors in {time.perf_counter() - start:.1f}s")
+
+    # Persistence
+
+    def save(self, path) -> None:
+        """Write the base (if it changed since the last save) and the fresh segment"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            base, base_saved = self._base, self._base_saved
+            ids, vectors, metadata = self._fresh.snapshot()
+            tombstones = list(self._tombstones)
+        # Base first: after a crash between the two writes, the older fresh file only
+        # re-adds vectors the new base already holds, which the tombstones then hide
+        if base is not None and not base_saved:
+            base.save(path / BASE_DIR)
+            with self._lock:
+                self._base_saved = self._base is base
+        handle, tmp = tempfile.mkstemp(prefix=".fresh.", suffix=".npz", dir=path)
+        with os.fdopen(handle, "wb") as f:
+            np.savez(f, ids=np.array(ids, dtype=str), vectors=vectors,
+                     metadata=np.array(json.dumps(metadata)), tombstones=np.array(tombstones, dtype=str))
+        os.replace(tmp, path / FRESH_FILE)
+
+    @classmethod
+    def load(cls, path, **params) -> "TieredIndex":
+        path = Path(path)
+        base = HnswIndex.load(path / BASE_DIR, ef_search=params.get("ef_search"), projection=params.get("projection")) \
+            if (path / BASE_DIR / MANIFEST_FILE).exists() else None
+        fresh = np.load(path / FRESH_FILE) if (path / FRESH_FILE).exists() else None
+        if base is None and fresh is None:
+            raise FileNotFoundError(f"No tiered index at {path}")
+        dimension = base.dimension if base is not None else fresh["vectors"].shape[1]
+        if base is not None:
+            params = {"M": base.M, "ef_construction": base.ef_construction, **params}
+        index = cls(dimension, base, **params)
+        index._base_saved = True
+        if fresh is not None:
+            # Tombstones at sequence 0 are applied by the next compaction
+            index._tombstones = {str(v): 0 for v in fresh["tombstones"]}
+            ids = [str(v) for v in fresh["ids"]]
+            for vector_id, vector, meta in zip(ids, fresh["vectors"], json.loads(str(fresh["metadata"]))):
+                index._seq += 1
+                index._fresh.put(vector_id, vector, meta, index._seq)
+                if base is not None and vector_id in base:
+                    index._tombstones.setdefault(vector_id, 0)
+        return index
@@ -0,0 +1,283 @@
+"""
+Chunked, concurrent, retrying vector upserts
+
+Every path that writes vectors (generate_embeddings.py, /add-product, the centroid backfill)
+goes through UpsertWriter:
+
+- Records are grouped into requests of at most ``max_vectors`` vectors and ``max_bytes``
+  of JSON (768 floats plus metadata is ~15 KB, so a large batch can exceed Pinecone's
+  request limit long before its vector limit).
+- Up to ``max_in_flight`` requests run concurrently; ``add`` blocks while that many are
+  pending, which bounds memory as well as load on the index.
+- Failures that look transient (timeouts, connection errors, 429 and 5xx responses) are
+  retried with exponential backoff and jitter; others fail the chunk immediately.
+- Records of chunks that still fail are appended to a spill file (JSON lines, vectors
+  included), so the write can be finished later without re-embedding:
+
+    python upsert_writer.py --resume embeddings/failed_upserts/<file>.jsonl
+
+Resuming writes to the configured backend (the local index with SEARCH_BACKEND=local).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Pinecone accepts up to 1000 vectors and 2 MB per upsert request
+DEFAULT_MAX_VECTORS = 100
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+# Request overhead beyond the records themselves (namespace, JSON framing)
+REQUEST_OVERHEAD_BYTES = 1024
+# Upper bound of one float in a JSON request ("-0.012345678918552399, "); estimating sizes
+# this way avoids encoding every vector twice
+BYTES_PER_VALUE = 24
+RECORD_OVERHEAD_BYTES = 64
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attr in ("status", "status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None) or getattr(response, "status", None)
+    return value if isinstance(value, int) else None
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an upsert error is worth retrying"""
+    status = _status_code(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    # No HTTP status: network-level failures are transient, programming errors are not
+    return not isinstance(error, (TypeError, ValueError, KeyError, AttributeError))
+
+
+def _estimated_size(record: Dict[str, Any]) -> int:
+    """Upper bound of a record's JSON size in an upsert request"""
+    return (len(record["values"]) * BYTES_PER_VALUE + len(record["id"]) + RECORD_OVERHEAD_BYTES
+            + len(json.dumps(record.get("metadata", {}))))
+
+
+def _plain(record) -> Dict[str, Any]:
+    """A Pinecone upsert item (dict or (id, values[, metadata]) tuple) as a JSON-ready dict"""
+    if not isinstance(record, dict):
+        record = {"id": record[0], "values": record[1], **({"metadata": record[2]} if len(record) > 2 else {})}
+    values = record["values"]
+    values = values.tolist() if hasattr(values, "tolist") else list(values)
+    plain = {"id": str(record["id"]), "values": values}
+    if record.get("metadata"):
+        plain["metadata"] = record["metadata"]
+    return plain
+
+
+class UpsertWriter:
+    """
+    Streams records into an index in size-limited chunks with bounded concurrency
+
+    Usage:
+        with UpsertWriter(index, spill_dir="embeddings/failed_upserts") as writer:
+            for batch in batches:
+                writer.add(batch)
+        writer.report()   # {"upserted", "failed", "chunks", "retries", "seconds", "vectors_per_second", ...}
+    """
+
+    def __init__(self, index, namespace: str = "", max_vectors: int = DEFAULT_MAX_VECTORS,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, spill_dir=None, spill_path=None,
+                 sleep=time.sleep):
+        self.index = index
+        self.namespace = namespace
+        self.max_vectors = max_vectors
+        self.max_bytes = max_bytes
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.sleep = sleep
+        if spill_path is None and spill_dir is not None:
+            spill_path = Path(spill_dir) / f"failed_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{id(self):x}.jsonl"
+        self.spill_path = Path(spill_path) if spill_path is not None else None
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="upsert")
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_bytes = REQUEST_OVERHEAD_BYTES
+        self._futures: List[Future] = []
+        self._started = time.perf_counter()
+        self._finished: Optional[float] = None
+        self._stats = {"upserted": 0, "failed": 0, "chunks": 0, "failed_chunks": 0, "retries": 0}
+        self.failed_ids: List[str] = []
+
+    def __enter__(self) -> "UpsertWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def add(self, records: Iterable[Any]) -> None:
+        """Queue records; full chunks are sent as they fill up"""
+        for record in records:
+            record = _plain(record)
+            size = _estimated_size(record)
+            if self._pending and (len(self._pending) >= self.max_vectors
+                                  or self._pending_bytes + size > self.max_bytes):
+                self._submit()
+            self._pending.append(record)
+            self._pending_bytes += size
+        if len(self._pending) >= self.max_vectors:
+            self._submit()
+
+    def flush(self) -> Dict[str, Any]:
+        """Send what is buffered and wait for every request; returns the report so far"""
+        if self._pending:
+            self._submit()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        self._finished = time.perf_counter()
+        return self.report()
+
+    def close(self) -> Dict[str, Any]:
+        report = self.flush()
+        self._executor.shutdown(wait=True)
+        if self._stats["failed"]:
+            logger.error(f"❌ {self._stats['failed']} vectors could not be upserted"
+                         + (f"; resume with: python upsert_writer.py --resume {self.spill_path}" if self.spill_path else ""))
+        return report
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = (self._finished or time.perf_counter()) - self._started
+            return {
+                **self._stats,
+                "seconds": round(elapsed, 3),
+                "vectors_per_second": round(self._stats["upserted"] / max(elapsed, 1e-9), 1),
+                "spill_path": str(self.spill_path) if self.spill_path and self._stats["failed"] else None,
+            }
+
+    def _submit(self) -> None:
+        chunk, self._pending, self._pending_bytes = self._pending, [], REQUEST_OVERHEAD_BYTES
+        # Blocks while max_in_flight requests are pending
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._send, chunk)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures = [f for f in self._futures if not f.done()] + [future]
+
+    def _send(self, chunk: List[Dict[str, Any]]) -> None:
+        attempt = 0
+        while True:
+            try:
+                self.index.upsert(vectors=chunk, namespace=self.namespace)
+                with self._lock:
+                    self._stats["upserted"] += len(chunk)
+                    self._stats["chunks"] += 1
+                return
+            except Exception as e:
+                if attempt < self.max_retries and is_transient(e):
+                    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    attempt += 1
+                    with self._lock:
+                        self._stats["retries"] += 1
+                    logger.warning(f"Upsert of {len(chunk)} vectors failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                    self.sleep(delay)
+                    continue
+                logger.error(f"Upsert of {len(chunk)} vectors failed after {attempt + 1} attempts: {e}")
+                self._spill(chunk)
+                return
+
+    def _spill(self, chunk: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._stats["failed"] += len(chunk)
+            self._stats["failed_chunks"] += 1
+            self.failed_ids.extend(r["id"] for r in chunk)
+            if self.spill_path is None:
+                return
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for record in chunk:
+                    f.write(json.dumps({**record, "namespace": self.namespace}) + "\n")
+
+
+def upsert_all(index, records: Iterable[Any], namespace: str = "", **options) -> Dict[str, Any]:
+    """Write records through an UpsertWriter and return its report"""
+    with UpsertWriter(index, namespace=namespace, **options) as writer:
+        writer.add(records)
+    return writer.report()
+
+
+def resume(index, spill_path, **options) -> Dict[str, Any]:
+    """
+    Upsert the records of a spill file again
+
+    Records that fail again are written to a new spill file next to it; the original file
+    is removed once its records are written or re-spilled.
+    """
+    spill_path = Path(spill_path)
+    by_namespace: Dict[str, List[Dict[str, Any]]] = {}
+    with open(spill_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                by_namespace.setdefault(record.pop("namespace", ""), []).append(record)
+    total = {"upserted": 0, "failed": 0, "spill_paths": []}
+    for namespace, records in by_namespace.items():
+        report = upsert_all(index, records, namespace=namespace, spill_dir=spill_path.parent, **options)
+        total["upserted"] += report["upserted"]
+        total["failed"] += report["failed"]
+        if report["spill_path"]:
+            total["spill_paths"].append(report["spill_path"])
+    spill_path.unlink()
+    return total
+
+
+def main():
+    """Re-send the records of a spill file left by a failed upsert"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Resume failed vector upserts without re-embedding")
+    parser.add_argument("--resume", required=True, help="Spill file (JSON lines) written by UpsertWriter")
+    parser.add_argument("--max_in_flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Concurrent upsert requests")
+    args = parser.parse_args()
+
+    from config import SEARCH_BACKEND, LOCAL_INDEX_PATH, PINECONE_API_KEY, PINECONE_INDEX_NAME
+
+    try:
+        # Replay into the backend the spill file was written for
+        if SEARCH_BACKEND == "local":
+            from local_index import LocalIndex
+            index = LocalIndex(LOCAL_INDEX_PATH)
+        else:
+            from pinecone import Pinecone
+            index = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+        report = resume(index, args.resume, max_in_flight=args.max_in_flight)
+        if SEARCH_BACKEND == "local":
+            index.save()
+        if report["failed"]:
+            logger.error(f"❌ {report['failed']} vectors failed again; see {', '.join(report['spill_paths'])}")
+            sys.exit(1)
+        logger.info(f"✅ Upserted {report['upserted']} vectors from {args.resume}")
+    except Exception as e:
+        logger.error(f"❌ Error resuming upserts: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
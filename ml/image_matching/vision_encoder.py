@@ -0,0 +1,86 @@
+"""
+CLIP image encoder without the text tower
+
+``SentenceTransformer(CLIP_MODEL_NAME)`` keeps both towers resident, although search and
+ingest workers only encode images (the few text prompts they need come precomputed from
+prompt_embeddings.py). VisionEncoder loads just the vision transformer and projection from
+the same sentence-transformers checkpoint, so its embeddings are the ones the full model
+produces for images, and exposes the parts of the SentenceTransformer API the service uses.
+
+Select it with CLIP_LOAD_MODE=vision; load_image_model() returns whichever the mode asks for.
+"""
+
+import logging
+from typing import List, Union
+
+import numpy as np
+from PIL import Image
+
+from config import CLIP_MODEL_NAME, CLIP_LOAD_MODE
+
+logger = logging.getLogger(__name__)
+
+# sentence-transformers CLIP checkpoints keep the Hugging Face model in this subfolder
+ST_CLIP_SUBFOLDER = "0_CLIPModel"
+
+
+class VisionEncoder:
+    """
+    Vision tower of a sentence-transformers CLIP model
+
+    Usage:
+        encoder = VisionEncoder("clip-ViT-L-14")
+        embedding = encoder.encode(image)             # (dim,)
+        embeddings = encoder.encode(images, batch_size=16)   # (len(images), dim)
+    """
+
+    def __init__(self, model_name: str = CLIP_MODEL_NAME, device: str = None):
+        import torch
+        from transformers import CLIPConfig, CLIPImageProcessor, CLIPVisionModelWithProjection
+
+        self.model_name = model_name
+        repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        config = CLIPConfig.from_pretrained(repo, subfolder=ST_CLIP_SUBFOLDER)
+        vision_config = config.vision_config
+        vision_config.projection_dim = config.projection_dim
+
+        self._torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.processor = CLIPImageProcessor.from_pretrained(repo, subfolder=ST_CLIP_SUBFOLDER)
+        # Text tower weights in the checkpoint are skipped while loading
+        self.model = CLIPVisionModelWithProjection.from_pretrained(
+            repo, subfolder=ST_CLIP_SUBFOLDER, config=vision_config
+        ).to(self.device).eval()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.projection_dim
+
+    def encode(self, images: Union[Image.Image, List[Image.Image]], batch_size: int = 32,
+               convert_to_numpy: bool = True, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        Embed one image or a list of images (always returned as numpy)
+
+        Raises TypeError for text: use prompt_embeddings.py, or load_text_model() in tooling.
+        """
+        single = isinstance(images, Image.Image)
+        images = [images] if single else list(images)
+        if any(not isinstance(image, Image.Image) for image in images):
+            raise TypeError("VisionEncoder only encodes images; text needs the full model (prompt_embeddings.load_text_model)")
+        batches = []
+        with self._torch.inference_mode():
+            for start in range(0, len(images), batch_size):
+                pixels = self.processor(images=images[start:start + batch_size], return_tensors="pt")["pixel_values"]
+                output = self.model(pixel_values=pixels.to(self.device))
+                batches.append(output.image_embeds.float().cpu().numpy())
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def load_image_model(mode: str = CLIP_LOAD_MODE, model_name: str = CLIP_MODEL_NAME):
+    """VisionEncoder for mode "vision", otherwise the full SentenceTransformer"""
+    if mode == "vision":
+        logger.info(f"Loading CLIP vision encoder: {model_name}")
+        return VisionEncoder(model_name)
+    from sentence_transformers import SentenceTransformer
+    logger.info(f"Loading CLIP model: {model_name}")
+    return SentenceTransformer(model_name)
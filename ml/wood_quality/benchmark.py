@@ -0,0 +1,86 @@
+"""Inference cost of the saved wood-quality models.
+
+For every model this measures what ``predict.py`` would serve: the compiled ``.npz`` when it
+exists, otherwise the scikit-learn pipeline. Reported per model: artifact size, load time,
+single-row latency (preprocessing + predict_proba, p50/p99) and rows/s at several batch sizes.
+"""
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from compiled import compiled_path, load_compiled
+from ensemble import needs_dense
+
+BATCH_SIZES = (32, 256, 2048)
+LATENCY_ROUNDS = 200
+MIN_SECONDS = 0.2
+
+
+def _load(out_dir: str, name: str):
+	path = compiled_path(out_dir, name)
+	if os.path.exists(path):
+		pre, est = load_compiled(path)
+		return "compiled", path, pre, est
+	import joblib
+
+	path = os.path.join(out_dir, f"model_{name}.joblib")
+	pipe = joblib.load(path)
+	return "sklearn", path, pipe.named_steps["preprocess"], pipe.named_steps["model"]
+
+
+def _infer(backend: str, pre, est) -> Callable[[pd.DataFrame], Any]:
+	def run(df: pd.DataFrame):
+		# Compiled artifacts take column arrays like predict.py passes them
+		X = {c: df[c].to_numpy() for c in df.columns} if backend == "compiled" else df
+		Xt = pre.transform(X)
+		if hasattr(Xt, "toarray") and needs_dense(est):
+			Xt = Xt.toarray()
+		return est.predict_proba(Xt) if hasattr(est, "predict_proba") else est.predict(Xt)
+
+	return run
+
+
+def _rows_per_second(run: Callable[[pd.DataFrame], Any], batch: pd.DataFrame) -> float:
+	run(batch)
+	rounds, start = 0, time.perf_counter()
+	while True:
+		run(batch)
+		rounds += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= MIN_SECONDS and rounds >= 3:
+			return rounds * len(batch) / elapsed
+
+
+def benchmark_model(out_dir: str, name: str, X_sample: pd.DataFrame) -> Dict[str, Any]:
+	start = time.perf_counter()
+	backend, path, pre, est = _load(out_dir, name)
+	load_ms = (time.perf_counter() - start) * 1000.0
+	run = _infer(backend, pre, est)
+
+	rows = [X_sample.iloc[[i % len(X_sample)]] for i in range(LATENCY_ROUNDS)]
+	run(rows[0])
+	latencies = []
+	for row in rows:
+		start = time.perf_counter()
+		run(row)
+		latencies.append((time.perf_counter() - start) * 1000.0)
+
+	result: Dict[str, Any] = {
+		"model": name,
+		"backend": backend,
+		"size_kb": os.path.getsize(path) / 1024.0,
+		"load_ms": load_ms,
+		"latency_p50_ms": float(np.percentile(latencies, 50)),
+		"latency_p99_ms": float(np.percentile(latencies, 99)),
+	}
+	for size in BATCH_SIZES:
+		batch = X_sample.iloc[np.arange(size) % len(X_sample)]
+		result[f"rows_per_s_{size}"] = _rows_per_second(run, batch)
+	return result
+
+
+def benchmark_models(out_dir: str, names: List[str], X_sample: pd.DataFrame) -> pd.DataFrame:
+	return pd.DataFrame([benchmark_model(out_dir, name, X_sample) for name in names])
@@ -0,0 +1,127 @@
+"""Early-exit cascade over the wood-quality ensemble.
+
+Rows are scored by the cheap stage first; only rows where those models disagree, or where
+one of them is less confident than ``threshold``, go on to the expensive stage. The final
+vote covers every model that ran for the row, using the same rule as ``predict_batch``.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ensemble import Ensemble
+
+# KNN sits with SVM and the MLP: its cost grows with the reference set. A row that reaches
+# the last stage is therefore voted on by all five models, as without the cascade.
+CASCADE_STAGES = [["DecisionTree", "NaiveBayes"], ["KNN", "SVM", "NeuralNet"]]
+DEFAULT_THRESHOLD = 0.7
+
+
+class CascadeStats:
+	"""Thread-safe counters for how much work the cascade saved."""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self.rows = 0
+		self.early_exits = 0
+		self.model_runs = 0
+		self.model_slots = 0
+
+	def record(self, executed: np.ndarray) -> None:
+		with self._lock:
+			self.rows += executed.shape[0]
+			self.early_exits += int(np.sum(~executed[:, -1]))
+			self.model_runs += int(executed.sum())
+			self.model_slots += executed.size
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"rows": self.rows,
+				"early_exit_rate": self.early_exits / self.rows if self.rows else None,
+				# Share of model evaluations the cascade did not have to run
+				"skip_rate": 1.0 - self.model_runs / self.model_slots if self.model_slots else None,
+			}
+
+
+def _n_rows(df: Any) -> int:
+	return len(next(iter(df.values()))) if isinstance(df, dict) else len(df)
+
+
+def _take(df: Any, idx: np.ndarray) -> Any:
+	if isinstance(df, dict):
+		return {k: np.asarray(v)[idx] for k, v in df.items()}
+	return df.iloc[idx]
+
+
+def cascade_predict(
+	models: Ensemble,
+	df: Any,
+	threshold: float = DEFAULT_THRESHOLD,
+	stats: Optional[CascadeStats] = None,
+	names: Optional[List[str]] = None,
+	stages: Optional[List[List[str]]] = None,
+) -> List[Dict[str, Any]]:
+	"""Score ``df`` stage by stage; each row gets ``vote``, ``confidence``, ``models_executed``
+	and the ``results`` of the models that ran for it. ``names`` restricts the models used."""
+	allowed = set(names or models.names())
+	stages = [[m for m in stage if m in allowed] for stage in (stages or CASCADE_STAGES)]
+	stages = [stage for stage in stages if stage]
+	names = [m for stage in stages for m in stage]
+	classes = models.classes
+	n_rows = _n_rows(df)
+
+	labels = {name: np.empty(n_rows, dtype=object) for name in names}
+	probas = {name: np.full((n_rows, len(classes)), np.nan) for name in names}
+	executed = np.zeros((n_rows, len(names)), dtype=bool)
+	active = np.arange(n_rows)
+	for s, stage in enumerate(stages):
+		stage_labels, stage_probas = models.score(_take(df, active), stage)
+		for name in stage:
+			labels[name][active] = stage_labels[name]
+			if name in stage_probas:
+				probas[name][active] = stage_probas[name]
+			executed[active, names.index(name)] = True
+		if s == len(stages) - 1:
+			break
+		# Exit where every model so far agrees and each one is confident enough
+		ran = [m for st in stages[: s + 1] for m in st]
+		agree = np.all([labels[m][active] == labels[ran[0]][active] for m in ran], axis=0)
+		confident = np.all([np.nan_to_num(probas[m][active]).max(axis=1) >= threshold for m in ran], axis=0)
+		active = active[~(agree & confident)]
+		if len(active) == 0:
+			break
+
+	if stats is not None:
+		stats.record(executed)
+
+	# Same vote rule as Ensemble.vote, restricted to the models that ran for each row
+	class_idx = np.array(classes)
+	votes = np.zeros((n_rows, len(classes)))
+	proba_sum = np.zeros((n_rows, len(classes)))
+	proba_count = np.zeros(n_rows)
+	for j, name in enumerate(names):
+		votes += executed[:, j, None] & (labels[name][:, None] == class_idx[None, :])
+		has_proba = executed[:, j] & ~np.isnan(probas[name][:, 0])
+		proba_sum[has_proba] += probas[name][has_proba]
+		proba_count += has_proba
+	mean_proba = proba_sum / np.maximum(proba_count, 1)[:, None]
+	vote_idx = np.argmax(votes + 0.5 * mean_proba, axis=1)
+	confidence = mean_proba[np.arange(n_rows), vote_idx]
+
+	label_lists = {name: labels[name].tolist() for name in names}
+	proba_lists = {name: probas[name].tolist() for name in names}
+	rows: List[Dict[str, Any]] = []
+	for i in range(n_rows):
+		ran = [name for j, name in enumerate(names) if executed[i, j]]
+		results = {}
+		for name in ran:
+			p = proba_lists[name][i]
+			results[name] = {"prediction": str(label_lists[name][i]), "probabilities": None if np.isnan(p[0]) else dict(zip(classes, p))}
+		rows.append({
+			"results": results,
+			"vote": str(class_idx[vote_idx[i]]),
+			"confidence": float(confidence[i]) if proba_count[i] else None,
+			"models_executed": ran,
+		})
+	return rows
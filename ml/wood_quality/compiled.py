@@ -0,0 +1,299 @@
+"""NumPy-only export and evaluation of the trained wood-quality pipelines.
+
+``export_pipeline`` flattens a fitted ``Pipeline(preprocess, model)`` into plain arrays
+(one-hot vocabularies, scaler statistics, tree nodes, GaussianNB parameters, MLP weights,
+SVM support vectors) saved as ``compiled_<Model>.npz``. ``load_compiled`` rebuilds a
+preprocessor/estimator pair that reproduces ``predict`` and ``predict_proba`` without
+importing scikit-learn, pandas or joblib.
+"""
+import os
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+
+COMPILED_PREFIX = "compiled_"
+
+
+def compiled_path(out_dir: str, name: str) -> str:
+	return os.path.join(out_dir, f"{COMPILED_PREFIX}{name}.npz")
+
+
+# ---------------------------------------------------------------- export
+
+def _export_preprocessor(pre: Any) -> Dict[str, np.ndarray]:
+	arrays: Dict[str, np.ndarray] = {}
+	blocks = []
+	for kind, transformer, columns in pre.transformers_:
+		if kind == "remainder":
+			if transformer != "drop":
+				raise ValueError("Only remainder='drop' can be compiled")
+			continue
+		cls = type(transformer).__name__
+		if cls == "OneHotEncoder":
+			if transformer.handle_unknown != "ignore" or transformer.drop is not None:
+				raise ValueError("Only OneHotEncoder(handle_unknown='ignore', drop=None) can be compiled")
+			for i, (col, cats) in enumerate(zip(columns, transformer.categories_)):
+				arrays[f"pre_onehot_{len(blocks)}_{i}"] = np.asarray(cats).astype(str)
+			blocks.append(("onehot", list(columns)))
+		elif cls == "StandardScaler":
+			n = len(columns)
+			arrays[f"pre_mean_{len(blocks)}"] = transformer.mean_ if transformer.with_mean else np.zeros(n)
+			arrays[f"pre_scale_{len(blocks)}"] = transformer.scale_ if transformer.with_std else np.ones(n)
+			blocks.append(("scale", list(columns)))
+		else:
+			raise ValueError(f"Cannot compile transformer {cls}")
+	arrays["pre_block_kinds"] = np.array([k for k, _ in blocks])
+	arrays["pre_block_columns"] = np.array(["\t".join(cols) for _, cols in blocks])
+	return arrays
+
+
+def _dense(a: Any) -> np.ndarray:
+	# Estimators fitted on sparse input keep sparse support vectors / reference sets
+	return a.toarray() if hasattr(a, "toarray") else np.asarray(a)
+
+
+def _export_estimator(est: Any) -> Dict[str, np.ndarray]:
+	cls = type(est).__name__
+	arrays: Dict[str, np.ndarray] = {"classes": np.asarray(est.classes_).astype(str)}
+	if cls == "KNeighborsClassifier":
+		if est.weights != "uniform" or est.effective_metric_ != "euclidean":
+			raise ValueError("Only uniform-weight euclidean KNN can be compiled")
+		arrays.update(kind="knn", fit_X=_dense(est._fit_X).astype(float), fit_y=est._y, n_neighbors=np.array(est.n_neighbors))
+	elif cls == "GaussianNB":
+		arrays.update(kind="gaussian_nb", theta=est.theta_, var=est.var_, class_prior=est.class_prior_)
+	elif cls == "DecisionTreeClassifier":
+		tree = est.tree_
+		arrays.update(
+			kind="tree",
+			children_left=tree.children_left,
+			children_right=tree.children_right,
+			feature=tree.feature,
+			threshold=tree.threshold,
+			value=tree.value[:, 0, :],
+		)
+	elif cls == "MLPClassifier":
+		arrays.update(kind="mlp", activation=np.array(est.activation), out_activation=np.array(est.out_activation_))
+		for i, (w, b) in enumerate(zip(est.coefs_, est.intercepts_)):
+			arrays[f"coef_{i}"] = w
+			arrays[f"intercept_{i}"] = b
+		arrays["n_layers"] = np.array(len(est.coefs_))
+	elif cls == "SVC":
+		if est.kernel != "rbf":
+			raise ValueError("Only the RBF SVC kernel can be compiled")
+		arrays.update(
+			kind="svc_rbf",
+			support_vectors=_dense(est.support_vectors_),
+			n_support=est.n_support_,
+			dual_coef=_dense(est._dual_coef_),
+			intercept=est._intercept_,
+			gamma=np.array(est._gamma),
+		)
+		if getattr(est, "probability", False):
+			arrays.update(prob_a=est.probA_, prob_b=est.probB_)
+	else:
+		raise ValueError(f"Cannot compile estimator {cls}")
+	return arrays
+
+
+def export_pipeline(preprocessor: Any, estimator: Any, path: str) -> None:
+	arrays = _export_preprocessor(preprocessor)
+	arrays.update({f"est_{k}": np.asarray(v) for k, v in _export_estimator(estimator).items()})
+	np.savez_compressed(path, **arrays)
+
+
+# ---------------------------------------------------------------- evaluation
+
+class CompiledPreprocessor:
+	"""One-hot + standard scaling over named columns (a DataFrame or a dict of arrays)."""
+
+	def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+		self.blocks: List[Tuple[str, List[str], Any]] = []
+		for b, (kind, cols) in enumerate(zip(arrays["pre_block_kinds"], arrays["pre_block_columns"])):
+			columns = str(cols).split("\t")
+			if kind == "onehot":
+				params = [arrays[f"pre_onehot_{b}_{i}"] for i in range(len(columns))]
+			else:
+				params = (arrays[f"pre_mean_{b}"], arrays[f"pre_scale_{b}"])
+			self.blocks.append((str(kind), columns, params))
+		# Identical preprocessors (one copy per exported pipeline) share a key
+		self.key = tuple((kind, tuple(cols), tuple(p.tobytes() for p in params)) for kind, cols, params in self.blocks)
+
+	def transform(self, X: Any) -> np.ndarray:
+		parts = []
+		for kind, columns, params in self.blocks:
+			if kind == "onehot":
+				for col, cats in zip(columns, params):
+					values = np.asarray(X[col]).astype(str)
+					pos = np.searchsorted(cats, values)
+					pos_clipped = np.minimum(pos, len(cats) - 1)
+					known = cats[pos_clipped] == values
+					block = np.zeros((len(values), len(cats)))
+					block[np.nonzero(known)[0], pos_clipped[known]] = 1.0
+					parts.append(block)
+			else:
+				mean, scale = params
+				block = np.column_stack([np.asarray(X[col], dtype=float) for col in columns])
+				parts.append((block - mean) / scale)
+		return np.hstack(parts)
+
+
+def _logsumexp(a: np.ndarray) -> np.ndarray:
+	a_max = np.max(a, axis=1, keepdims=True)
+	return np.log(np.sum(np.exp(a - a_max), axis=1)) + a_max[:, 0]
+
+
+class CompiledEstimator:
+	"""Array-backed re-implementation of one fitted scikit-learn classifier."""
+
+	def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+		self.a = {k[4:]: v for k, v in arrays.items() if k.startswith("est_")}
+		self.kind = str(self.a["kind"])
+		self.classes_ = self.a["classes"]
+
+	def predict_proba(self, X: np.ndarray) -> np.ndarray:
+		return getattr(self, f"_proba_{self.kind}")(X)
+
+	def predict(self, X: np.ndarray) -> np.ndarray:
+		if self.kind == "svc_rbf":
+			return self.classes_[self._svc_vote(self._svc_decision(X))]
+		return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+	# KNeighborsClassifier(weights="uniform", metric="euclidean")
+	def _proba_knn(self, X: np.ndarray) -> np.ndarray:
+		fit_X, fit_y, k = self.a["fit_X"], self.a["fit_y"], int(self.a["n_neighbors"])
+		fit_sq = (fit_X * fit_X).sum(axis=1)[None, :]
+		counts = np.zeros((len(X), len(self.classes_)))
+		# Query in blocks so the distance matrix stays around 2**22 entries for large reference sets
+		step = max(1, (1 << 22) // max(len(fit_X), 1))
+		for start in range(0, len(X), step):
+			Xb = X[start:start + step]
+			d2 = (Xb * Xb).sum(axis=1)[:, None] - 2.0 * Xb @ fit_X.T + fit_sq
+			neigh = np.argpartition(d2, k - 1, axis=1)[:, :k]
+			rows = np.arange(start, start + len(Xb))
+			for j in range(k):
+				counts[rows, fit_y[neigh[:, j]]] += 1.0
+		return counts / k
+
+	# GaussianNB
+	def _proba_gaussian_nb(self, X: np.ndarray) -> np.ndarray:
+		theta, var, prior = self.a["theta"], self.a["var"], self.a["class_prior"]
+		jll = np.empty((len(X), len(prior)))
+		for i in range(len(prior)):
+			n_ij = -0.5 * np.sum(np.log(2.0 * np.pi * var[i, :]))
+			n_ij -= 0.5 * np.sum(((X - theta[i, :]) ** 2) / (var[i, :]), 1)
+			jll[:, i] = np.log(prior[i]) + n_ij
+		return np.exp(jll - _logsumexp(jll)[:, None])
+
+	# DecisionTreeClassifier (thresholds are compared in float32, like sklearn)
+	def _proba_tree(self, X: np.ndarray) -> np.ndarray:
+		left, right = self.a["children_left"], self.a["children_right"]
+		feature, threshold, value = self.a["feature"], self.a["threshold"], self.a["value"]
+		Xf = np.asarray(X, dtype=np.float32)
+		node = np.zeros(len(X), dtype=np.intp)
+		rows = np.arange(len(X))
+		active = left[node] != -1
+		while active.any():
+			idx = rows[active]
+			n = node[idx]
+			go_left = Xf[idx, feature[n]] <= threshold[n]
+			node[idx] = np.where(go_left, left[n], right[n])
+			active = left[node] != -1
+		proba = value[node]
+		normalizer = proba.sum(axis=1)[:, None]
+		normalizer[normalizer == 0.0] = 1.0
+		return proba / normalizer
+
+	# MLPClassifier
+	def _proba_mlp(self, X: np.ndarray) -> np.ndarray:
+		activation = str(self.a["activation"])
+		n_layers = int(self.a["n_layers"])
+		h = np.asarray(X, dtype=float)
+		for i in range(n_layers):
+			h = h @ self.a[f"coef_{i}"] + self.a[f"intercept_{i}"]
+			if i < n_layers - 1:
+				if activation == "relu":
+					np.maximum(h, 0, out=h)
+				elif activation == "tanh":
+					np.tanh(h, out=h)
+				elif activation == "logistic":
+					h = 1.0 / (1.0 + np.exp(-h))
+		if str(self.a["out_activation"]) == "softmax":
+			h = np.exp(h - h.max(axis=1)[:, None])
+			return h / h.sum(axis=1)[:, None]
+		p = 1.0 / (1.0 + np.exp(-h[:, 0]))
+		return np.column_stack([1.0 - p, p])
+
+	# SVC(kernel="rbf"): libsvm one-vs-one decision values, voting and pairwise coupling
+	def _svc_pairs(self) -> List[Tuple[int, int]]:
+		k = len(self.classes_)
+		return [(i, j) for i in range(k) for j in range(i + 1, k)]
+
+	def _svc_decision(self, X: np.ndarray) -> np.ndarray:
+		sv, n_support = self.a["support_vectors"], self.a["n_support"]
+		dual, intercept, gamma = self.a["dual_coef"], self.a["intercept"], float(self.a["gamma"])
+		d2 = (X * X).sum(axis=1)[:, None] + (sv * sv).sum(axis=1)[None, :] - 2.0 * X @ sv.T
+		K = np.exp(-gamma * d2)
+		start = np.concatenate([[0], np.cumsum(n_support)])
+		dec = np.empty((len(X), len(intercept)))
+		for p, (i, j) in enumerate(self._svc_pairs()):
+			si, sj = slice(start[i], start[i + 1]), slice(start[j], start[j + 1])
+			dec[:, p] = K[:, si] @ dual[j - 1, si] + K[:, sj] @ dual[i, sj] + intercept[p]
+		return dec
+
+	def _svc_vote(self, dec: np.ndarray) -> np.ndarray:
+		votes = np.zeros((len(dec), len(self.classes_)), dtype=int)
+		rows = np.arange(len(dec))
+		for p, (i, j) in enumerate(self._svc_pairs()):
+			winner = np.where(dec[:, p] > 0, i, j)
+			votes[rows, winner] += 1
+		return np.argmax(votes, axis=1)
+
+	def _proba_svc_rbf(self, X: np.ndarray) -> np.ndarray:
+		if "prob_a" not in self.a:
+			raise AttributeError("SVC was trained without probability=True")
+		dec = self._svc_decision(X)
+		k = len(self.classes_)
+		min_prob = 1e-7
+		r = np.zeros((len(X), k, k))
+		for p, (i, j) in enumerate(self._svc_pairs()):
+			f = dec[:, p] * self.a["prob_a"][p] + self.a["prob_b"][p]
+			sig = np.where(f >= 0, np.exp(-np.abs(f)) / (1.0 + np.exp(-np.abs(f))), 1.0 / (1.0 + np.exp(-np.abs(f))))
+			r[:, i, j] = np.clip(sig, min_prob, 1.0 - min_prob)
+			r[:, j, i] = 1.0 - r[:, i, j]
+		if k == 2:
+			return np.column_stack([r[:, 0, 1], r[:, 1, 0]])
+		return _multiclass_probability(r)
+
+
+def _multiclass_probability(r: np.ndarray) -> np.ndarray:
+	"""libsvm's pairwise coupling (Wu, Lin & Weng method 2), vectorized over rows."""
+	n, k, _ = r.shape
+	Q = np.zeros((n, k, k))
+	for t in range(k):
+		for j in range(k):
+			if j != t:
+				Q[:, t, t] += r[:, j, t] * r[:, j, t]
+				Q[:, t, j] = -r[:, j, t] * r[:, t, j]
+	p = np.full((n, k), 1.0 / k)
+	eps = 0.005 / k
+	active = np.ones(n, dtype=bool)
+	for _ in range(max(100, k)):
+		Qp = np.einsum("ntj,nj->nt", Q, p)
+		pQp = np.sum(p * Qp, axis=1)
+		max_error = np.max(np.abs(Qp - pQp[:, None]), axis=1)
+		active &= max_error >= eps
+		if not active.any():
+			break
+		for t in range(k):
+			diff = np.where(active, (-Qp[:, t] + pQp) / Q[:, t, t], 0.0)
+			p[:, t] += diff
+			pQp = (pQp + diff * (diff * Q[:, t, t] + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+			Qp = (Qp + diff[:, None] * Q[:, t, :]) / (1 + diff)[:, None]
+			p /= (1 + diff)[:, None]
+	return p
+
+
+def load_compiled(path: str) -> Tuple[CompiledPreprocessor, CompiledEstimator]:
+	with np.load(path) as data:
+		arrays = {k: data[k] for k in data.files}
+	return CompiledPreprocessor(arrays), CompiledEstimator(arrays)
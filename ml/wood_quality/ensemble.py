@@ -0,0 +1,155 @@
+import threading
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from compiled import CompiledPreprocessor
+
+ENSEMBLE_FILE = "ensemble.joblib"
+
+
+def needs_dense(est: Any) -> bool:
+	"""Estimators that reject sparse input: GaussianNB and tree-indexed KNN."""
+	cls = type(est).__name__
+	return cls == "GaussianNB" or (cls == "KNeighborsClassifier" and getattr(est, "_fit_method", None) in ("ball_tree", "kd_tree"))
+
+
+class Ensemble:
+	"""Fitted estimators that share preprocessing.
+
+	The input frame is transformed once per distinct fitted preprocessor (normally a single
+	one) and every estimator is fed from that shared matrix. Labels come from the argmax of
+	``predict_proba`` when the estimator has one, so probabilistic models run inference once.
+	``references`` keeps the transformed rows and labels that instance-based models (KNN)
+	were fit on, so incremental updates can refit them with new rows appended.
+	"""
+
+	def __init__(self, preprocessors: Dict[str, Any], models: Dict[str, Any], references: Optional[Dict[str, Tuple[Any, np.ndarray]]] = None) -> None:
+		self.preprocessors = preprocessors
+		self.models = models
+		self.references = references or {}
+		# Estimators that reject sparse input (sparse one-hot preprocessors)
+		self.dense_only = {name for name, est in models.items() if needs_dense(est)}
+		first = next(iter(models.values()))
+		self.classes: List[str] = [str(c) for c in first.classes_]
+
+	@classmethod
+	def from_fitted(cls, preprocessors: Dict[str, Any], fitted: Dict[str, Tuple[Any, Optional[Tuple[Any, np.ndarray]]]]) -> "Ensemble":
+		"""Build from ``name -> (estimator, reference rows or None)`` as returned by the fit workers."""
+		models = {name: est for name, (est, _) in fitted.items()}
+		references = {name: ref for name, (_, ref) in fitted.items() if ref is not None}
+		return cls(preprocessors, models, references)
+
+	@classmethod
+	def from_artifact(cls, artifact: Dict[str, Any]) -> "Ensemble":
+		pre = artifact["preprocessor"]
+		return cls({name: pre for name in artifact["models"]}, dict(artifact["models"]), dict(artifact.get("references", {})))
+
+	def to_artifact(self) -> Dict[str, Any]:
+		pre = next(iter(self.preprocessors.values()))
+		return {"preprocessor": pre, "models": self.models, "classes": self.classes, "references": self.references}
+
+	def names(self) -> List[str]:
+		return list(self.models.keys())
+
+	def loaded(self) -> List[str]:
+		return self.names()
+
+	def score(self, df: Any, names: Optional[List[str]] = None) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+		"""Return per-model label arrays and, where available, probability matrices.
+
+		``df`` is a DataFrame or a dict of column arrays; scikit-learn preprocessors get a
+		DataFrame, compiled ones read the columns directly.
+		"""
+		names = names or self.names()
+		matrices: Dict[int, Any] = {}
+		labels: Dict[str, np.ndarray] = {}
+		probas: Dict[str, np.ndarray] = {}
+		for name in names:
+			pre = self.preprocessors[name]
+			if id(pre) not in matrices:
+				if isinstance(df, dict) and not isinstance(pre, CompiledPreprocessor):
+					import pandas as pd
+
+					df = pd.DataFrame(df)
+				matrices[id(pre)] = pre.transform(df)
+			X = matrices[id(pre)]
+			est = self.models[name]
+			if hasattr(X, "toarray") and name in self.dense_only:
+				X = X.toarray()
+			if hasattr(est, "predict_proba"):
+				p = est.predict_proba(X)
+				probas[name] = p
+				labels[name] = np.asarray(est.classes_).astype(str)[np.argmax(p, axis=1)]
+			else:
+				labels[name] = np.asarray(est.predict(X)).astype(str)
+		return labels, probas
+
+	def vote(self, labels: Dict[str, np.ndarray], probas: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+		"""Majority vote per row across ``labels``, ties broken by mean probability."""
+		class_idx = np.array(self.classes)
+		n_rows = len(next(iter(labels.values())))
+		votes = np.zeros((n_rows, len(class_idx)))
+		for preds in labels.values():
+			votes += preds[:, None] == class_idx[None, :]
+		mean_proba = np.mean(list(probas.values()), axis=0) if probas else None
+		# Vote counts differ by at least 1, so half the mean probability only breaks ties
+		tie_break = 0.5 * mean_proba if mean_proba is not None else 0.0
+		return class_idx[np.argmax(votes + tie_break, axis=1)], mean_proba
+
+
+class LazyEnsemble(Ensemble):
+	"""Ensemble whose models are loaded on first use and then kept.
+
+	``loaders`` maps each model name to a callable returning its ``(preprocessor, estimator)``
+	pair. Identical preprocessors are shared so the transform still runs once per request.
+	"""
+
+	def __init__(self, loaders: Dict[str, Callable[[], Tuple[Any, Any]]]) -> None:
+		self._loaders = loaders
+		self._lock = threading.Lock()
+		self._shared: Dict[Any, Any] = {}
+		self.preprocessors = {}
+		self.models = {}
+		self.references = {}
+		self.dense_only = set()
+
+	def names(self) -> List[str]:
+		return list(self._loaders.keys())
+
+	def loaded(self) -> List[str]:
+		return [name for name in self._loaders if name in self.models]
+
+	def ensure(self, names: Iterable[str]) -> "LazyEnsemble":
+		missing = [name for name in names if name not in self.models]
+		if not missing:
+			return self
+		with self._lock:
+			for name in missing:
+				if name in self.models:
+					continue
+				if name not in self._loaders:
+					raise KeyError(f"Unknown model: {name}")
+				pre, est = self._loaders[name]()
+				key = getattr(pre, "key", None)
+				if key is None:
+					import joblib
+
+					key = joblib.hash(pre)
+				self.preprocessors[name] = self._shared.setdefault(key, pre)
+				if needs_dense(est):
+					self.dense_only.add(name)
+				# Publish the estimator last; readers check self.models without the lock
+				self.models[name] = est
+		return self
+
+	@property
+	def classes(self) -> List[str]:
+		# Any loaded model will do; load one only if nothing has been used yet
+		loaded = self.loaded() or [self.ensure(self.names()[:1]).names()[0]]
+		return [str(c) for c in self.models[loaded[0]].classes_]
+
+	def score(self, df: Any, names: Optional[List[str]] = None) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+		names = names or self.names()
+		self.ensure(names)
+		return super().score(df, names)
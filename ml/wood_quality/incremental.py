@@ -0,0 +1,119 @@
+"""Incremental updates of a trained ensemble from newly collected rows.
+
+Between full retrains the fitted preprocessor stays frozen so every estimator keeps the
+feature space it was trained in. New rows are appended to the KNN reference set kept in the
+ensemble (``Ensemble.references``) and the KNN is refit on it; GaussianNB and the MLP get
+``partial_fit``; DecisionTree and SVM are left as trained. Running mean/variance of the raw
+numeric columns are kept alongside and compared with the frozen scaler to decide when the
+feature space has drifted far enough to need a full retrain.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import accuracy_score
+
+from ensemble import Ensemble
+
+INCREMENTAL_MODELS = ["KNN", "NaiveBayes", "NeuralNet"]
+
+
+def _numeric_columns(pre) -> List[str]:
+	return list(pre.transformers_[1][2])
+
+
+def _categorical_columns(pre) -> List[str]:
+	return list(pre.transformers_[0][2])
+
+
+def new_rows(base: pd.DataFrame, current: pd.DataFrame) -> Optional[pd.DataFrame]:
+	"""Rows appended to ``base``, or None if the existing history was edited or removed."""
+	if len(current) < len(base) or list(current.columns) != list(base.columns):
+		return None
+	head = current.iloc[: len(base)].reset_index(drop=True)
+	if not head.equals(base.reset_index(drop=True)):
+		return None
+	return current.iloc[len(base):].reset_index(drop=True)
+
+
+def initial_stats(pre) -> Dict[str, Any]:
+	scaler = pre.named_transformers_["num"]
+	return {
+		"count": int(np.max(scaler.n_samples_seen_)),
+		"mean": scaler.mean_.tolist(),
+		"var": scaler.var_.tolist(),
+	}
+
+
+def merge_stats(stats: Dict[str, Any], X_num: np.ndarray) -> Dict[str, Any]:
+	# Chan et al. parallel mean/variance merge
+	n1, m1, v1 = stats["count"], np.asarray(stats["mean"]), np.asarray(stats["var"])
+	n2 = len(X_num)
+	if n2 == 0:
+		return stats
+	m2, v2 = X_num.mean(axis=0), X_num.var(axis=0)
+	n = n1 + n2
+	delta = m2 - m1
+	mean = m1 + delta * n2 / n
+	var = (v1 * n1 + v2 * n2 + delta ** 2 * n1 * n2 / n) / n
+	return {"count": int(n), "mean": mean.tolist(), "var": var.tolist()}
+
+
+def drift_report(pre, stats: Dict[str, Any], X_new: pd.DataFrame, X_base: pd.DataFrame) -> Dict[str, Any]:
+	"""Compare running statistics and new categories with the frozen preprocessor.
+
+	Unseen categories are measured against the rate the base data predicts (share of
+	categories seen once, Good-Turing), since some columns such as Vendor are mostly unique.
+	"""
+	scaler = pre.named_transformers_["num"]
+	shift = np.abs(np.asarray(stats["mean"]) - scaler.mean_) / np.sqrt(np.maximum(scaler.var_, 1e-12))
+	ratio = np.asarray(stats["var"]) / np.maximum(scaler.var_, 1e-12)
+	encoder = pre.named_transformers_["cat"]
+	excess = {}
+	for column, categories in zip(_categorical_columns(pre), encoder.categories_):
+		seen = set(str(c) for c in categories)
+		rate = float(np.mean([str(v) not in seen for v in X_new[column]])) if len(X_new) else 0.0
+		counts = X_base[column].astype(str).value_counts()
+		expected = float((counts == 1).sum() / max(len(X_base), 1))
+		excess[column] = round(rate - expected, 4)
+	return {
+		"max_mean_shift": float(shift.max()),
+		"max_var_ratio": float(max(ratio.max(), 1.0 / max(ratio.min(), 1e-12))),
+		"unknown_category_excess": excess,
+	}
+
+
+def numeric_matrix(pre, X: pd.DataFrame) -> np.ndarray:
+	return X[_numeric_columns(pre)].to_numpy(dtype=float)
+
+
+def prequential_accuracy(ensemble: Ensemble, X_new: pd.DataFrame, y_new: pd.Series) -> Dict[str, float]:
+	# Score the new rows before learning from them
+	labels, _ = ensemble.score(X_new)
+	return {name: float(accuracy_score(y_new, y_pred)) for name, y_pred in labels.items()}
+
+
+def update_ensemble(ensemble: Ensemble, X_new: pd.DataFrame, y_new: pd.Series, epochs: int = 5) -> List[str]:
+	"""Update the incremental estimators in place and return their names."""
+	y = np.asarray(y_new).astype(str)
+	updated = []
+	for name in INCREMENTAL_MODELS:
+		est = ensemble.models.get(name)
+		if est is None:
+			continue
+		Xt = ensemble.preprocessors[name].transform(X_new)
+		if sparse.issparse(Xt) and name in ensemble.dense_only:
+			Xt = Xt.toarray()
+		if name == "KNN":
+			X_ref, y_ref = ensemble.references[name]
+			stack = sparse.vstack if sparse.issparse(X_ref) else np.vstack
+			ensemble.references[name] = (stack([X_ref, Xt]), np.concatenate([y_ref, y]))
+			est.fit(*ensemble.references[name])
+		elif name == "NeuralNet":
+			for _ in range(epochs):
+				est.partial_fit(Xt, y)
+		else:
+			est.partial_fit(Xt, y)
+		updated.append(name)
+	return updated
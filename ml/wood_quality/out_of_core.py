@@ -0,0 +1,188 @@
+"""Compact, chunked data loading and out-of-core fitting for large wood-quality datasets.
+
+The CSV is parsed in chunks into a compact frame (categorical strings, float32 numbers),
+optionally cached as one memory-mapped ``.npy`` file per column next to the CSV. Estimators
+with ``partial_fit`` (GaussianNB, MLP) stream over sparse-encoded chunks of the full training
+set; the rest train on stratified subsamples capped by ``SUBSAMPLE_ROWS``.
+"""
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from pandas.api.types import union_categoricals
+from sklearn import config_context
+from sklearn.model_selection import train_test_split
+
+from ensemble import Ensemble
+from prototypes import fit_prototype_knn
+
+CATEGORICAL_COLUMNS = ["Vendor", "WoodType", "Quality"]
+STREAMED_MODELS = ["NaiveBayes", "NeuralNet"]
+SUBSAMPLE_ROWS = {"KNN": 200_000, "DecisionTree": 1_000_000, "SVM": 20_000}
+# MB scikit-learn may use per chunk of KNN distances (its default is 1024)
+WORKING_MEMORY_MB = 128
+CACHE_SUFFIX = ".cols"
+CACHE_META = "columns.json"
+
+
+def read_compact(csv_path: str, chunk_size: int = 100_000) -> pd.DataFrame:
+	columns = list(pd.read_csv(csv_path, nrows=0).columns)
+	dtypes = {c: ("category" if c in CATEGORICAL_COLUMNS else "float32") for c in columns}
+	chunks = list(pd.read_csv(csv_path, dtype=dtypes, chunksize=chunk_size))
+	if not chunks:
+		return pd.DataFrame({c: pd.Series(dtype=t) for c, t in dtypes.items()})
+	data = {}
+	for c in columns:
+		parts = [chunk[c] for chunk in chunks]
+		data[c] = union_categoricals(parts) if dtypes[c] == "category" else np.concatenate([p.to_numpy() for p in parts])
+	return pd.DataFrame(data)
+
+
+def _source_stamp(csv_path: str) -> Dict[str, Any]:
+	st = os.stat(csv_path)
+	return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_cache(df: pd.DataFrame, cache_dir: str, stamp: Dict[str, Any]) -> None:
+	os.makedirs(cache_dir, exist_ok=True)
+	schema = []
+	for c in df.columns:
+		if isinstance(df[c].dtype, pd.CategoricalDtype):
+			np.save(os.path.join(cache_dir, f"{c}.npy"), df[c].cat.codes.to_numpy())
+			schema.append({"name": c, "categories": [str(v) for v in df[c].cat.categories]})
+		else:
+			np.save(os.path.join(cache_dir, f"{c}.npy"), df[c].to_numpy())
+			schema.append({"name": c})
+	# The schema is written last so a half-written cache is never considered valid
+	with open(os.path.join(cache_dir, CACHE_META), "w", encoding="utf-8") as f:
+		json.dump({"source": stamp, "rows": len(df), "columns": schema}, f)
+
+
+def read_cache(cache_dir: str, stamp: Dict[str, Any]) -> Optional[pd.DataFrame]:
+	try:
+		with open(os.path.join(cache_dir, CACHE_META), "r", encoding="utf-8") as f:
+			meta = json.load(f)
+	except (FileNotFoundError, ValueError):
+		return None
+	if meta["source"] != stamp:
+		return None
+	data = {}
+	for col in meta["columns"]:
+		values = np.load(os.path.join(cache_dir, f"{col['name']}.npy"), mmap_mode="r")
+		if "categories" in col:
+			data[col["name"]] = pd.Categorical.from_codes(values, categories=col["categories"])
+		else:
+			data[col["name"]] = values
+	return pd.DataFrame(data, copy=False)
+
+
+def load_compact(csv_path: str, chunk_size: int = 100_000, cache: bool = False) -> Tuple[pd.DataFrame, pd.Series]:
+	"""Compact-dtype counterpart of ``train_evaluate.load_data``."""
+	if cache:
+		cache_dir = csv_path + CACHE_SUFFIX
+		stamp = _source_stamp(csv_path)
+		data = read_cache(cache_dir, stamp)
+		if data is None:
+			data = read_compact(csv_path, chunk_size)
+			write_cache(data, cache_dir, stamp)
+	else:
+		data = read_compact(csv_path, chunk_size)
+	return data.drop(columns=["Quality"]), data["Quality"]
+
+
+def stratified_indices(y: pd.Series, n: int, seed: int) -> np.ndarray:
+	idx = np.arange(len(y))
+	if n >= len(y):
+		return idx
+	sample, _ = train_test_split(idx, train_size=n, stratify=np.asarray(y), random_state=seed)
+	return np.sort(sample)
+
+
+def widen(X: pd.DataFrame) -> pd.DataFrame:
+	"""float64 copy of the numeric columns of a chunk.
+
+	Storage stays float32, but scaling runs in float64 like it does at prediction time, so
+	tree thresholds and the compiled artifacts see exactly the same features.
+	"""
+	return X.astype({c: "float64" for c in X.columns if X[c].dtype == np.float32})
+
+
+def _labels(y: pd.Series) -> np.ndarray:
+	return np.asarray(y).astype(str)
+
+
+def _fit_streamed(name: str, est, pre, X: pd.DataFrame, y: pd.Series, classes: np.ndarray, chunk_size: int, epochs: int, seed: int):
+	rng = np.random.default_rng(seed)
+	starts = np.arange(0, len(X), chunk_size)
+	# GaussianNB's sufficient statistics are exact after one pass; the MLP needs several
+	for _ in range(epochs if name == "NeuralNet" else 1):
+		for start in rng.permutation(starts):
+			Xt = pre.transform(widen(X.iloc[start:start + chunk_size]))
+			if name == "NaiveBayes":
+				Xt = Xt.toarray()
+			est.partial_fit(Xt, _labels(y.iloc[start:start + chunk_size]), classes=classes)
+	return est, None
+
+
+def _fit_subsample(name: str, est, pre, X: pd.DataFrame, y: pd.Series, seed: int, knn_prototypes: bool):
+	idx = stratified_indices(y, SUBSAMPLE_ROWS[name], seed)
+	Xt, yt = pre.transform(widen(X.iloc[idx])), _labels(y.iloc[idx])
+	if name == "KNN" and knn_prototypes:
+		# config_context is per thread, so the editing pass needs its own working-memory cap
+		with config_context(working_memory=WORKING_MEMORY_MB):
+			return fit_prototype_knn(est, Xt, yt, seed)
+	return est.fit(Xt, yt), ((Xt, yt) if name == "KNN" else None)
+
+
+def fit_out_of_core(
+	X_train: pd.DataFrame,
+	y_train: pd.Series,
+	estimators: Dict[str, Any],
+	preprocessor,
+	chunk_size: int = 100_000,
+	epochs: int = 10,
+	jobs: int = 1,
+	seed: int = 42,
+	knn_prototypes: bool = False,
+) -> Ensemble:
+	"""Fit ``preprocessor`` (sparse one-hot output) and every estimator without densifying the full set."""
+	preprocessor.fit(widen(X_train))
+	classes = np.unique(_labels(y_train))
+	tasks = []
+	for name, est in estimators.items():
+		if name in STREAMED_MODELS:
+			tasks.append(delayed(_fit_streamed)(name, est, preprocessor, X_train, y_train, classes, chunk_size, epochs, seed))
+		else:
+			tasks.append(delayed(_fit_subsample)(name, est, preprocessor, X_train, y_train, seed, knn_prototypes))
+	# Threads share the compact frame instead of copying it into every worker process;
+	# libsvm, the tree builder and the BLAS calls release the GIL
+	fitted = Parallel(n_jobs=jobs, prefer="threads")(tasks)
+	return Ensemble.from_fitted({name: preprocessor for name in estimators}, dict(zip(estimators, fitted)))
+
+
+def score_chunked(ensemble: Ensemble, X: pd.DataFrame, chunk_size: int = 100_000) -> Dict[str, np.ndarray]:
+	parts: Dict[str, List[np.ndarray]] = {name: [] for name in ensemble.names()}
+	with config_context(working_memory=WORKING_MEMORY_MB):
+		for start in range(0, len(X), chunk_size):
+			labels, _ = ensemble.score(widen(X.iloc[start:start + chunk_size]))
+			for name, values in labels.items():
+				parts[name].append(values)
+	return {name: np.concatenate(values) for name, values in parts.items()}
+
+
+def peak_memory_mb() -> Dict[str, Optional[float]]:
+	"""Peak resident set size of this process and of its finished children, in MB."""
+	try:
+		import resource
+	except ImportError:  # Windows
+		return {"self": None, "children": None}
+	# ru_maxrss is in kilobytes on Linux and bytes on macOS
+	unit = 1 if sys.platform == "darwin" else 1024
+	return {
+		"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20,
+		"children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20,
+	}
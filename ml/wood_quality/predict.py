@@ -1,48 +1,102 @@
 import argparse
+import contextlib
+import functools
 import json
 import os
 import sys
-from typing import Dict, Any, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional, Tuple
 
-import joblib
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
+import numpy as np
 
-from train_evaluate import build_preprocessor, get_models, load_data, RANDOM_STATE
+from cascade import CascadeStats, DEFAULT_THRESHOLD, cascade_predict
+from compiled import compiled_path, load_compiled
+from ensemble import Ensemble, ENSEMBLE_FILE, LazyEnsemble
+from registry import current_version, resolve_models_dir, start_background_training, train_version
+
+if TYPE_CHECKING:
+	# pandas is imported lazily where it is used
+	import pandas as pd
 
 MODELS = ["KNN", "NaiveBayes", "DecisionTree", "SVM", "NeuralNet"]
 
+# Request payload keys -> dataset/training column names
+FEATURE_COLUMNS = {
+	"vendor": "Vendor",
+	"woodType": "WoodType",
+	"length": "Length_cm",
+	"width": "Width_cm",
+	"thickness": "Thickness_cm",
+	"moisture": "Moisture",
+	"costPerUnit": "Cost_per_unit",
+}
+CATEGORICAL_COLUMNS = ["Vendor", "WoodType"]
+
+
+def _legacy_paths(out_dir: str) -> List[str]:
+	return [os.path.join(out_dir, f"model_{m}.joblib") for m in MODELS]
+
+
+def has_models(models_dir: str) -> bool:
+	if os.path.exists(os.path.join(models_dir, ENSEMBLE_FILE)):
+		return True
+	if all(os.path.exists(compiled_path(models_dir, m)) for m in MODELS):
+		return True
+	return all(os.path.exists(p) for p in _legacy_paths(models_dir))
 
-def train_if_needed(dataset_path: str, out_dir: str) -> None:
-	os.makedirs(out_dir, exist_ok=True)
-	# If any model missing, train them all using train_evaluate module
-	missing = [m for m in MODELS if not os.path.exists(os.path.join(out_dir, f"model_{m}.joblib"))]
-	if not missing:
+
+def train_if_needed(dataset_path: str, root: str, wait: bool = True) -> None:
+	# Training goes through the registry: lock-protected, published atomically as a new version
+	if has_models(resolve_models_dir(root)):
+		return
+	if wait:
+		# Keep stdout clean for the prediction output
+		with contextlib.redirect_stdout(sys.stderr):
+			train_version(root, dataset_path)
 		return
-	X, y = load_data(dataset_path)
-	preprocessor = build_preprocessor(X)
-	X_train, X_test, y_train, y_test = train_test_split(
-		X, y, test_size=0.25, random_state=RANDOM_STATE, stratify=y
-	)
-	models = get_models()
-	for name, estimator in models.items():
-		pipe = Pipeline(steps=[("preprocess", preprocessor), ("model", estimator)])
-		pipe.fit(X_train, y_train)
-		joblib.dump(pipe, os.path.join(out_dir, f"model_{name}.joblib"))
-
-
-def load_models(out_dir: str) -> Dict[str, Any]:
-	loaded = {}
-	for name in MODELS:
-		path = os.path.join(out_dir, f"model_{name}.joblib")
-		loaded[name] = joblib.load(path)
-	return loaded
-
-
-def to_dataframe(payload: Dict[str, Any]) -> pd.DataFrame:
+	start_background_training(root, dataset_path)
+	raise RuntimeError("Models are not trained yet; training has been started in the background")
+
+
+def _load_pipeline(path: str) -> Tuple[Any, Any]:
+	import joblib
+
+	pipe = joblib.load(path)
+	return pipe.named_steps["preprocess"], pipe.named_steps["model"]
+
+
+def load_models(out_dir: str, backend: str = "auto", names: Optional[List[str]] = None, lazy: bool = False) -> Ensemble:
+	"""Models from ``out_dir`` restricted to ``names`` (default: all five).
+
+	Per-model artifacts are loaded on first use when ``lazy`` is set, otherwise right away.
+	"""
+	names = list(names or MODELS)
+	unknown = [n for n in names if n not in MODELS]
+	if unknown:
+		raise ValueError(f"Unknown models: {unknown}")
+	# "compiled" artifacts need only NumPy; otherwise fall back to the joblib files
+	compiled = all(os.path.exists(compiled_path(out_dir, m)) for m in names)
+	pipelines = all(os.path.exists(os.path.join(out_dir, f"model_{m}.joblib")) for m in names)
+	ensemble_path = os.path.join(out_dir, ENSEMBLE_FILE)
+	if backend == "compiled" or (backend == "auto" and compiled):
+		models = LazyEnsemble({n: functools.partial(load_compiled, compiled_path(out_dir, n)) for n in names})
+	elif pipelines or not os.path.exists(ensemble_path):
+		models = LazyEnsemble({n: functools.partial(_load_pipeline, os.path.join(out_dir, f"model_{n}.joblib")) for n in names})
+	else:
+		# The shared ensemble is one pickle, so it can only be loaded whole
+		import joblib
+
+		full = Ensemble.from_artifact(joblib.load(ensemble_path))
+		return Ensemble({n: full.preprocessors[n] for n in names}, {n: full.models[n] for n in names})
+	return models if lazy else models.ensure(names)
+
+
+def to_record(payload: Dict[str, Any]) -> Dict[str, Any]:
 	# Expecting keys: vendor, woodType, length, width, thickness, moisture, costPerUnit
-	record = {
+	return {
 		"Vendor": payload.get("vendor"),
 		"WoodType": payload.get("woodType"),
 		"Length_cm": float(payload.get("length")),
@@ -51,28 +105,386 @@ def to_dataframe(payload: Dict[str, Any]) -> pd.DataFrame:
 		"Moisture": float(payload.get("moisture")),
 		"Cost_per_unit": float(payload.get("costPerUnit")),
 	}
-	return pd.DataFrame([record])
 
 
-def predict_all(models: Dict[str, Any], df: pd.DataFrame) -> Dict[str, Any]:
+def to_columns(payload: Dict[str, Any]) -> Dict[str, np.ndarray]:
+	# Single-row frame as column arrays; avoids importing pandas on the compiled path
+	return {col: np.array([value]) for col, value in to_record(payload).items()}
+
+
+def to_dataframe(payload: Dict[str, Any]) -> "pd.DataFrame":
+	import pandas as pd
+
+	return pd.DataFrame([to_record(payload)])
+
+
+def _proba_dict(classes: List[str], row: np.ndarray) -> Dict[str, float]:
+	return dict(zip(classes, row.tolist()))
+
+
+def predict_all(models: Ensemble, df: Any, names: Optional[List[str]] = None) -> Dict[str, Any]:
+	labels, probas = models.score(df, names)
 	results: Dict[str, Any] = {}
-	for name, pipe in models.items():
-		pred = pipe.predict(df)[0]
-		proba = None
-		if hasattr(pipe.named_steps["model"], "predict_proba"):
-			p = pipe.predict_proba(df)[0]
-			classes = list(pipe.classes_)
-			proba = {str(c): float(v) for c, v in zip(classes, p)}
-		results[name] = {"prediction": str(pred), "probabilities": proba}
+	for name, preds in labels.items():
+		proba = _proba_dict(models.classes, probas[name][0]) if name in probas else None
+		results[name] = {"prediction": str(preds[0]), "probabilities": proba}
 	return results
 
 
+def records_to_dataframe(records: Any) -> "pd.DataFrame":
+	"""Build a feature frame from many rows at once.
+
+	Accepts a list of dicts or a DataFrame using either the request payload keys
+	(``vendor``, ``woodType``, ...) or the dataset column names (``Vendor``, ``WoodType``, ...).
+	"""
+	import pandas as pd
+
+	df = records if isinstance(records, pd.DataFrame) else pd.DataFrame.from_records(records)
+	df = df.rename(columns=FEATURE_COLUMNS)
+	missing = [c for c in FEATURE_COLUMNS.values() if c not in df.columns]
+	if missing:
+		raise ValueError(f"Missing feature columns: {missing}")
+	df = df[list(FEATURE_COLUMNS.values())].copy()
+	for col in df.columns:
+		if col in CATEGORICAL_COLUMNS:
+			df[col] = df[col].astype(str)
+		else:
+			df[col] = pd.to_numeric(df[col], errors="raise").astype(float)
+	return df
+
+
+def predict_batch(models: Ensemble, df: Any, names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+	"""Score every row of ``df`` with one vectorized call per model.
+
+	Each row gets the per-model results (same shape as ``predict_all``), the majority
+	``vote`` across models (ties broken by mean probability) and ``mean_probabilities``.
+	"""
+	n_rows = len(df)
+	labels, probas = models.score(df, names)
+	classes = models.classes
+	vote, mean_proba = models.vote(labels, probas)
+	if mean_proba is None:
+		mean_proba = np.zeros((n_rows, len(classes)))
+
+	# Convert to Python lists once per model rather than once per row
+	label_lists = {name: preds.tolist() for name, preds in labels.items()}
+	proba_lists = {name: p.tolist() for name, p in probas.items()}
+	mean_list = mean_proba.tolist()
+	vote_list = vote.tolist()
+	rows: List[Dict[str, Any]] = []
+	for i in range(n_rows):
+		results = {}
+		for name, preds in label_lists.items():
+			proba = dict(zip(classes, proba_lists[name][i])) if name in proba_lists else None
+			results[name] = {"prediction": preds[i], "probabilities": proba}
+		rows.append({
+			"results": results,
+			"vote": vote_list[i],
+			"mean_probabilities": dict(zip(classes, mean_list[i])) if probas else None,
+		})
+	return rows
+
+
+def iter_batch_input(path: str, chunk_size: int) -> Iterator["pd.DataFrame"]:
+	"""Yield feature frames of at most ``chunk_size`` rows from a CSV, JSONL or JSON array file."""
+	import pandas as pd
+
+	ext = os.path.splitext(path)[1].lower()
+	if ext == ".csv":
+		for chunk in pd.read_csv(path, chunksize=chunk_size):
+			yield records_to_dataframe(chunk)
+	elif ext in (".jsonl", ".ndjson"):
+		with open(path, "r", encoding="utf-8") as f:
+			lines = (line for line in f if line.strip())
+			while True:
+				block = list(islice(lines, chunk_size))
+				if not block:
+					break
+				yield records_to_dataframe([json.loads(line) for line in block])
+	else:
+		with open(path, "r", encoding="utf-8") as f:
+			records = json.load(f)
+		if isinstance(records, dict):
+			records = [records]
+		for start in range(0, len(records), chunk_size):
+			yield records_to_dataframe(records[start:start + chunk_size])
+
+
+def run_batch(
+	models: Ensemble,
+	input_path: str,
+	output_path: Optional[str],
+	chunk_size: int,
+	cascade: bool = False,
+	threshold: float = DEFAULT_THRESHOLD,
+	names: Optional[List[str]] = None,
+) -> None:
+	out = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+	stats = CascadeStats()
+	total = 0
+	start = time.perf_counter()
+	try:
+		for df in iter_batch_input(input_path, chunk_size):
+			rows = cascade_predict(models, df, threshold, stats, names) if cascade else predict_batch(models, df, names)
+			out.write("".join(json.dumps({"row": total + i, **row}) + "\n" for i, row in enumerate(rows)))
+			out.flush()
+			total += len(rows)
+	finally:
+		if output_path:
+			out.close()
+	elapsed = time.perf_counter() - start
+	rate = total / elapsed if elapsed > 0 else 0.0
+	print(f"✅ Scored {total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)", file=sys.stderr, flush=True)
+	if cascade:
+		print(f"✅ Cascade: {json.dumps(stats.snapshot())}", file=sys.stderr, flush=True)
+
+
+class ModelStore:
+	"""Keeps the fitted models in memory for a long-running process and hot-reloads
+	them when the registry's current version (or the artifacts it points at) changes.
+
+	Requests never train: if nothing has been published yet a background training job
+	is started and requests fail fast until it completes.
+	"""
+
+	def __init__(
+		self,
+		models_dir: str,
+		dataset_path: str,
+		backend: str = "auto",
+		check_interval: float = 1.0,
+		mode: str = "all",
+		threshold: float = DEFAULT_THRESHOLD,
+		names: Optional[List[str]] = None,
+	) -> None:
+		self.models_dir = models_dir
+		self.dataset_path = dataset_path
+		self.backend = backend
+		self.check_interval = check_interval
+		# Defaults for requests that do not pick a mode/threshold themselves
+		self.mode = mode
+		self.threshold = threshold
+		self.names = list(names or MODELS)
+		self.cascade_stats = CascadeStats()
+		self._lock = threading.Lock()
+		self._models: Optional[Ensemble] = None
+		self._stamp: Optional[Tuple] = None
+		self._last_check = 0.0
+		self.reloads = 0
+		self.version: Optional[str] = None
+
+	def _artifact_stamp(self) -> Tuple:
+		models_dir = resolve_models_dir(self.models_dir)
+		stamp: List[Tuple] = [("dir", models_dir)]
+		paths = [os.path.join(models_dir, ENSEMBLE_FILE)] + _legacy_paths(models_dir)
+		paths += [compiled_path(models_dir, m) for m in MODELS]
+		for path in paths:
+			try:
+				st = os.stat(path)
+				stamp.append((path, st.st_mtime_ns, st.st_size))
+			except FileNotFoundError:
+				stamp.append((path, None, None))
+		return tuple(stamp)
+
+	def get(self) -> Ensemble:
+		now = time.monotonic()
+		if self._models is not None and now - self._last_check < self.check_interval:
+			return self._models
+		with self._lock:
+			if self._models is not None and now - self._last_check < self.check_interval:
+				return self._models
+			self._last_check = now
+			stamp = self._artifact_stamp()
+			if stamp == self._stamp:
+				return self._models
+			try:
+				train_if_needed(self.dataset_path, self.models_dir, wait=False)
+				# Other models load on the first request that asks for them; after a reload
+				# everything the previous version had loaded is loaded again up front
+				models = load_models(resolve_models_dir(self.models_dir), self.backend, lazy=True)
+				models.ensure(self._models.loaded() if self._models is not None else self.names)
+			except Exception as e:
+				# Artifacts may be mid-write (e.g. during retraining); keep serving the previous set
+				if self._models is None:
+					raise
+				print(f"⚠️ Model reload failed, keeping previous models: {e}", file=sys.stderr, flush=True)
+				return self._models
+			self._models = models
+			self._stamp = stamp
+			self.reloads += 1
+			self.version = current_version(self.models_dir)
+			print(f"✅ Loaded {len(models.loaded())} models: {models.loaded()} (version: {self.version or 'unversioned'})", file=sys.stderr, flush=True)
+			return self._models
+
+
+	def warm(self) -> None:
+		try:
+			self.get()
+		except Exception as e:
+			print(f"⚠️ Models not available yet: {e}", file=sys.stderr, flush=True)
+
+
+def handle_request(store: ModelStore, payload: Any, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+	"""Score one payload (an object, or a list of objects for batch scoring).
+
+	``options`` may set ``mode`` ("all" or "cascade"), the cascade ``threshold`` and
+	``models``, the subset of models to run (default: the store's, normally all five).
+	"""
+	start = time.perf_counter()
+	options = options or {}
+	mode = options.get("mode") or store.mode
+	names = options.get("models") or store.names
+	unknown = [n for n in names if n not in MODELS]
+	if unknown:
+		raise ValueError(f"Unknown models: {unknown}")
+	models = store.get()
+	if mode == "cascade":
+		threshold = float(options.get("threshold", store.threshold))
+		df = records_to_dataframe(payload) if isinstance(payload, list) else to_columns(payload)
+		rows = cascade_predict(models, df, threshold, store.cascade_stats, names)
+		response = {"ok": True, "rows": rows} if isinstance(payload, list) else {"ok": True, **rows[0]}
+	elif mode != "all":
+		raise ValueError(f"Unknown mode: {mode}")
+	elif isinstance(payload, list):
+		response = {"ok": True, "rows": predict_batch(models, records_to_dataframe(payload), names)}
+	else:
+		response = {"ok": True, "results": predict_all(models, to_columns(payload), names)}
+	response["model_version"] = store.version
+	response["latency_ms"] = round((time.perf_counter() - start) * 1000.0, 3)
+	return response
+
+
+def split_request(request: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+	"""Separate ``{"payload": ..., "mode": ..., "threshold": ..., "models": [...]}`` envelopes from bare payloads."""
+	if isinstance(request, dict) and "payload" in request:
+		return request["payload"], {k: request[k] for k in ("mode", "threshold", "models") if k in request}
+	return request, {}
+
+
+def health(store: ModelStore) -> Dict[str, Any]:
+	models = store.get()
+	return {
+		"ok": True,
+		"models": models.names(),
+		"loaded": models.loaded(),
+		"version": store.version,
+		"reloads": store.reloads,
+		"cascade": store.cascade_stats.snapshot(),
+	}
+
+
+def serve_jsonl(store: ModelStore, workers: int) -> None:
+	"""JSON-lines loop: one request object per stdin line, one response per stdout line.
+
+	Requests may carry an ``id`` (echoed back so callers can match out-of-order replies)
+	and either a ``payload`` (an object, or a list of objects for batch scoring) plus
+	optional ``mode``/``threshold``/``models``, or the payload fields at the top level.
+	``{"op": "health"}`` returns the same status as the HTTP ``/health`` endpoint.
+	"""
+	write_lock = threading.Lock()
+	# Responses own stdout; anything else printed (e.g. by background training) goes to stderr
+	out = sys.stdout
+	sys.stdout = sys.stderr
+
+	def respond(line: str) -> None:
+		request_id = None
+		try:
+			request = json.loads(line)
+			request_id = request.get("id")
+			if request.get("op") == "health":
+				response = health(store)
+			else:
+				response = handle_request(store, *split_request(request))
+		except Exception as e:
+			response = {"ok": False, "error": str(e)}
+		response["id"] = request_id
+		with write_lock:
+			out.write(json.dumps(response) + "\n")
+			out.flush()
+
+	store.warm()
+	print("🚀 Wood quality predictor serving JSON lines on stdin/stdout", file=sys.stderr, flush=True)
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		for line in sys.stdin:
+			line = line.strip()
+			if line:
+				pool.submit(respond, line)
+
+
+def serve_http(store: ModelStore, host: str, port: int) -> None:
+	"""Local HTTP endpoint: POST /predict with the payload JSON, GET /health for status."""
+	from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+	class Handler(BaseHTTPRequestHandler):
+		def _send(self, status: int, body: Dict[str, Any]) -> None:
+			data = json.dumps(body).encode("utf-8")
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def do_GET(self) -> None:
+			if self.path != "/health":
+				self._send(404, {"ok": False, "error": "not found"})
+				return
+			self._send(200, health(store))
+
+		def do_POST(self) -> None:
+			if self.path != "/predict":
+				self._send(404, {"ok": False, "error": "not found"})
+				return
+			try:
+				length = int(self.headers.get("Content-Length", 0))
+				request = json.loads(self.rfile.read(length) or b"{}")
+				self._send(200, handle_request(store, *split_request(request)))
+			except Exception as e:
+				self._send(400, {"ok": False, "error": str(e)})
+
+		def log_message(self, format: str, *args: Any) -> None:
+			return
+
+	store.warm()
+	server = ThreadingHTTPServer((host, port), Handler)
+	print(f"🚀 Wood quality predictor listening on http://{host}:{port}", file=sys.stderr, flush=True)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+
+
 def main() -> None:
 	parser = argparse.ArgumentParser(description="Predict wood quality using 5 models")
-	parser.add_argument("--models_dir", type=str, default="results", help="Directory with saved joblib models")
+	parser.add_argument("--models_dir", type=str, default="results", help="Model registry root (serves its current version, else the models saved directly in it)")
 	parser.add_argument("--data", type=str, default="dataset.csv", help="Dataset path for training if models missing")
 	parser.add_argument("--input", type=str, default=None, help="Path to JSON input file; otherwise read stdin")
+	parser.add_argument("--serve", action="store_true", help="Serve JSON-lines requests on stdin/stdout with models kept loaded")
+	parser.add_argument("--port", type=int, default=None, help="Serve HTTP on this port instead of stdin/stdout")
+	parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address for --port")
+	parser.add_argument("--workers", type=int, default=4, help="Concurrent requests handled in --serve mode")
+	parser.add_argument("--backend", choices=["auto", "compiled", "sklearn"], default="auto", help="auto prefers the NumPy-only compiled artifacts when present")
+	parser.add_argument("--batch", type=str, default=None, help="Score every row of a CSV, JSONL or JSON array file")
+	parser.add_argument("--output", type=str, default=None, help="JSONL output path for --batch; otherwise stdout")
+	parser.add_argument("--chunk_size", type=int, default=10000, help="Rows scored per vectorized pass in --batch mode")
+	parser.add_argument("--models", type=str, default=None, help="Comma-separated subset of models to load and run (default: all five)")
+	parser.add_argument("--cascade", action="store_true", help="Run DecisionTree/NaiveBayes first and the other models only on disagreement or low confidence")
+	parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minimum probability every cheap model needs for a cascade early exit")
 	args = parser.parse_args()
+	names = args.models.split(",") if args.models else None
+
+	if args.batch:
+		train_if_needed(args.data, args.models_dir)
+		models = load_models(resolve_models_dir(args.models_dir), args.backend, names)
+		run_batch(models, args.batch, args.output, args.chunk_size, cascade=args.cascade, threshold=args.threshold, names=names)
+		return
+
+	if args.serve or args.port is not None:
+		store = ModelStore(args.models_dir, args.data, args.backend, mode="cascade" if args.cascade else "all", threshold=args.threshold, names=names)
+		if args.port is not None:
+			serve_http(store, args.host, args.port)
+		else:
+			serve_jsonl(store, args.workers)
+		return
 
 	# Load request JSON
 	if args.input:
@@ -88,20 +500,27 @@ def main() -> None:
 	train_if_needed(args.data, args.models_dir)
 
 	# Load models
-	models = load_models(args.models_dir)
-	print(f"✅ Loaded {len(models)} models: {list(models.keys())}", file=sys.stderr, flush=True)
+	models = load_models(resolve_models_dir(args.models_dir), args.backend, names)
+	print(f"✅ Loaded {len(models.loaded())} models: {models.loaded()}", file=sys.stderr, flush=True)
 
 	# Predict
-	df = to_dataframe(payload)
-	print(f"📊 DataFrame created:\n{df.to_string()}", file=sys.stderr, flush=True)
-	
+	record = to_record(payload)
+	print(f"📊 Feature record: {json.dumps(record)}", file=sys.stderr, flush=True)
+	df = to_columns(payload)
+
+	if args.cascade:
+		row = cascade_predict(models, df, args.threshold, names=names)[0]
+		print(f"🧩 Cascade vote: {row['vote']} (confidence {row['confidence']}, ran {row['models_executed']})", file=sys.stderr, flush=True)
+		print(json.dumps({"ok": True, **row}))
+		return
+
 	results = predict_all(models, df)
-	
+
 	# Debug: Print predictions
 	print(f"🧩 Model predictions:", file=sys.stderr, flush=True)
 	for model_name, result in results.items():
 		print(f"   {model_name}: {result['prediction']} (probabilities: {result['probabilities']})", file=sys.stderr, flush=True)
-	
+
 	print(json.dumps({"ok": True, "results": results}))
 
 
@@ -0,0 +1,95 @@
+"""Prototype selection for the KNN reference set.
+
+Wilson editing first drops training rows that their own neighbours misclassify (label noise
+and overlap), then condensing keeps only the rows the k-NN rule needs: starting from a few
+rows per class, every row the current prototypes misclassify is added until a full pass adds
+nothing. The remaining set tracks the class boundaries rather than the sample count, and is
+indexed with a ball tree (the scaled features include many one-hot columns, where a KD-tree
+degrades).
+"""
+import time
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+
+EDIT_NEIGHBORS = 3
+CONDENSE_CHUNK = 2048
+MAX_PASSES = 10
+
+
+def edit(X: Any, y: np.ndarray, k: int = EDIT_NEIGHBORS) -> np.ndarray:
+	"""Indices of rows whose k nearest other rows vote for their own label."""
+	if X.shape[0] <= k:
+		return np.arange(X.shape[0])
+	neigh = NearestNeighbors(n_neighbors=k + 1).fit(X).kneighbors(X, return_distance=False)[:, 1:]
+	classes, y_idx = np.unique(y, return_inverse=True)
+	counts = np.zeros((len(y), len(classes)))
+	for j in range(k):
+		counts[np.arange(len(y)), y_idx[neigh[:, j]]] += 1
+	return np.flatnonzero(np.argmax(counts, axis=1) == y_idx)
+
+
+def condense(X: Any, y: np.ndarray, k: int = 5, seed: int = 42) -> np.ndarray:
+	"""Indices of a subset on which the k-NN rule classifies every row of (X, y) correctly.
+
+	Rows are checked a chunk at a time against the prototypes chosen so far, and all rows
+	misclassified in a chunk are added together.
+	"""
+	order = np.random.default_rng(seed).permutation(len(y))
+	selected = np.zeros(len(y), dtype=bool)
+	for label in np.unique(y):
+		selected[order[y[order] == label][:k]] = True
+	for _ in range(MAX_PASSES):
+		added = 0
+		for start in range(0, len(order), CONDENSE_CHUNK):
+			chunk = order[start:start + CONDENSE_CHUNK]
+			chunk = chunk[~selected[chunk]]
+			if len(chunk) == 0:
+				continue
+			proto = np.flatnonzero(selected)
+			knn = KNeighborsClassifier(n_neighbors=min(k, len(proto))).fit(X[proto], y[proto])
+			wrong = chunk[knn.predict(X[chunk]) != y[chunk]]
+			selected[wrong] = True
+			added += len(wrong)
+		if added == 0:
+			break
+	return np.flatnonzero(selected)
+
+
+def select_prototypes(X: Any, y: Any, k: int = 5, seed: int = 42) -> np.ndarray:
+	y = np.asarray(y).astype(str)
+	edited = edit(X, y)
+	# Editing can empty a class on tiny or very noisy data; fall back to the full set then
+	if len(np.unique(y[edited])) < len(np.unique(y)):
+		edited = np.arange(len(y))
+	return edited[condense(X[edited], y[edited], k, seed)]
+
+
+def fit_prototype_knn(est: KNeighborsClassifier, X: Any, y: Any, seed: int = 42) -> Tuple[KNeighborsClassifier, Tuple[Any, np.ndarray]]:
+	"""Fit ``est`` on the prototypes of (X, y) with a ball-tree index; return it and the prototypes."""
+	idx = select_prototypes(X, y, est.n_neighbors, seed)
+	X_proto = X[idx]
+	if sparse.issparse(X_proto):
+		# The prototype set is small; densify so the tree index can be used
+		X_proto = X_proto.toarray()
+	y_proto = np.asarray(y).astype(str)[idx]
+	est.set_params(algorithm="ball_tree")
+	return est.fit(X_proto, y_proto), (X_proto, y_proto)
+
+
+def compare_with_full(served: KNeighborsClassifier, X_ref: Any, y_ref: Any, X_test: Any, y_test: Any) -> Dict[str, Any]:
+	"""Accuracy and per-row predict time of ``served`` against KNeighborsClassifier(5) on all of X_ref."""
+	y_test = np.asarray(y_test).astype(str)
+	full = KNeighborsClassifier(n_neighbors=5).fit(X_ref, np.asarray(y_ref).astype(str))
+	report: Dict[str, Any] = {"reference_rows": int(X_ref.shape[0]), "prototypes": int(served.n_samples_fit_)}
+	report["reduction"] = 1.0 - report["prototypes"] / max(report["reference_rows"], 1)
+	X_served = X_test.toarray() if sparse.issparse(X_test) else X_test
+	for key, model, X in (("full", full, X_test), ("prototypes", served, X_served)):
+		start = time.perf_counter()
+		pred = model.predict(X)
+		report[f"accuracy_{key}"] = float(np.mean(pred == y_test))
+		report[f"predict_us_per_row_{key}"] = (time.perf_counter() - start) * 1e6 / max(len(y_test), 1)
+	report["accuracy_diff"] = report["accuracy_prototypes"] - report["accuracy_full"]
+	return report
@@ -0,0 +1,369 @@
+"""Versioned model registry for the wood-quality models.
+
+Layout under the registry root (``results/`` by default)::
+
+	versions/<version>/   complete set of artifacts + metadata.json
+	CURRENT               name of the version predictions should serve
+	.train.lock           held while a training job runs
+
+A training job snapshots the dataset, trains into a staging directory inside
+``versions/``, writes ``metadata.json`` and then switches ``CURRENT`` with an atomic
+rename, so readers always see either the previous or the new complete version.
+Without a ``CURRENT`` pointer the root itself is served (artifacts from before the
+registry existed).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".train.lock"
+METADATA_FILE = "metadata.json"
+STALE_LOCK_SECONDS = 6 * 60 * 60
+
+_background: Dict[str, threading.Thread] = {}
+_background_lock = threading.Lock()
+
+
+class TrainingInProgress(RuntimeError):
+	pass
+
+
+def current_version(root: str) -> Optional[str]:
+	try:
+		with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+			version = f.read().strip()
+	except FileNotFoundError:
+		return None
+	return version if version and os.path.isdir(os.path.join(root, VERSIONS_DIR, version)) else None
+
+
+def resolve_models_dir(root: str) -> str:
+	version = current_version(root)
+	return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+
+def list_versions(root: str) -> List[Dict[str, Any]]:
+	versions_dir = os.path.join(root, VERSIONS_DIR)
+	if not os.path.isdir(versions_dir):
+		return []
+	current = current_version(root)
+	out = []
+	for version in sorted(os.listdir(versions_dir)):
+		meta_path = os.path.join(versions_dir, version, METADATA_FILE)
+		if version.startswith(".") or not os.path.exists(meta_path):
+			continue
+		with open(meta_path, "r", encoding="utf-8") as f:
+			meta = json.load(f)
+		meta["current"] = version == current
+		out.append(meta)
+	return out
+
+
+def set_current(root: str, version: str) -> None:
+	if not os.path.exists(os.path.join(root, VERSIONS_DIR, version, METADATA_FILE)):
+		raise ValueError(f"Unknown model version: {version}")
+	tmp = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+	with open(tmp, "w", encoding="utf-8") as f:
+		f.write(version)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def _acquire_lock(root: str) -> str:
+	path = os.path.join(root, LOCK_FILE)
+	try:
+		if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+			os.remove(path)
+	except FileNotFoundError:
+		pass
+	try:
+		fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+	except FileExistsError:
+		raise TrainingInProgress("A training job is already running")
+	with os.fdopen(fd, "w") as f:
+		f.write(str(os.getpid()))
+	return path
+
+
+def _prune(root: str, keep: int) -> None:
+	current = current_version(root)
+	versions = [v["version"] for v in list_versions(root)]
+	for version in versions[:-keep] if keep > 0 else []:
+		if version != current:
+			shutil.rmtree(os.path.join(root, VERSIONS_DIR, version), ignore_errors=True)
+
+
+def _new_version() -> str:
+	return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def _publish(root: str, staging: str, metadata: Dict[str, Any], keep: int) -> None:
+	with open(os.path.join(staging, METADATA_FILE), "w", encoding="utf-8") as f:
+		json.dump(metadata, f, indent=2)
+	os.replace(staging, os.path.join(root, VERSIONS_DIR, metadata["version"]))
+	set_current(root, metadata["version"])
+	_prune(root, keep)
+
+
+def read_metadata(root: str, version: str) -> Dict[str, Any]:
+	with open(os.path.join(root, VERSIONS_DIR, version, METADATA_FILE), "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def train_version(root: str, data_path: str, keep: int = 5, reason: Optional[str] = None, **train_options: Any) -> Dict[str, Any]:
+	"""Train a new version and publish it as current. Raises TrainingInProgress if locked.
+
+	``train_options`` are passed to ``train_and_evaluate`` (jobs, cv, out_of_core, ...).
+	"""
+	os.makedirs(os.path.join(root, VERSIONS_DIR), exist_ok=True)
+	lock = _acquire_lock(root)
+	try:
+		return _train_locked(root, data_path, keep, reason, **train_options)
+	finally:
+		os.remove(lock)
+
+
+def _train_locked(root: str, data_path: str, keep: int, reason: Optional[str], **train_options: Any) -> Dict[str, Any]:
+	# Imported lazily so serving never pulls in the training stack
+	from train_evaluate import train_and_evaluate
+
+	staging = None
+	try:
+		version = _new_version()
+		staging = os.path.join(root, VERSIONS_DIR, f".staging-{version}")
+		os.makedirs(staging)
+		# Snapshot the dataset so a concurrent export cannot change it mid-training
+		dataset_copy = os.path.join(staging, "dataset.csv")
+		shutil.copyfile(data_path, dataset_copy)
+
+		start = time.perf_counter()
+		df_metrics = train_and_evaluate(dataset_copy, staging, **train_options)
+		training_seconds = time.perf_counter() - start
+
+		with open(dataset_copy, "r", encoding="utf-8") as f:
+			rows = max(sum(1 for line in f if line.strip()) - 1, 0)
+		metadata = {
+			"version": version,
+			"mode": "full",
+			"reason": reason,
+			"created_at": datetime.now(timezone.utc).isoformat(),
+			"dataset": os.path.abspath(data_path),
+			"dataset_rows": rows,
+			"trained_rows": rows,
+			"rows_since_full": 0,
+			"training_seconds": round(training_seconds, 3),
+			"metrics": df_metrics.to_dict(orient="records"),
+		}
+		_publish(root, staging, metadata, keep)
+		staging = None
+		return metadata
+	finally:
+		if staging:
+			shutil.rmtree(staging, ignore_errors=True)
+
+
+def update_version(
+	root: str,
+	data_path: str,
+	keep: int = 5,
+	max_growth: float = 0.25,
+	max_shift: float = 0.5,
+	max_unknown: float = 0.25,
+	max_var_ratio: float = 4.0,
+	epochs: int = 5,
+	jobs: int = -1,
+) -> Dict[str, Any]:
+	"""Apply the rows appended since the current version incrementally, or retrain in full.
+
+	A full retrain runs when there is no current version, the existing rows changed, a new
+	label appears, the rows added since the last full retrain exceed ``max_growth`` of the
+	rows it was trained on, or the running feature statistics drift past the thresholds.
+	The base version is read under the training lock, so concurrent updates never build on
+	the same parent. Raises TrainingInProgress if locked.
+	"""
+	os.makedirs(os.path.join(root, VERSIONS_DIR), exist_ok=True)
+	lock = _acquire_lock(root)
+	try:
+		return _update_locked(root, data_path, keep, max_growth, max_shift, max_unknown, max_var_ratio, epochs, jobs)
+	finally:
+		os.remove(lock)
+
+
+def _update_locked(
+	root: str,
+	data_path: str,
+	keep: int,
+	max_growth: float,
+	max_shift: float,
+	max_unknown: float,
+	max_var_ratio: float,
+	epochs: int,
+	jobs: int,
+) -> Dict[str, Any]:
+	import pandas as pd
+	from ensemble import Ensemble, ENSEMBLE_FILE
+	from incremental import drift_report, initial_stats, merge_stats, new_rows, numeric_matrix, prequential_accuracy, update_ensemble
+	from train_evaluate import export_compiled, load_data, save_ensemble
+	import joblib
+
+	def full(reason: str) -> Dict[str, Any]:
+		return _train_locked(root, data_path, keep, reason, jobs=jobs)
+
+	current = current_version(root)
+	if current is None:
+		return full("no current version")
+	base_dir = os.path.join(root, VERSIONS_DIR, current)
+	base = read_metadata(root, current)
+	if not os.path.exists(os.path.join(base_dir, ENSEMBLE_FILE)):
+		return full("current version has no ensemble artifact")
+
+	base_rows = pd.read_csv(os.path.join(base_dir, "dataset.csv"))
+	added = new_rows(base_rows, pd.read_csv(data_path))
+	if added is None:
+		return full("existing rows changed")
+	if added.empty:
+		return dict(base, mode="noop", reason="no new rows")
+
+	ensemble = Ensemble.from_artifact(joblib.load(os.path.join(base_dir, ENSEMBLE_FILE)))
+	if "KNN" in ensemble.models and "KNN" not in ensemble.references:
+		return full("current version has no KNN reference set")
+	pre = next(iter(ensemble.preprocessors.values()))
+	X_new = added.drop(columns=["Quality"])
+	y_new = added["Quality"].astype(str)
+	unseen = sorted(set(y_new) - set(ensemble.classes))
+	if unseen:
+		return full(f"new labels: {', '.join(unseen)}")
+
+	trained_rows = base.get("trained_rows", base["dataset_rows"])
+	rows_since_full = base.get("rows_since_full", 0) + len(added)
+	if rows_since_full > max_growth * trained_rows:
+		return full(f"{rows_since_full} rows since last full retrain (limit {max_growth:.0%} of {trained_rows})")
+	stats = merge_stats(base.get("running_stats") or initial_stats(pre), numeric_matrix(pre, X_new))
+	drift = drift_report(pre, stats, X_new, base_rows)
+	if (drift["max_mean_shift"] > max_shift or drift["max_var_ratio"] > max_var_ratio
+			or max(drift["unknown_category_excess"].values()) > max_unknown):
+		return full(f"feature drift {drift}")
+
+	staging = None
+	try:
+		version = _new_version()
+		staging = os.path.join(root, VERSIONS_DIR, f".staging-{version}")
+		os.makedirs(staging)
+		dataset_copy = os.path.join(staging, "dataset.csv")
+		shutil.copyfile(data_path, dataset_copy)
+
+		start = time.perf_counter()
+		prequential = prequential_accuracy(ensemble, X_new, y_new)
+		updated = update_ensemble(ensemble, X_new, y_new, epochs=epochs)
+		save_ensemble(ensemble, staging)
+		X_all, _ = load_data(dataset_copy)
+		export_compiled(ensemble, staging, X_all)
+
+		metadata = {
+			"version": version,
+			"mode": "incremental",
+			"reason": None,
+			"base_version": current,
+			"created_at": datetime.now(timezone.utc).isoformat(),
+			"dataset": os.path.abspath(data_path),
+			"dataset_rows": base["dataset_rows"] + len(added),
+			# Only these are inherited: both describe the last full retrain, not this version
+			"trained_rows": trained_rows,
+			"base_metrics": base.get("base_metrics", base.get("metrics")),
+			"rows_added": len(added),
+			"rows_since_full": rows_since_full,
+			"updated_models": updated,
+			"prequential_accuracy": prequential,
+			"running_stats": stats,
+			"drift": drift,
+			"training_seconds": round(time.perf_counter() - start, 3),
+		}
+		_publish(root, staging, metadata, keep)
+		staging = None
+		return metadata
+	finally:
+		if staging:
+			shutil.rmtree(staging, ignore_errors=True)
+
+
+def start_background_training(root: str, data_path: str) -> bool:
+	"""Start train_version on a thread unless one is already running in this process."""
+	with _background_lock:
+		thread = _background.get(root)
+		if thread is not None and thread.is_alive():
+			return False
+
+		def run() -> None:
+			try:
+				meta = train_version(root, data_path)
+				print(f"✅ Published model version {meta['version']}", file=sys.stderr, flush=True)
+			except TrainingInProgress:
+				pass
+			except Exception as e:
+				print(f"❌ Background training failed: {e}", file=sys.stderr, flush=True)
+
+		thread = threading.Thread(target=run, name="wood-quality-training", daemon=True)
+		_background[root] = thread
+		thread.start()
+		return True
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Manage versioned wood quality models")
+	parser.add_argument("--root", type=str, default="results", help="Registry root directory")
+	sub = parser.add_subparsers(dest="command", required=True)
+	train = sub.add_parser("train", help="Train a new version and publish it as current")
+	train.add_argument("--data", type=str, default="dataset.csv", help="Path to CSV dataset")
+	train.add_argument("--keep", type=int, default=5, help="Number of versions to retain")
+	train.add_argument("--jobs", type=int, default=-1, help="Worker processes for training (-1 = all cores)")
+	train.add_argument("--cv", type=int, default=0, help="Also run k-fold cross-validation (0 = off)")
+	train.add_argument("--out_of_core", action="store_true", help="Chunked compact-dtype training for large datasets")
+	train.add_argument("--knn_prototypes", action="store_true", help="Serve KNN from condensed prototypes instead of every training row")
+	update = sub.add_parser("update", help="Apply newly appended rows incrementally, retraining in full past the thresholds")
+	update.add_argument("--data", type=str, default="dataset.csv", help="Path to CSV dataset")
+	update.add_argument("--keep", type=int, default=5, help="Number of versions to retain")
+	update.add_argument("--max_growth", type=float, default=0.25, help="Retrain once rows since the last full retrain exceed this fraction")
+	update.add_argument("--max_shift", type=float, default=0.5, help="Retrain once a running feature mean moves this many training std devs")
+	update.add_argument("--max_unknown", type=float, default=0.25, help="Retrain once unseen categories exceed the expected rate by this fraction")
+	update.add_argument("--max_var_ratio", type=float, default=4.0, help="Retrain once a running feature variance grows or shrinks by this factor")
+	update.add_argument("--epochs", type=int, default=5, help="partial_fit passes over the new rows for the MLP")
+	update.add_argument("--jobs", type=int, default=-1, help="Worker processes for a full retrain (-1 = all cores)")
+	sub.add_parser("list", help="List versions with their metadata")
+	sub.add_parser("current", help="Print the version currently served")
+	use = sub.add_parser("use", help="Point CURRENT at an existing version (rollback)")
+	use.add_argument("version", type=str)
+	args = parser.parse_args()
+
+	if args.command in ("train", "update"):
+		try:
+			if args.command == "train":
+				metadata = train_version(args.root, args.data, args.keep, jobs=args.jobs, cv=args.cv, out_of_core=args.out_of_core, knn_prototypes=args.knn_prototypes)
+			else:
+				metadata = update_version(
+					args.root, args.data, args.keep, max_growth=args.max_growth, max_shift=args.max_shift,
+					max_unknown=args.max_unknown, max_var_ratio=args.max_var_ratio, epochs=args.epochs, jobs=args.jobs,
+				)
+		except TrainingInProgress as e:
+			print(json.dumps({"ok": False, "message": str(e)}))
+			sys.exit(3)
+		print(json.dumps({"ok": True, "metadata": metadata}))
+	elif args.command == "list":
+		print(json.dumps(list_versions(args.root), indent=2))
+	elif args.command == "current":
+		print(current_version(args.root) or "")
+	elif args.command == "use":
+		set_current(args.root, args.version)
+		print(json.dumps({"ok": True, "current": args.version}))
+
+
+if __name__ == "__main__":
+	main()
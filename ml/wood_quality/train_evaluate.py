@@ -1,15 +1,20 @@
 import argparse
+import json
 import os
-from typing import Dict, List, Tuple
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
 
 import joblib
+from joblib import Parallel, delayed
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from sklearn import config_context
 from sklearn.compose import ColumnTransformer
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, classification_report
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.neighbors import KNeighborsClassifier
@@ -18,6 +23,12 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.svm import SVC
 from sklearn.neural_network import MLPClassifier
 
+from benchmark import BATCH_SIZES, benchmark_models
+from compiled import compiled_path, export_pipeline, load_compiled
+from ensemble import Ensemble, ENSEMBLE_FILE
+from prototypes import compare_with_full, fit_prototype_knn
+from out_of_core import SUBSAMPLE_ROWS, WORKING_MEMORY_MB, fit_out_of_core, load_compact, peak_memory_mb, score_chunked, stratified_indices, widen
+
 RANDOM_STATE = 42
 
 
@@ -28,15 +39,16 @@ def load_data(csv_path: str) -> Tuple[pd.DataFrame, pd.Series]:
 	return X, y
 
 
-def build_preprocessor(X: pd.DataFrame) -> ColumnTransformer:
+def build_preprocessor(X: pd.DataFrame, sparse: bool = False) -> ColumnTransformer:
 	categorical_features = ["Vendor", "WoodType"]
 	numeric_features = [c for c in X.columns if c not in categorical_features]
 
 	preprocessor = ColumnTransformer(
 		transformers=[
-			("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), categorical_features),
+			("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=sparse), categorical_features),
 			("num", StandardScaler(), numeric_features),
-		]
+		],
+		sparse_threshold=1.0 if sparse else 0.3,
 	)
 	return preprocessor
 
@@ -51,22 +63,102 @@ def get_models() -> Dict[str, object]:
 	}
 
 
+def _fit(name: str, estimator, Xt: np.ndarray, y: pd.Series, knn_prototypes: bool):
+	# Returns (estimator, reference rows or None); see Ensemble.references
+	if name != "KNN":
+		return estimator.fit(Xt, y), None
+	if knn_prototypes:
+		# Condensed reference set so KNN cost follows the class boundaries, not the row count
+		return fit_prototype_knn(estimator, Xt, y, RANDOM_STATE)
+	y = np.asarray(y).astype(str)
+	return estimator.fit(Xt, y), (Xt, y)
+
+
+def fit_ensemble(
+	X_train: pd.DataFrame,
+	y_train: pd.Series,
+	estimators: Dict[str, object],
+	jobs: int = 1,
+	knn_prototypes: bool = False,
+) -> Ensemble:
+	# Fit the preprocessor once and train every estimator on the same transformed matrix,
+	# one worker process per estimator (the slowest one, SVM, bounds the wall time)
+	preprocessor = build_preprocessor(X_train)
+	Xt = preprocessor.fit_transform(X_train)
+	fitted = Parallel(n_jobs=jobs)(delayed(_fit)(name, est, Xt, y_train, knn_prototypes) for name, est in estimators.items())
+	return Ensemble.from_fitted({name: preprocessor for name in estimators}, dict(zip(estimators, fitted)))
+
+
+def _cv_fold(name: str, estimator, X: pd.DataFrame, y: pd.Series, train_idx: np.ndarray, test_idx: np.ndarray, fold: int, knn_prototypes: bool) -> Dict[str, Any]:
+	ensemble = fit_ensemble(X.iloc[train_idx], y.iloc[train_idx], {name: estimator}, knn_prototypes=knn_prototypes)
+	labels, _ = ensemble.score(X.iloc[test_idx])
+	metrics = score_labels(name, y.iloc[test_idx], labels[name])
+	metrics["fold"] = fold
+	return metrics
+
+
+def cross_validate(X: pd.DataFrame, y: pd.Series, folds: int, jobs: int = 1, knn_prototypes: bool = False) -> pd.DataFrame:
+	# Every (model, fold) pair is an independent task, so all of them share one worker pool
+	splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=RANDOM_STATE)
+	splits = list(splitter.split(X, y))
+	rows = Parallel(n_jobs=jobs)(
+		delayed(_cv_fold)(name, est, X, y, train_idx, test_idx, fold, knn_prototypes)
+		for name, est in get_models().items()
+		for fold, (train_idx, test_idx) in enumerate(splits)
+	)
+	df = pd.DataFrame(rows)
+	summary = df.drop(columns=["fold"]).groupby("model", sort=False).agg(["mean", "std"])
+	summary.columns = [f"{metric}_{stat}" for metric, stat in summary.columns]
+	return summary.reset_index()
+
+
+def save_ensemble(ensemble: Ensemble, out_dir: str) -> None:
+	os.makedirs(out_dir, exist_ok=True)
+	joblib.dump(ensemble.to_artifact(), os.path.join(out_dir, ENSEMBLE_FILE))
+	# Per-model pipelines are still written for tools that load them directly
+	for name, estimator in ensemble.models.items():
+		pipe = Pipeline(steps=[("preprocess", ensemble.preprocessors[name]), ("model", estimator)])
+		joblib.dump(pipe, os.path.join(out_dir, f"model_{name}.joblib"))
+
+
+def export_compiled(ensemble: Ensemble, out_dir: str, X_check: pd.DataFrame, tol: float = 1e-9) -> None:
+	# Write NumPy-only artifacts and check they reproduce sklearn on X_check
+	for name, estimator in ensemble.models.items():
+		Xt = ensemble.preprocessors[name].transform(X_check)
+		if hasattr(Xt, "toarray"):
+			Xt = Xt.toarray()
+		path = compiled_path(out_dir, name)
+		export_pipeline(ensemble.preprocessors[name], estimator, path)
+		pre, compiled = load_compiled(path)
+		Ct = pre.transform(X_check)
+		labels_ok = np.array_equal(compiled.predict(Ct), np.asarray(estimator.predict(Xt)).astype(str))
+		max_diff = float(np.max(np.abs(Ct - Xt)))
+		if hasattr(estimator, "predict_proba"):
+			max_diff = max(max_diff, float(np.max(np.abs(compiled.predict_proba(Ct) - estimator.predict_proba(Xt)))))
+		if not labels_ok or max_diff > tol:
+			os.remove(path)
+			raise RuntimeError(f"Compiled {name} does not match sklearn (labels_ok={labels_ok}, max_diff={max_diff:.3g})")
+		print(f"Compiled {name}: {os.path.getsize(path)} bytes, max |diff| vs sklearn = {max_diff:.3g}")
+
+
 def ensure_dirs(out_dir: str) -> Dict[str, str]:
 	plots_dir = os.path.join(out_dir, "plots")
 	os.makedirs(plots_dir, exist_ok=True)
 	return {"out": out_dir, "plots": plots_dir}
 
 
-def evaluate_model(name: str, model, X_test: np.ndarray, y_test: pd.Series) -> Dict[str, float]:
-	y_pred = model.predict(X_test)
-	metrics = {
+def score_labels(name: str, y_true: pd.Series, y_pred: np.ndarray) -> Dict[str, Any]:
+	return {
 		"model": name,
-		"accuracy": accuracy_score(y_test, y_pred),
-		"precision": precision_score(y_test, y_pred, average="macro", zero_division=0),
-		"recall": recall_score(y_test, y_pred, average="macro", zero_division=0),
-		"f1": f1_score(y_test, y_pred, average="macro", zero_division=0),
+		"accuracy": accuracy_score(y_true, y_pred),
+		"precision": precision_score(y_true, y_pred, average="macro", zero_division=0),
+		"recall": recall_score(y_true, y_pred, average="macro", zero_division=0),
+		"f1": f1_score(y_true, y_pred, average="macro", zero_division=0),
 	}
-	return metrics
+
+
+def evaluate_model(name: str, model, X_test: np.ndarray, y_test: pd.Series) -> Dict[str, float]:
+	return score_labels(name, y_test, model.predict(X_test))
 
 
 def plot_confusion(name: str, y_true: pd.Series, y_pred: np.ndarray, labels: List[str], save_path: str) -> None:
@@ -82,81 +174,179 @@ def plot_confusion(name: str, y_true: pd.Series, y_pred: np.ndarray, labels: Lis
 
 
 def plot_model_comparison(df_metrics: pd.DataFrame, save_path: str) -> None:
-	plt.figure(figsize=(7, 4))
 	order = df_metrics.sort_values("accuracy", ascending=False)["model"]
-	sns.barplot(data=df_metrics, x="model", y="accuracy", order=order, hue="model", palette="viridis", legend=False)
-	plt.ylim(0, 1)
-	plt.title("Model Accuracy Comparison")
-	plt.ylabel("Accuracy")
-	plt.xlabel("")
-	plt.tight_layout()
-	plt.savefig(save_path, dpi=150)
-	plt.close()
+	with_cost = "latency_p50_ms" in df_metrics.columns
+	fig, axes = plt.subplots(1, 2 if with_cost else 1, figsize=(12 if with_cost else 7, 4), squeeze=False)
+	ax = axes[0, 0]
+	sns.barplot(data=df_metrics, x="model", y="accuracy", order=order, hue="model", palette="viridis", legend=False, ax=ax)
+	ax.set_ylim(0, 1)
+	ax.set_title("Model Accuracy Comparison")
+	ax.set_ylabel("Accuracy")
+	ax.set_xlabel("")
+	if with_cost:
+		# Inference cost of the served artifacts, annotated with their size
+		ax = axes[0, 1]
+		cost = df_metrics.set_index("model").loc[order]
+		sns.barplot(data=df_metrics, x="model", y="latency_p50_ms", order=order, hue="model", palette="viridis", legend=False, ax=ax)
+		p50, p99 = cost["latency_p50_ms"].to_numpy(), cost["latency_p99_ms"].to_numpy()
+		ax.errorbar(range(len(order)), p50, yerr=[np.zeros(len(order)), p99 - p50], fmt="none", ecolor="black", capsize=4)
+		for i, (top, size_kb) in enumerate(zip(p99, cost["size_kb"])):
+			ax.annotate(f"{size_kb:.0f} KB", (i, top), ha="center", va="bottom", fontsize=8)
+		ax.set_title("Single-row Latency (p50, whisker to p99)")
+		ax.set_ylabel("ms")
+		ax.set_xlabel("")
+	fig.tight_layout()
+	fig.savefig(save_path, dpi=150)
+	plt.close(fig)
+
+
+def render_confusion_plots(plots_dir: str, y_test: pd.Series, test_labels: Dict[str, np.ndarray], labels: List[str]) -> None:
+	for name, y_pred in test_labels.items():
+		plot_confusion(name, y_test, y_pred, labels, os.path.join(plots_dir, f"confusion_matrix_{name}.png"))
+
+
+def knn_report(ensemble: Ensemble, X_train: pd.DataFrame, y_train: pd.Series, X_test: pd.DataFrame, y_test: pd.Series, out_of_core: bool) -> Dict[str, Any]:
+	# Compare the served prototype KNN with KNeighborsClassifier(5) on the reference rows it was reduced from
+	pre = ensemble.preprocessors["KNN"]
+	if out_of_core:
+		idx = stratified_indices(y_train, SUBSAMPLE_ROWS["KNN"], RANDOM_STATE)
+		X_ref, y_ref, X_eval = widen(X_train.iloc[idx]), y_train.iloc[idx], widen(X_test)
+	else:
+		X_ref, y_ref, X_eval = X_train, y_train, X_test
+	with config_context(working_memory=WORKING_MEMORY_MB):
+		report = compare_with_full(ensemble.models["KNN"], pre.transform(X_ref), y_ref, pre.transform(X_eval), y_test)
+	print(
+		f"KNN prototypes: {report['prototypes']} of {report['reference_rows']} rows, "
+		f"accuracy {report['accuracy_prototypes']:.4f} vs {report['accuracy_full']:.4f} with the full set "
+		f"({report['accuracy_diff']:+.4f}), {report['predict_us_per_row_prototypes']:.1f} vs {report['predict_us_per_row_full']:.1f} us/row"
+	)
+	return report
+
+
+def train_and_evaluate(
+	data_path: str,
+	out_dir: str,
+	jobs: int = 1,
+	cv: int = 0,
+	out_of_core: bool = False,
+	chunk_size: int = 100_000,
+	cache: bool = False,
+	epochs: int = 10,
+	bench: bool = True,
+	knn_prototypes: bool = False,
+) -> pd.DataFrame:
+	if out_of_core:
+		X, y = load_compact(data_path, chunk_size=chunk_size, cache=cache)
+	else:
+		X, y = load_data(data_path)
+	labels = sorted(str(v) for v in y.unique())
+
+	if out_of_core:
+		# Split row indices so the compact dtypes survive; labels become plain strings for scoring
+		train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.25, random_state=RANDOM_STATE, stratify=np.asarray(y))
+		X_train, y_train = X.iloc[train_idx], y.iloc[train_idx]
+		X_test, y_test = X.iloc[test_idx], y.iloc[test_idx].astype(str)
+	else:
+		X_train, X_test, y_train, y_test = train_test_split(
+			X, y, test_size=0.25, random_state=RANDOM_STATE, stratify=y
+		)
+
+	dirs = ensure_dirs(out_dir)
+
+	start = time.perf_counter()
+	if out_of_core:
+		ensemble = fit_out_of_core(
+			X_train, y_train, get_models(), build_preprocessor(X_train, sparse=True),
+			chunk_size=chunk_size, epochs=epochs, jobs=jobs, seed=RANDOM_STATE, knn_prototypes=knn_prototypes,
+		)
+	else:
+		ensemble = fit_ensemble(X_train, y_train, get_models(), jobs=jobs, knn_prototypes=knn_prototypes)
+	print(f"Trained {len(ensemble.models)} models on {len(X_train)} rows in {time.perf_counter() - start:.2f}s (jobs={jobs})")
+
+	# Evaluate with the same label rule used at prediction time
+	test_labels = score_chunked(ensemble, X_test, chunk_size)
+	df_metrics = pd.DataFrame([score_labels(name, y_test, y_pred) for name, y_pred in test_labels.items()])
+
+	# Plots render in a separate process while the artifacts are written
+	with ProcessPoolExecutor(max_workers=1) as plotter:
+		plots = plotter.submit(render_confusion_plots, dirs["plots"], y_test, test_labels, labels)
+
+		# Save models
+		save_ensemble(ensemble, dirs["out"])
+		# Out of core, the export is verified on a stratified sample instead of every row
+		X_check = widen(X.iloc[stratified_indices(y, 5_000, RANDOM_STATE)]) if out_of_core else X
+		with config_context(working_memory=WORKING_MEMORY_MB):
+			export_compiled(ensemble, dirs["out"], X_check)
+
+		# Classification reports (text)
+		for name, y_pred in test_labels.items():
+			report = classification_report(y_test, y_pred, labels=labels, zero_division=0)
+			report_path = os.path.join(dirs["out"], f"classification_report_{name}.txt")
+			with open(report_path, "w", encoding="utf-8") as f:
+				f.write(report)
+
+		if cv > 1 and out_of_core:
+			print("Skipping cross-validation: not supported with --out_of_core")
+		elif cv > 1:
+			start = time.perf_counter()
+			df_cv = cross_validate(X, y, cv, jobs=jobs, knn_prototypes=knn_prototypes)
+			cv_csv = os.path.join(dirs["out"], "cv_metrics.csv")
+			df_cv.to_csv(cv_csv, index=False)
+			print(f"Saved: {cv_csv} ({cv}-fold, {time.perf_counter() - start:.2f}s)")
+
+		if knn_prototypes and "KNN" in ensemble.models:
+			report_path = os.path.join(dirs["out"], "knn_prototypes.json")
+			with open(report_path, "w", encoding="utf-8") as f:
+				json.dump(knn_report(ensemble, X_train, y_train, X_test, y_test, out_of_core), f, indent=2)
+			print("Saved:", report_path)
+
+		# Benchmark once nothing else is running so the timings are not skewed
+		plots.result()
+		if bench:
+			X_bench = X_test.iloc[: max(BATCH_SIZES)]
+			df_cost = benchmark_models(dirs["out"], ensemble.names(), widen(X_bench) if out_of_core else X_bench)
+			df_metrics = df_metrics.merge(df_cost, on="model")
+
+		# Save metrics CSV
+		metrics_csv = os.path.join(dirs["out"], "metrics.csv")
+		df_metrics.to_csv(metrics_csv, index=False)
+		print("Saved:", metrics_csv)
+
+		plotter.submit(plot_model_comparison, df_metrics, os.path.join(dirs["plots"], "model_comparison.png")).result()
+	print("Saved plots to:", dirs["plots"])
+	peak = peak_memory_mb()
+	if peak["self"] is not None:
+		print(f"Peak memory: {peak['self']:.0f} MB (worker processes: {peak['children']:.0f} MB)")
+	return df_metrics
 
 
 def main() -> None:
 	parser = argparse.ArgumentParser(description="Train and evaluate wood quality classifiers")
 	parser.add_argument("--data", type=str, default="dataset.csv", help="Path to CSV dataset")
 	parser.add_argument("--out", type=str, default="results", help="Output directory for metrics and plots")
+	parser.add_argument("--jobs", type=int, default=-1, help="Worker processes for training and cross-validation (-1 = all cores)")
+	parser.add_argument("--cv", type=int, default=0, help="Also run k-fold cross-validation with this many folds (0 = off)")
+	parser.add_argument("--out_of_core", action="store_true", help="Chunked compact-dtype loading, sparse one-hot, streamed/subsampled fitting")
+	parser.add_argument("--chunk_size", type=int, default=100_000, help="Rows per chunk with --out_of_core")
+	parser.add_argument("--cache", action="store_true", help="With --out_of_core, keep a columnar .npy cache next to the CSV")
+	parser.add_argument("--epochs", type=int, default=10, help="Passes over the training set for the streamed MLP")
+	parser.add_argument("--knn_prototypes", action="store_true", help="Serve KNN from condensed prototypes instead of every training row")
+	parser.add_argument("--no_bench", action="store_true", help="Skip the inference size/latency/throughput benchmark")
+	parser.add_argument("--export_only", action="store_true", help="Only export NumPy-only artifacts from the models already in --out")
 	args = parser.parse_args()
 
-	X, y = load_data(args.data)
-	labels = sorted(y.unique())
+	if args.export_only:
+		from predict import load_models
 
-	preprocessor = build_preprocessor(X)
-	X_train, X_test, y_train, y_test = train_test_split(
-		X, y, test_size=0.25, random_state=RANDOM_STATE, stratify=y
-	)
+		X, _ = load_data(args.data)
+		export_compiled(load_models(args.out, backend="sklearn"), args.out, X)
+		return
 
-	dirs = ensure_dirs(args.out)
-
-	all_metrics: List[Dict[str, float]] = []
-	models = get_models()
-
-	for name, estimator in models.items():
-		pipe = Pipeline(steps=[
-			("preprocess", preprocessor),
-			("model", estimator),
-		])
-
-		pipe.fit(X_train, y_train)
-
-		# Save model
-		model_path = os.path.join(dirs["out"], f"model_{name}.joblib")
-		joblib.dump(pipe, model_path)
-
-		# Evaluate
-		y_pred = pipe.predict(X_test)
-		metrics = {
-			"model": name,
-			"accuracy": accuracy_score(y_test, y_pred),
-			"precision": precision_score(y_test, y_pred, average="macro", zero_division=0),
-			"recall": recall_score(y_test, y_pred, average="macro", zero_division=0),
-			"f1": f1_score(y_test, y_pred, average="macro", zero_division=0),
-		}
-		all_metrics.append(metrics)
-
-		# Confusion matrix plot
-		cm_path = os.path.join(dirs["plots"], f"confusion_matrix_{name}.png")
-		plot_confusion(name, y_test, y_pred, labels, cm_path)
-
-		# Classification report (text)
-		report = classification_report(y_test, y_pred, labels=labels, zero_division=0)
-		report_path = os.path.join(dirs["out"], f"classification_report_{name}.txt")
-		with open(report_path, "w", encoding="utf-8") as f:
-			f.write(report)
-
-	# Save metrics CSV
-	df_metrics = pd.DataFrame(all_metrics)
-	metrics_csv = os.path.join(dirs["out"], "metrics.csv")
-	df_metrics.to_csv(metrics_csv, index=False)
-
-	# Comparison plot
-	comparison_path = os.path.join(dirs["plots"], "model_comparison.png")
-	plot_model_comparison(df_metrics, comparison_path)
-
-	print("Saved:", metrics_csv)
-	print("Saved plots to:", dirs["plots"])
+	train_and_evaluate(
+		args.data, args.out, jobs=args.jobs, cv=args.cv,
+		out_of_core=args.out_of_core, chunk_size=args.chunk_size, cache=args.cache, epochs=args.epochs,
+		bench=not args.no_bench, knn_prototypes=args.knn_prototypes,
+	)
 
 
 if __name__ == "__main__":
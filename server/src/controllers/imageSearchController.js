@@ -209,7 +209,10 @@ export const searchByImage = async (req, res) => {
     }
 
     if (error.response) {
-      // FastAPI returned an error
+      // FastAPI returned an error; pass on Retry-After from its admission control (429/503)
+      if (error.response.headers?.['retry-after']) {
+        res.set('Retry-After', error.response.headers['retry-after']);
+      }
       console.error('FastAPI returned error:', {
         status: error.response.status,
         statusText: error.response.statusText,
@@ -308,7 +311,10 @@ export const searchByImageBase64 = async (req, res) => {
     }
 
     if (error.response) {
-      // FastAPI returned an error
+      // FastAPI returned an error; pass on Retry-After from its admission control (429/503)
+      if (error.response.headers?.['retry-after']) {
+        res.set('Retry-After', error.response.headers['retry-after']);
+      }
       return res.status(error.response.status || 500).json({
         success: false,
         message: error.response.data?.detail || 'Error processing image search',
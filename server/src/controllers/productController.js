@@ -645,11 +645,79 @@ export const removeProductImage = async (req, res) => {
   }
 };
 
+// Reindex pacing: FastAPI /add-product only queues a job (202) and answers 429/503 with
+// Retry-After when its ingest queue or admission limit is full
+const REINDEX_MAX_RETRIES = 5;
+const REINDEX_MAX_PENDING_JOBS = 100;
+const REINDEX_POLL_INTERVAL_MS = 2000;
+// Total time one reindex request waits for jobs; what is unfinished then is reported as queued
+const REINDEX_TIMEOUT_MS = 10 * 60 * 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// POST that retries 429/503, waiting for Retry-After (exponential backoff when it is missing)
+const postWithRetry = async (url, body, options) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, body, options);
+    } catch (error) {
+      const status = error.response?.status;
+      if ((status !== 429 && status !== 503) || attempt >= REINDEX_MAX_RETRIES) throw error;
+      const retryAfter = Number(error.response.headers?.['retry-after']);
+      const delay = retryAfter > 0 ? retryAfter * 1000 : Math.min(1000 * 2 ** attempt, 30000);
+      console.warn(`Image search busy (${status}), retrying in ${delay}ms`);
+      await sleep(delay);
+    }
+  }
+};
+
+// Poll queued ingest jobs until at most `keep` are unfinished (or the deadline passes),
+// moving finished ones from `pending` into the report. Jobs are polled oldest first and
+// each tick stops at the first job still queued: the worker takes jobs in FIFO order, so
+// the ones behind it cannot have finished yet.
+const waitForIngestJobs = async (FASTAPI_URL, pending, report, keep, deadline) => {
+  while (pending.size > keep && Date.now() < deadline) {
+    await sleep(REINDEX_POLL_INTERVAL_MS);
+    for (const [jobId, product] of pending) {
+      if (pending.size <= keep) break;
+      let job;
+      try {
+        ({ data: job } = await axios.get(`${FASTAPI_URL}/add-product/jobs/${jobId}`, { timeout: 10000 }));
+      } catch (pollErr) {
+        if (pollErr.response?.status === 404) {
+          // Expired from the service's job history (or the service restarted)
+          pending.delete(jobId);
+          report.unknown++;
+        }
+        continue;
+      }
+      if (job.status === 'done') {
+        report.indexed++;
+      } else if (job.status === 'superseded') {
+        // A newer job for the same product (e.g. an edit during the reindex) replaced it
+        report.superseded++;
+      } else if (job.status === 'failed') {
+        report.errors.push({ productId: product._id, productName: product.name, error: job.error || 'Indexing failed' });
+      } else if (job.status === 'queued') {
+        break;
+      } else {
+        continue;
+      }
+      pending.delete(jobId);
+    }
+  }
+};
+
 /**
  * Reindex all furniture products into the image search (Pinecone) service.
  * For each product: uses stored base64 when available, otherwise fetches image from URL
  * (Cloudinary or /api/images) and sends to FastAPI add-product.
  * Call this once to fix "same image from site not showing" when products were never indexed.
+ *
+ * add-product queues the indexing, so at most REINDEX_MAX_PENDING_JOBS jobs are kept
+ * unfinished at a time and each is polled until done; busy responses (429/503) are retried
+ * after their Retry-After. After REINDEX_TIMEOUT_MS the request stops waiting; the response
+ * reports indexed and still-queued products separately.
  */
 export const reindexImageSearch = async (req, res) => {
   const FASTAPI_URL = process.env.FASTAPI_URL || 'http://localhost:8000';
@@ -661,8 +729,10 @@ export const reindexImageSearch = async (req, res) => {
       isActive: true
     }).select('name category subcategory images').lean();
 
-    let reindexed = 0;
-    const errors = [];
+    const report = { submitted: 0, indexed: 0, superseded: 0, unknown: 0, errors: [] };
+    const errors = report.errors;
+    const pending = new Map(); // job ID -> product, in submission order
+    const deadline = Date.now() + REINDEX_TIMEOUT_MS;
 
     for (const product of products) {
       const images = product.images || [];
@@ -702,24 +772,40 @@ export const reindexImageSearch = async (req, res) => {
 
       if (imagesForPinecone.length === 0) continue;
 
+      await waitForIngestJobs(FASTAPI_URL, pending, report, REINDEX_MAX_PENDING_JOBS - 1, deadline);
+
       try {
-        await axios.post(`${FASTAPI_URL}/add-product`, {
+        const { data } = await postWithRetry(`${FASTAPI_URL}/add-product`, {
           product_id: product._id.toString(),
           product_name: product.name,
           category: product.category,
           subcategory: product.subcategory || '',
           images: imagesForPinecone
         }, { timeout: 30000 });
-        reindexed++;
-        console.log(`Reindexed image search for product: ${product.name} (${product._id})`);
+        report.submitted++;
+        if (data?.job_id) {
+          pending.set(data.job_id, product);
+          console.log(`Queued image search reindex for product: ${product.name} (${product._id}) as job ${data.job_id}`);
+        } else {
+          report.indexed++;
+        }
       } catch (apiErr) {
         errors.push({ productId: product._id, productName: product.name, error: apiErr.message });
       }
     }
 
+    await waitForIngestJobs(FASTAPI_URL, pending, report, 0, deadline);
+
+    const queued = pending.size;
     res.json({
-      message: `Reindexed ${reindexed} furniture products for image search`,
-      reindexed,
+      message: `Reindexed ${report.indexed} furniture products for image search`
+        + (queued > 0 ? `; ${queued} still queued` : ''),
+      reindexed: report.indexed,
+      submitted: report.submitted,
+      queued,
+      superseded: report.superseded,
+      unknown: report.unknown,
+      queuedJobIds: queued > 0 ? [...pending.keys()] : undefined,
       total: products.length,
       errors: errors.length > 0 ? errors : undefined
     });
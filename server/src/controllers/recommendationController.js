@@ -107,6 +107,8 @@ export const getSimilarProducts = async (req, res) => {
           const formData = new FormData();
           formData.append('image_base64', imageBase64);
           formData.append('top_k', topK.toString());
+          formData.append('aggregate', 'mean'); // one result per product, scored over all its photos
+          formData.append('use_centroids', 'true');
 
           console.log('Calling image search service for furniture KNN recommendations...');
 
@@ -115,7 +117,9 @@ export const getSimilarProducts = async (req, res) => {
             formData,
             {
               headers: {
-                ...formData.getHeaders()
+                ...formData.getHeaders(),
+                // Scheduled after customer image searches (see ml/image_matching/inference_scheduler.py)
+                'X-Request-Priority': 'recommendation'
               },
               timeout: 30000
             }
@@ -1,25 +1,6 @@
 import Vendor from "../models/Vendor.js";
 import WoodIntake from "../models/WoodIntake.js";
-import { spawn } from "child_process";
-import path from "path";
-import { fileURLToPath } from 'url';
-import fs from 'fs';
-
-const __filename = fileURLToPath(import.meta.url);
-const __dirname = path.dirname(__filename);
-const repoRoot = path.resolve(__dirname, "../../../");
-const pyScript = path.join(repoRoot, "ml", "wood_quality", "predict.py");
-const modelsDir = path.join(repoRoot, "ml", "wood_quality", "results");
-const datasetCsv = path.join(repoRoot, "ml", "wood_quality", "dataset.csv");
-
-function resolvePythonExecutable() {
-  if (process.env.PYTHON_EXECUTABLE) return process.env.PYTHON_EXECUTABLE;
-  const winPath = path.join(repoRoot, '.venv', 'Scripts', 'python.exe');
-  const nixPath = path.join(repoRoot, '.venv', 'bin', 'python');
-  if (process.platform === 'win32' && fs.existsSync(winPath)) return winPath;
-  if (fs.existsSync(nixPath)) return nixPath;
-  return 'python';
-}
+import { predictWoodQuality } from "../utils/woodQualityPredictor.js";
 
 // Create a new vendor
 export const createVendor = async (req, res) => {
@@ -187,31 +168,11 @@ export const deleteVendor = async (req, res) => {
   }
 };
 
-// Helper to invoke Python predictor
+// Helper to invoke the persistent Python predictor; the cascade computes the vote in Python
 async function runPrediction(payload) {
-  return new Promise((resolve, reject) => {
-    const pyExec = resolvePythonExecutable();
-    const py = spawn(pyExec, [pyScript, '--models_dir', modelsDir, '--data', datasetCsv], { cwd: repoRoot });
-    let stdout = '';
-    let stderr = '';
-    py.stdout.on('data', d => { stdout += d.toString(); });
-    py.stderr.on('data', d => { stderr += d.toString(); });
-    py.on('error', err => reject(new Error(`Python spawn error: ${err.message}`)));
-    py.on('close', code => {
-      if (code !== 0) {
-        return reject(new Error(`Python exited with code ${code}: ${stderr}`));
-      }
-      try {
-        const parsed = JSON.parse(stdout.trim());
-        if (!parsed.ok) return reject(new Error('Predictor returned not ok'));
-        resolve(parsed.results);
-      } catch (e) {
-        reject(new Error(`Invalid JSON from predictor: ${stdout}`));
-      }
-    });
-    py.stdin.write(JSON.stringify(payload));
-    py.stdin.end();
-  });
+  const parsed = await predictWoodQuality(payload, { mode: 'cascade' });
+  if (!parsed.ok) throw new Error(`Predictor returned not ok: ${parsed.error || 'unknown error'}`);
+  return parsed;
 }
 
 // Create wood intake
@@ -295,11 +256,10 @@ export const createWoodIntake = async (req, res) => {
     let mlResults = null;
     let predictedQuality = undefined;
     try {
-      mlResults = await runPrediction(payload);
-      // Majority vote across models; fallback to NeuralNet
-      const votes = Object.values(mlResults).map(r => r.prediction);
-      const counts = votes.reduce((acc, v) => { acc[v] = (acc[v]||0)+1; return acc; }, {});
-      predictedQuality = Object.entries(counts).sort((a,b)=>b[1]-a[1])[0]?.[0] || mlResults?.NeuralNet?.prediction;
+      const prediction = await runPrediction(payload);
+      // Results only contain the models the cascade actually ran
+      mlResults = prediction.results;
+      predictedQuality = prediction.vote;
     } catch (e) {
       console.warn('Prediction failed, continuing without predictedQuality:', e.message);
     }
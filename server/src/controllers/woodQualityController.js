@@ -9,7 +9,7 @@ const __dirname = path.dirname(__filename);
 const repoRoot = path.resolve(__dirname, "../../../");
 const mlDir = path.join(repoRoot, "ml", "wood_quality");
 const datasetCsv = path.join(mlDir, "dataset.csv");
-const trainerScript = path.join(mlDir, "train_evaluate.py");
+const registryScript = path.join(mlDir, "registry.py");
 
 function resolvePythonExecutable() {
   if (process.env.PYTHON_EXECUTABLE) return process.env.PYTHON_EXECUTABLE;
@@ -63,25 +63,37 @@ function exportToCsv(samples) {
   fs.writeFileSync(datasetCsv, lines.join('\n'), 'utf-8');
 }
 
-export const trainFromMongo = async (_req, res) => {
+export const trainFromMongo = async (req, res) => {
   try {
-    const samples = await WoodQualitySample.find();
+    // Oldest first so the export only ever appends rows, which lets the registry update incrementally
+    const samples = await WoodQualitySample.find().sort({ createdAt: 1, _id: 1 });
     if (!samples.length) {
       return res.status(400).json({ ok: false, message: 'No samples to train' });
     }
     exportToCsv(samples);
 
+    // Publish a new registry version; predictions keep serving the current one until it is published.
+    // "update" applies only the new rows and falls back to a full retrain past its drift/size thresholds.
+    const full = req.query.full === 'true' || req.body?.full === true;
     const pyExec = resolvePythonExecutable();
-    const py = spawn(pyExec, [trainerScript, '--data', datasetCsv, '--out', path.join(mlDir, 'results')], { cwd: repoRoot });
+    const py = spawn(pyExec, [registryScript, '--root', path.join(mlDir, 'results'), full ? 'train' : 'update', '--data', datasetCsv], { cwd: repoRoot });
     let stdout = '';
     let stderr = '';
     py.stdout.on('data', d => { stdout += d.toString(); });
     py.stderr.on('data', d => { stderr += d.toString(); });
     py.on('close', (code) => {
+      const lastLine = stdout.trim().split('\n').pop() || '{}';
+      let parsed = {};
+      try { parsed = JSON.parse(lastLine); } catch (_) { /* trainer output without a summary line */ }
+      if (code === 3) {
+        return res.status(409).json({ ok: false, message: parsed.message || 'A training job is already running' });
+      }
       if (code !== 0) {
         return res.status(500).json({ ok: false, message: 'Trainer failed', stderr });
       }
-      return res.json({ ok: true, message: 'Training complete', stdout });
+      const mode = parsed.metadata?.mode;
+      const message = mode === 'incremental' ? 'Incremental update complete' : mode === 'noop' ? 'No new samples' : 'Training complete';
+      return res.json({ ok: true, message, metadata: parsed.metadata, stdout });
     });
   } catch (e) {
     res.status(500).json({ ok: false, message: e.message });
@@ -0,0 +1,93 @@
+/**
+ * Long-running wood quality predictor.
+ * Keeps one `predict.py --serve` process alive so models are loaded once,
+ * and multiplexes JSON-line requests over its stdin/stdout by request id.
+ */
+import { spawn } from "child_process";
+import readline from "readline";
+import path from "path";
+import fs from "fs";
+import { fileURLToPath } from "url";
+
+const __filename = fileURLToPath(import.meta.url);
+const __dirname = path.dirname(__filename);
+const repoRoot = path.resolve(__dirname, "../../../");
+const pyScript = path.join(repoRoot, "ml", "wood_quality", "predict.py");
+const modelsDir = path.join(repoRoot, "ml", "wood_quality", "results");
+const datasetCsv = path.join(repoRoot, "ml", "wood_quality", "dataset.csv");
+
+const REQUEST_TIMEOUT_MS = parseInt(process.env.WOOD_QUALITY_TIMEOUT_MS || "60000", 10);
+
+let worker = null;
+let nextId = 1;
+const pending = new Map();
+
+export function resolvePythonExecutable() {
+  if (process.env.PYTHON_EXECUTABLE) return process.env.PYTHON_EXECUTABLE;
+  const winPath = path.join(repoRoot, '.venv', 'Scripts', 'python.exe');
+  const nixPath = path.join(repoRoot, '.venv', 'bin', 'python');
+  if (process.platform === 'win32' && fs.existsSync(winPath)) return winPath;
+  if (fs.existsSync(nixPath)) return nixPath;
+  return 'python';
+}
+
+function failPending(error) {
+  for (const { reject, timer } of pending.values()) {
+    clearTimeout(timer);
+    reject(error);
+  }
+  pending.clear();
+}
+
+function startWorker() {
+  const py = spawn(resolvePythonExecutable(), [pyScript, '--models_dir', modelsDir, '--data', datasetCsv, '--serve'], { cwd: repoRoot });
+
+  readline.createInterface({ input: py.stdout }).on('line', (line) => {
+    let parsed;
+    try {
+      parsed = JSON.parse(line);
+    } catch (e) {
+      console.warn('Wood quality predictor emitted invalid JSON:', line);
+      return;
+    }
+    const entry = pending.get(parsed.id);
+    if (!entry) return;
+    pending.delete(parsed.id);
+    clearTimeout(entry.timer);
+    entry.resolve(parsed);
+  });
+
+  // Forward Python debug output to the server console
+  py.stderr.on('data', d => process.stderr.write(d.toString()));
+
+  py.on('error', (err) => {
+    if (worker === py) worker = null;
+    failPending(new Error(`Python spawn error: ${err.message}`));
+  });
+
+  py.on('close', (code) => {
+    if (worker === py) worker = null;
+    failPending(new Error(`Python predictor exited with code ${code}`));
+  });
+
+  return py;
+}
+
+/**
+ * Score one intake payload. Resolves with the predictor response
+ * `{ ok, results, latency_ms }` (or `{ ok: false, error }`).
+ * With `{ mode: 'cascade' }` the cheap models run first and the response also carries
+ * `vote`, `confidence` and `models_executed`; `threshold` overrides the early-exit confidence.
+ */
+export function predictWoodQuality(payload, options = {}) {
+  if (!worker) worker = startWorker();
+  const id = nextId++;
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      pending.delete(id);
+      reject(new Error(`Wood quality prediction timed out after ${REQUEST_TIMEOUT_MS}ms`));
+    }, REQUEST_TIMEOUT_MS);
+    pending.set(id, { resolve, reject, timer });
+    worker.stdin.write(JSON.stringify({ id, payload, ...options }) + '\n');
+  });
+}